@@ -0,0 +1,81 @@
+"""
+地块要素的流式读取
+
+出图只需要地块的fid、几何以及地块图层样式用到的字段. 用精简的QgsFeatureRequest按fid分批读取,
+每批最多chunk_size个地块, 每个地块只读取一次, 地块数很多时内存占用也不随之增长.
+"""
+import itertools
+
+from qgis._core import QgsFeatureRequest, QgsRenderContext
+
+
+def block_ids(block_layer):
+    """只读取fid, 不读取几何和属性"""
+    request = QgsFeatureRequest().setNoAttributes().setFlags(QgsFeatureRequest.Flag.NoGeometry)
+    return [feature.id() for feature in block_layer.getFeatures(request)]
+
+
+def used_attributes(block_layer):
+    """地块图层符号化用到的字段名; 有标注时返回None, 读取全部字段"""
+    if block_layer.labelsEnabled() and block_layer.labeling() is not None:
+        return None
+    if block_layer.renderer() is None:
+        return []
+    return list(block_layer.renderer().usedAttributes(QgsRenderContext()))
+
+
+class block_stream:
+    # 每批读取的地块数
+    chunk_size = 1000
+
+    def __init__(self, block_layer, timer=None, chunk_size=None):
+        self.block_layer = block_layer
+        self.timer = timer
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.attributes = used_attributes(block_layer)
+
+    def request(self):
+        request = QgsFeatureRequest()
+        if self.attributes is not None:
+            if len(self.attributes) == 0:
+                request.setNoAttributes()
+            else:
+                request.setSubsetOfAttributes(self.attributes, self.block_layer.fields())
+        return request
+
+    def blocks(self, fids=None):
+        """
+        依次返回(fid, 要素), fids中不存在的地块要素为None; fids为None时按图层顺序返回全部地块.
+        读取每批要素的时间记入timer的fetch阶段.
+        """
+        if fids is None:
+            iterator = self.block_layer.getFeatures(self.request())
+            while True:
+                chunk = self._fetch(lambda: list(itertools.islice(iterator, self.chunk_size)))
+                if len(chunk) == 0:
+                    return
+                for feature in chunk:
+                    yield feature.id(), feature
+
+        fid_iterator = iter(fids)
+        while True:
+            chunk_ids = list(itertools.islice(fid_iterator, self.chunk_size))
+            if len(chunk_ids) == 0:
+                return
+            request = self.request().setFilterFids(chunk_ids)
+            features = self._fetch(lambda: {feature.id(): feature for feature in self.block_layer.getFeatures(request)})
+            for fea_id in chunk_ids:
+                yield fea_id, features.get(fea_id)
+
+    def get(self, fea_id):
+        """单个地块, 不存在时返回None"""
+        for _, feature in self.blocks([fea_id]):
+            return feature
+        return None
+
+    def _fetch(self, read):
+        if self.timer is None:
+            return read()
+        with self.timer.batch_stage("fetch"):
+            return read()
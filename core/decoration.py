@@ -0,0 +1,55 @@
+import collections
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QPainter
+
+
+class decoration_cache:
+    """
+    预先栅格化的装饰元素.
+    与地块无关的元素(指北针、比例尺框架、图例)按输出分辨率只绘制一次, 之后直接叠加到每张输出图片上;
+    随范围变化的部分通过key区分, 例如比例尺的段长和图例过滤后的内容, key变化时才重新绘制.
+    """
+
+    def __init__(self, dpi, max_entries=16):
+        self.dots_per_meter = int(round(dpi / 0.0254))
+        self.max_entries = max_entries
+        self.images = collections.OrderedDict()
+
+    def get(self, key, size, draw) -> QImage:
+        """
+        Args:
+            key: 缓存键, 决定装饰元素内容的全部参数
+            size: 栅格化的图片大小QSize, 或者未命中缓存时才调用的size()
+            draw: draw(painter)在透明图片上绘制装饰元素
+
+        Returns:
+            QImage: 已栅格化的装饰元素
+        """
+        if key in self.images:
+            self.images.move_to_end(key)
+            return self.images[key]
+
+        if callable(size):
+            size = size()
+        image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+        image.setDotsPerMeterX(self.dots_per_meter)
+        image.setDotsPerMeterY(self.dots_per_meter)
+        image.fill(Qt.transparent)
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing, True)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        painter.setRenderHint(QPainter.TextAntialiasing, True)
+        try:
+            draw(painter)
+        finally:
+            painter.end()
+
+        self.images[key] = image
+        if len(self.images) > self.max_entries:
+            self.images.popitem(last=False)
+        return image
+
+    def clear(self):
+        self.images.clear()
@@ -0,0 +1,366 @@
+import math
+import os.path
+
+from PyQt5.QtCore import QSize, QRectF, QPointF, Qt
+from PyQt5.QtGui import QImage, QPainter, QColor, QFont, QPen, QFontMetricsF
+from PyQt5.QtSvg import QSvgRenderer
+from qgis._core import QgsMapSettings, QgsMapRendererParallelJob, QgsApplication, QgsLayerTree, QgsLayerTreeModel, \
+    QgsLegendSettings, QgsLegendStyle, QgsLegendRenderer, QgsRenderContext, QgsExpressionContext, \
+    QgsExpressionContextUtils, QgsRectangle
+
+from ..utils import IconDir, DefaultFont
+from .decoration import decoration_cache
+from .export import block_renderer
+from .pipeline import encoder_options
+from .strips import write_strips
+
+# 直接出图支持的栅格格式, pdf仍然通过版面导出
+DIRECT_FORMATS = ["png", "jpg", "bmp", "tif", "webp"]
+
+
+def mm_to_pixel(mm, dpi):
+    return mm * dpi / 25.4
+
+
+def pt_to_pixel(pt, dpi):
+    return pt * dpi / 72
+
+
+def strip_extent(extent: QgsRectangle, map_units_per_pixel, y, rows, overlap) -> QgsRectangle:
+    """
+    条带的地图范围: 从整张图片第y行开始的rows行, 上下各多overlap行.
+    相邻条带的范围重叠2*overlap行, 去掉重叠部分后正好拼成整张图片
+    """
+    return QgsRectangle(extent.xMinimum(), extent.yMaximum() - (y + rows + overlap) * map_units_per_pixel,
+                        extent.xMaximum(), extent.yMaximum() - (y - overlap) * map_units_per_pixel)
+
+
+class direct_renderer(block_renderer):
+    """
+    栅格格式跳过打印版面, 用QgsMapRendererParallelJob直接渲染地图,
+    再用QPainter在同一张可复用的QImage上绘制圆圈、指北针、比例尺和图例.
+    元素的位置和大小与版面出图保持一致.
+    """
+
+    # 分条渲染时条带上下各多渲染的像素, 减少条带边缘的标注被截断或者位置不一致
+    strip_overlap = 128
+
+    def __init__(self, project, block_layer, config, checked_layer_ids, init_extent=None, tile_cache=None):
+        super(direct_renderer, self).__init__(project, block_layer, config, checked_layer_ids, init_extent, tile_cache)
+
+        self.dots_per_meter = int(round(config.out_resolution / 0.0254))
+        # 分条渲染时每个条带单独分配, 不分配整张图片
+        self.image = None
+        if self.strips is None:
+            self.image = self.new_image(QSize(config.out_width, config.out_height))
+
+        self.north_svg = None
+        if config.draw_northarrow:
+            north_path = os.path.join(IconDir, "north_arrow.svg")
+            if not os.path.exists(north_path):
+                north_path = os.path.join(QgsApplication.prefixPath(), "svg", "arrows", "NorthArrow_10.svg")
+            if os.path.exists(north_path):
+                self.north_svg = QSvgRenderer(north_path)
+
+        self.legend_root = None
+        self.legend_model = None
+        if config.draw_legend:
+            self.build_legend()
+
+        # 缓存的装饰图层和输出图片一样大, 分条渲染时不使用
+        self.decorations = None
+        if config.decoration_cache and self.strips is None:
+            self.decorations = decoration_cache(config.out_resolution)
+
+    def render(self, fea_id, feature=None) -> bool:
+        if self.config.out_format not in DIRECT_FORMATS:
+            return super(direct_renderer, self).render(fea_id, feature)
+
+        self.timer.begin(fea_id)
+        try:
+            return self.render_block(fea_id, feature)
+        finally:
+            self.timer.end()
+
+    def render_block(self, fea_id, feature=None) -> bool:
+        with self.timer.stage("query"):
+            if feature is None:
+                feature = self.blocks.get(fea_id)
+            if feature is None or not feature.isValid():
+                return False
+            self.overlay.set_feature(feature)
+
+        with self.timer.stage("update"):
+            centroid = self.block_center(feature)
+            settings = self.block_map_settings(centroid)
+            self.block_info = self.make_block_info(settings.visibleExtent(), centroid)
+        self.sample_layer_times(settings)
+
+        out_format = self.config.out_format
+        out_file = os.path.join(self.config.out_path, out_format, f"out_{fea_id}.{out_format}")
+        if self.strips is not None:
+            self.render_strips(settings, centroid, out_file)
+            with self.timer.stage("project"):
+                self.write_project(fea_id)
+            return True
+
+        self.image.fill(Qt.white)
+        painter = self.begin_painter(self.image)
+        try:
+            with self.timer.stage("map"):
+                self.draw_map(painter, settings)
+            with self.timer.stage("decorations"):
+                self.draw_decorations(painter, settings, centroid)
+        finally:
+            painter.end()
+
+        with self.timer.stage("project"):
+            self.write_project(fea_id)
+
+        # 输出图片整批复用, 交给写出线程前复制一份
+        with self.timer.stage("write"):
+            self.image_writer.submit(self.image.copy(), out_file, out_format, fea_id)
+        return True
+
+    def render_strips(self, settings: QgsMapSettings, centroid, out_file):
+        """
+        按条带渲染并流式写出. 每个条带单独渲染地图, 上下各多渲染strip_overlap像素,
+        装饰元素按整张图片的坐标平移后绘制, 超出条带的部分被裁掉.
+        """
+        extent = settings.visibleExtent()
+        mupp = settings.mapUnitsPerPixel()
+        width = self.config.out_width
+        overlap = self.strip_overlap
+
+        def render_strip(y, rows):
+            strip_settings = self.map_settings(strip_extent(extent, mupp, y, rows, overlap),
+                                               size=QSize(width, rows + 2 * overlap))
+
+            image = self.new_image(QSize(width, rows))
+            image.fill(Qt.white)
+            painter = self.begin_painter(image)
+            try:
+                painter.translate(0, -overlap)
+                with self.timer.stage("map"):
+                    self.draw_map(painter, strip_settings)
+                painter.translate(0, overlap - y)
+                with self.timer.stage("decorations"):
+                    self.draw_decorations(painter, settings, centroid)
+            finally:
+                painter.end()
+            return image
+
+        write_strips(out_file, self.config.out_format, width, self.config.out_height, encoder_options(self.config),
+                     self.config.out_resolution, self.strips, render_strip)
+
+    def new_image(self, size: QSize) -> QImage:
+        image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+        image.setDotsPerMeterX(self.dots_per_meter)
+        image.setDotsPerMeterY(self.dots_per_meter)
+        return image
+
+    @staticmethod
+    def begin_painter(image: QImage) -> QPainter:
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing, True)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        painter.setRenderHint(QPainter.TextAntialiasing, True)
+        return painter
+
+    def release_caches(self):
+        super(direct_renderer, self).release_caches()
+        if self.decorations is not None:
+            self.decorations.clear()
+
+    def block_map_settings(self, centroid):
+        return self.map_settings(self.block_extent(centroid))
+
+    def draw_map(self, painter: QPainter, settings: QgsMapSettings):
+        job = QgsMapRendererParallelJob(settings)
+        job.start()
+        job.waitForFinished()
+        painter.drawImage(0, 0, job.renderedImage())
+
+    def map_settings(self, extent, layers=None, size=None):
+        settings = QgsMapSettings()
+        settings.setLayers(self.overlay.map_layers(self.project) if layers is None else layers)
+        settings.setDestinationCrs(self.project.crs())
+        settings.setTransformContext(self.project.transformContext())
+        settings.setEllipsoid(self.project.ellipsoid())
+        settings.setLabelingEngineSettings(self.project.labelingEngineSettings())
+        settings.setOutputSize(QSize(self.config.out_width, self.config.out_height) if size is None else size)
+        settings.setOutputDpi(self.config.out_resolution)
+        settings.setBackgroundColor(QColor(255, 255, 255, 0))
+        settings.setFlag(QgsMapSettings.Flag.DrawSelection, False)
+        settings.setExtent(extent)
+
+        context = QgsExpressionContext()
+        context.appendScope(QgsExpressionContextUtils.globalScope())
+        context.appendScope(QgsExpressionContextUtils.projectScope(self.project))
+        context.appendScope(QgsExpressionContextUtils.mapSettingsScope(settings))
+        settings.setExpressionContext(context)
+        return settings
+
+    def draw_decorations(self, painter: QPainter, settings: QgsMapSettings, centroid):
+        if self.config.draw_circle:
+            self.draw_circle(painter, settings, centroid)
+        if self.legend_model is not None:
+            self.update_legend_filter(settings)
+
+        if self.decorations is None:
+            self.draw_static_decorations(painter, settings)
+            if self.legend_model is not None:
+                self.draw_legend(painter, settings)
+            return
+
+        # 指北针和比例尺整批不变, 只有比例尺段长(像素)变化时才重新栅格化
+        if self.north_svg is not None or self.config.draw_scalebar:
+            key = ("static", round(self.segment_pixels(settings), 3))
+            overlay = self.decorations.get(key, self.image.size(),
+                                           lambda p: self.draw_static_decorations(p, settings))
+            painter.drawImage(0, 0, overlay)
+
+        # 图例位于左上角, 按过滤后的图例内容缓存
+        if self.legend_model is not None:
+            key = ("legend", self.legend_signature())
+            overlay = self.decorations.get(key, lambda: self.legend_size(painter, settings),
+                                           lambda p: self.draw_legend(p, settings))
+            painter.drawImage(0, 0, overlay)
+
+    def draw_static_decorations(self, painter: QPainter, settings: QgsMapSettings):
+        if self.north_svg is not None:
+            self.draw_northarrow(painter)
+        if self.config.draw_scalebar:
+            self.draw_scalebar(painter, settings)
+
+    def draw_circle(self, painter: QPainter, settings: QgsMapSettings, centroid):
+        center = settings.mapToPixel().transform(centroid).toQPointF()
+        radius = self.convert_distance(self.config.radius) / settings.mapUnitsPerPixel()
+
+        pen = QPen(QColor(64, 64, 64, 77))
+        pen.setWidthF(5)
+        pen.setStyle(Qt.DotLine)
+        painter.save()
+        painter.setPen(pen)
+        painter.setBrush(Qt.NoBrush)
+        painter.drawEllipse(center, radius, radius)
+        painter.restore()
+
+    def northarrow_rect(self):
+        out_width = self.config.out_width
+        out_height = self.config.out_height
+        box_width = 20 if out_width / 10 < 20 else int(out_width / 10)
+        box_height = 20 if out_height / 10 < 20 else int(out_height / 10)
+
+        # 与QgsLayoutItemPicture的Zoom模式一致: 保持宽高比, 靠左上角
+        svg_size = self.north_svg.defaultSize()
+        ratio = min(box_width / svg_size.width(), box_height / svg_size.height())
+        return QRectF(int(17 * out_width / 19), int(2 * out_height / 19),
+                      svg_size.width() * ratio, svg_size.height() * ratio)
+
+    def draw_northarrow(self, painter: QPainter):
+        self.north_svg.render(painter, self.northarrow_rect())
+
+    def scalebar_labels(self):
+        segment = int(self.config.radius / 4)
+        return ["0", f"{segment}", f"{segment * 2} 米"]
+
+    def segment_pixels(self, settings: QgsMapSettings):
+        segment = int(self.config.radius / 4)
+        return self.convert_distance(segment) / settings.mapUnitsPerPixel()
+
+    def draw_scalebar(self, painter: QPainter, settings: QgsMapSettings):
+        """按版面中Line Ticks Up样式绘制两段比例尺"""
+        dpi = self.config.out_resolution
+        segment_px = self.segment_pixels(settings)
+        tick_px = mm_to_pixel(self.config.out_height / 500, dpi)
+        label_space_px = mm_to_pixel(1, dpi)
+
+        font = QFont(DefaultFont)
+        font.setPixelSize(max(1, int(round(pt_to_pixel(self.scalebar_size, dpi)))))
+        metrics = QFontMetricsF(font)
+
+        left = int(1 * self.config.out_width / 19)
+        top = int(16 * self.config.out_height / 19)
+        baseline_y = top + metrics.height() + label_space_px + tick_px
+
+        pen = QPen(QColor(0, 0, 0))
+        pen.setWidthF(mm_to_pixel(0.3, dpi))
+        pen.setCapStyle(Qt.SquareCap)
+        painter.save()
+        painter.setPen(pen)
+        painter.drawLine(QPointF(left, baseline_y), QPointF(left + 2 * segment_px, baseline_y))
+        for i in range(3):
+            x = left + i * segment_px
+            painter.drawLine(QPointF(x, baseline_y), QPointF(x, baseline_y - tick_px))
+
+        painter.setFont(font)
+        for i, label in enumerate(self.scalebar_labels()):
+            x = left + i * segment_px
+            # 最后一个标注带单位, 和版面一样以数字居中
+            number_width = metrics.horizontalAdvance(label.split(" ")[0])
+            painter.drawText(QPointF(x - number_width / 2, top + metrics.ascent()), label)
+        painter.restore()
+
+    def build_legend(self):
+        """图例只保留轨道站点和POI两个图层, 顺序与图层树一致"""
+        checked = {layer_id: name for name, layer_id in self.checked_layer_ids.items()}
+        self.legend_root = QgsLayerTree()
+        for tree_layer in self.project.layerTreeRoot().findLayers():
+            if tree_layer.layerId() not in checked:
+                continue
+            node = self.legend_root.addLayer(tree_layer.layer())
+            node.setCustomProperty("legend/title-label", checked[tree_layer.layerId()])
+            if checked[tree_layer.layerId()] == "POI":
+                QgsLegendRenderer.setNodeLegendStyle(node, QgsLegendStyle.Style.Hidden)
+        self.legend_model = QgsLayerTreeModel(self.legend_root)
+
+        self.legend_settings = QgsLegendSettings()
+        self.legend_settings.setTitle("图例")
+        title_font = QFont(DefaultFont, self.legend_title_size)
+        title_font.setBold(True)
+        self.legend_settings.rstyle(QgsLegendStyle.Style.Title).setFont(title_font)
+        self.legend_settings.rstyle(QgsLegendStyle.Style.SymbolLabel).setFont(
+            QFont(DefaultFont, self.legend_label_size, 1, False))
+        self.legend_settings.rstyle(QgsLegendStyle.Style.Symbol).setMargin(QgsLegendStyle.Side.Top, 0.3)
+        self.legend_settings.rstyle(QgsLegendStyle.Style.Title).setMargin(QgsLegendStyle.Side.Bottom, 1)
+
+    def update_legend_filter(self, settings: QgsMapSettings):
+        with self.timer.stage("legend"):
+            if self.legend_index is not None:
+                self.legend_index.apply(self.legend_model, settings.visibleExtent())
+            else:
+                self.legend_model.setLegendFilterByMap(settings)
+
+    def legend_signature(self):
+        """过滤后各图层显示的图例项, 内容相同的图例可以复用"""
+        signature = []
+        for node in self.legend_root.findLayers():
+            legend_nodes = self.legend_model.layerLegendNodes(node)
+            signature.append((node.layerId(), tuple(n.data(Qt.DisplayRole) for n in legend_nodes)))
+        return tuple(signature)
+
+    def legend_context(self, painter: QPainter, settings: QgsMapSettings):
+        context = QgsRenderContext.fromQPainter(painter)
+        context.setRendererScale(settings.scale())
+        context.setMapToPixel(settings.mapToPixel())
+        context.setFlag(QgsRenderContext.Flag.Antialiasing, True)
+        return context
+
+    def legend_size(self, painter: QPainter, settings: QgsMapSettings):
+        context = self.legend_context(painter, settings)
+        size = QgsLegendRenderer(self.legend_model, self.legend_settings).minimumSize(context)
+        scale = context.scaleFactor()
+        return QSize(int(math.ceil(size.width() * scale)), int(math.ceil(size.height() * scale)))
+
+    def draw_legend(self, painter: QPainter, settings: QgsMapSettings):
+        context = self.legend_context(painter, settings)
+        legend = QgsLegendRenderer(self.legend_model, self.legend_settings)
+        size = legend.minimumSize(context)
+        scale = context.scaleFactor()
+
+        # 与版面中的图例一样位于左上角, 半透明白色背景
+        painter.save()
+        painter.fillRect(QRectF(0, 0, size.width() * scale, size.height() * scale), QColor(255, 255, 255, 153))
+        legend.drawLegend(context)
+        painter.restore()
@@ -1,10 +1,13 @@
+import dataclasses
 import math
 import os.path
 import random
+import shutil
+import tempfile
 import time
 import traceback
 
-from PyQt5.QtCore import QTimer, QSize, QSizeF, QPoint, Qt, QPointF, QEvent
+from PyQt5.QtCore import QTimer, QSize, QSizeF, QPoint, Qt, QPointF, QEvent, QRectF
 from PyQt5.QtGui import QPainter, QImage, QColor, QFont, QTextFormat
 from PyQt5.QtWidgets import QMessageBox
 from osgeo.osr import SpatialReference
@@ -20,6 +23,21 @@ from qgis._gui import QgisInterface
 
 from ..utils import get_qset_name, get_field_index_no_case, default_field, ExportDir, epsg_code, PluginConfig, \
     MESSAGE_TAG, IconDir, DefaultFont, default_scalebar_size, default_diag
+from .blocks import block_stream, block_ids
+from .legend_index import legend_presence_index
+from .manifest import export_manifest
+from .memory import memory_monitor
+from .overlay import block_overlay_layer
+from .pdf_batch import block_page_iterator, merge_available, merge_pdfs, part_name, pdf_export_settings, \
+    split_underlay_layers, PDF_BATCH_NAME
+from .pipeline import image_writer, encoder_options
+from .profiling import block_profiler
+from .project_files import project_file_writer
+from .strips import strip_rows, write_strips, STRIP_FORMATS, PALETTE_STRIPS_ERROR
+from .tile_cache import tile_prefetcher, cache_layer
+from .telemetry import export_telemetry
+from .timing import stage_timer
+from .worker import export_worker_pool
 
 
 # class escapeEventFilter(QtCore.QObject):
@@ -46,6 +64,12 @@ class bacth_export(QgsTask):
         iface.mainWindow().keyPressed.connect(self.key_pressed)
         iface.mapCanvas().keyPressed.connect(self.key_pressed)
         self.exception = None
+        self.manifest = None
+        # 预取的底图瓦片{XYZ图层id: MBTiles路径}
+        self.tile_cache = {}
+        self.timer = stage_timer()
+        self.telemetry = None
+        self.base_description = description
 
         self.config = PluginConfig(
             key=self.qset.value(get_qset_name("key")),
@@ -63,7 +87,34 @@ class bacth_export(QgsTask):
             draw_northarrow=self.qset.value(get_qset_name("draw_northarrow"), type=int),
             draw_scalebar=self.qset.value(get_qset_name("draw_scalebar"), type=int),
             draw_legend=self.qset.value(get_qset_name("draw_legend"), type=int),
-            radius=self.qset.value(get_qset_name("radius"), type=float)
+            radius=self.qset.value(get_qset_name("radius"), type=float),
+            export_workers=self.qset.value(get_qset_name("export_workers"), 1, type=int),
+            layout_template=self.qset.value(get_qset_name("layout_template"), True, type=bool),
+            project_files=self.qset.value(get_qset_name("project_files"), "full", type=str),
+            export_engine=self.qset.value(get_qset_name("export_engine"), "layout", type=str),
+            decoration_cache=self.qset.value(get_qset_name("decoration_cache"), True, type=bool),
+            legend_index=self.qset.value(get_qset_name("legend_index"), True, type=bool),
+            tile_prefetch=self.qset.value(get_qset_name("tile_prefetch"), False, type=bool),
+            tile_workers=self.qset.value(get_qset_name("tile_workers"), 8, type=int),
+            mosaic_poi=self.qset.value(get_qset_name("mosaic_poi"), False, type=bool),
+            incremental=self.qset.value(get_qset_name("incremental"), False, type=bool),
+            encode_workers=self.qset.value(get_qset_name("encode_workers"), 2, type=int),
+            pdf_single=self.qset.value(get_qset_name("pdf_single"), False, type=bool),
+            pdf_hybrid=self.qset.value(get_qset_name("pdf_hybrid"), False, type=bool),
+            pdf_raster_dpi=self.qset.value(get_qset_name("pdf_raster_dpi"), 150, type=int),
+            encoder_preset=self.qset.value(get_qset_name("encoder_preset"), "balanced", type=str),
+            png_compression=self.qset.value(get_qset_name("png_compression"), 4, type=int),
+            png_palette=self.qset.value(get_qset_name("png_palette"), False, type=bool),
+            jpg_quality=self.qset.value(get_qset_name("jpg_quality"), 90, type=int),
+            jpg_progressive=self.qset.value(get_qset_name("jpg_progressive"), False, type=bool),
+            webp_quality=self.qset.value(get_qset_name("webp_quality"), 100, type=int),
+            tif_compress=self.qset.value(get_qset_name("tif_compress"), "LZW", type=str),
+            strip_memory_mb=self.qset.value(get_qset_name("strip_memory_mb"), 512, type=int),
+            layer_timing_every=self.qset.value(get_qset_name("layer_timing_every"), 0, type=int),
+            profile_every=self.qset.value(get_qset_name("profile_every"), 0, type=int),
+            profile_sample_ms=self.qset.value(get_qset_name("profile_sample_ms"), 0, type=int),
+            memory_warn_kb=self.qset.value(get_qset_name("memory_warn_kb"), 512, type=int),
+            cleanup_every=self.qset.value(get_qset_name("cleanup_every"), 0, type=int)
         )
 
     def key_pressed(self, event):
@@ -71,24 +122,6 @@ class bacth_export(QgsTask):
             self.cancel()
 
     def run(self):
-        out_width = self.config.out_width
-        out_height = self.config.out_height
-        out_resolution = self.config.out_resolution
-        out_format = self.config.out_format
-        draw_circle = self.config.draw_circle
-        draw_northarrow = self.config.draw_northarrow
-        draw_scalebar = self.config.draw_scalebar
-        draw_legend = self.config.draw_legend
-        radius = self.config.radius
-        out_path = os.path.join(self.config.out_path)
-
-        out_diag = math.sqrt(out_width ** 2 + out_height ** 2)
-        scalebar_size = int(out_diag * default_scalebar_size * 72 / out_resolution)
-        legend_title_size = int(scalebar_size * 1.5)
-        legend_label_size = int(legend_title_size * 0.8)
-        # QgsMessageLog.logMessage("大小:{}".format(scalebar_size), tag="Plugins",
-        #                          level=Qgis.MessageLevel.Info)
-
         try:
             metro_station_layer_id = self.qset.value(get_qset_name("metro_station_layer_id"))
             poi_layer_id = self.qset.value(get_qset_name("poi_layer_id"))
@@ -97,222 +130,263 @@ class bacth_export(QgsTask):
                 "POI": poi_layer_id
             }
 
-            lyrsToRemove = [l for l in self.project.mapLayers() if l not in list(checked_layer_ids.values())]
-
-            # QgsMessageLog.logMessage(str(self.project.mapLayers()), tag="Plugins",
-            #                          level=Qgis.MessageLevel.Info)
-
-            circle_symbol_layer = QgsSimpleFillSymbolLayer.create({
-                'outline_color': "64,64,64,77",
-                'color': '0,0,0,0',
-                'outline_style': 'dot',
-                'outline_width': "5",
-                'outline_width_unit': 'Pixel'
-            })
-            circle_symbol = QgsFillSymbol()
-            circle_symbol.changeSymbolLayer(0, circle_symbol_layer)
-
-            # lyrs_exist = [l for l in QgsProject().instance().layerTreeRoot().children() if l.isVisible()]
-
             # proj_id = self.project.crs().authid()
             if self.project.crs().isGeographic():
                 self.project.setCrs(QgsCoordinateReferenceSystem("EPSG:3857"))
 
-            bTransfer = False
-            if self.block_layer.crs().isValid():
-                if self.block_layer.crs().authid() != "EPSG:3857":
-                    sourceCrs = QgsCoordinateReferenceSystem(f"EPSG:{epsg_code(self.block_layer.crs())}")
-                    destCrs = QgsCoordinateReferenceSystem(f"EPSG:{epsg_code(self.project.crs())}")
-                    geom_tr = QgsCoordinateTransform(sourceCrs, destCrs, self.project)
-                    bTransfer = True
-            else:
+            if not self.block_layer.crs().isValid():
                 raise Exception("地块图层坐标系统不符合标准.")
 
-            self.block_layer.setSubsetString("")
-            fids = []
-            for fea in self.block_layer.getFeatures():
-                fids.append(fea.id())
+            # 增量导出: 跳过清单中内容没有变化并且已经输出的地块. 多页PDF每次都要完整输出
+            if self.config.incremental and not self.pdf_batch():
+                with self.timer.batch_stage("manifest"):
+                    self.manifest = export_manifest(self.config.out_path)
+                    self.manifest.load(self.project, self.block_layer, self.config, checked_layer_ids)
+            prefetcher = tile_prefetcher(self.project, self.config) if self.config.tile_prefetch else None
 
-            ifeat = 1
-            total_num = self.block_layer.featureCount()
+            # 单进程出图时fids为None, 渲染时按批读取全部地块; 并行导出需要按fid分片, 只读取fid.
+            # 增量导出或预取瓦片时先扫描一遍地块, 同时计算地块哈希和出图范围, 只保留需要出图的地块
+            extents = []
+            if self.manifest is not None or prefetcher is not None:
+                with self.timer.batch_stage("scan"):
+                    fids, extents, total = self.scan_blocks(prefetcher)
+                if self.manifest is not None:
+                    QgsMessageLog.logMessage("共{}个地块, 其中{}个没有变化, 需要出图{}个.".format(
+                        total, total - len(fids), len(fids)), tag=MESSAGE_TAG, level=Qgis.MessageLevel.Info)
+                    if len(fids) == 0:
+                        return True
+            else:
+                with self.timer.batch_stage("fids"):
+                    fids = block_ids(self.block_layer) if self.config.export_workers > 1 else None
 
-            fid_name = self.get_key_column()
+            total_num = self.block_layer.featureCount() if fids is None else len(fids)
+            self.telemetry = export_telemetry(total_num, self.config.out_path)
+            self.telemetry.write_status(force=True)
 
-            # for feature in self.block_layer.getFeatures():
-            for fea_id in fids:
-                bflag = self.block_layer.setSubsetString("{}={}".format(fid_name, fea_id))
-                # fea_id = str(feature.id())
-                if not bflag:
-                    QgsMessageLog.logMessage("fid{}不存在".format(fea_id), tag="Plugins",
-                                             level=Qgis.MessageLevel.Warning)
+            # 底图瓦片预取到本地后再出图, 渲染器用缓存图层代替工程中的XYZ图层
+            result = False
+            try:
+                if prefetcher is not None:
+                    with self.timer.batch_stage("prefetch"):
+                        self.tile_cache = prefetcher.prefetch(extents, self.isCanceled)
+                    if self.isCanceled():
+                        return False
+                self.telemetry.reset_clock()
+                with self.timer.batch_stage("render"):
+                    result = self.render_blocks(fids, checked_layer_ids)
+                return result
+            finally:
+                if self.manifest is not None:
+                    self.manifest.close()
+                self.write_timing()
+                self.finish_telemetry(result)
+        except:
+            self.exception = Exception(traceback.format_exc())
+            return False
+
+    def scan_blocks(self, prefetcher=None):
+        """
+        按批读取一遍地块, 由清单计算地块哈希判断是否需要出图, 同时计算需要出图的地块的瓦片预取范围
+
+        Returns:
+            tuple: (需要出图的fid列表, 这些地块的出图范围, 地块总数)
+        """
+        block_extent = prefetcher.extent_function(self.block_layer) if prefetcher is not None else None
+        fids = []
+        extents = []
+        total = 0
+        for fea_id, feature in block_stream(self.block_layer).blocks():
+            total += 1
+            if self.manifest is not None and not self.manifest.check(feature):
+                continue
+            fids.append(fea_id)
+            if block_extent is not None:
+                extent = block_extent(feature)
+                if extent is not None:
+                    extents.append(extent)
+        return fids, extents, total
+
+    def render_blocks(self, fids, checked_layer_ids):
+        if self.config.export_workers > 1 and fids is not None and len(fids) > 1:
+            if not self.pdf_batch() or merge_available():
+                return self.run_parallel(fids, checked_layer_ids)
+            # 各进程的分段PDF无法合并, 在分片开始前退回单进程出图
+            QgsMessageLog.logMessage("没有安装pypdf, 无法合并并行导出的PDF, 改为单进程出图.",
+                                     tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
+
+        renderer = create_renderer(self.project, self.block_layer, self.config, checked_layer_ids,
+                                   self.iface.mapCanvas().extent(), self.tile_cache)
+
+        ifeat = 1
+        total_num = self.block_layer.featureCount() if fids is None else len(fids)
+
+        def on_page(fea_id):
+            nonlocal ifeat
+            self.block_done(fea_id)
+            self.setProgress(float(ifeat * 100 / total_num))
+            ifeat += 1
+
+        # 单个地块出错时记录下来继续出图, 与并行导出的子进程一致
+        errors = []
+        try:
+            if self.pdf_batch():
+                renderer.render_pdf(fids, os.path.join(self.config.out_path, "pdf", PDF_BATCH_NAME), on_page,
+                                    self.isCanceled)
+                return not self.isCanceled()
+
+            if isinstance(renderer, atlas_renderer):
+                for fea_id in renderer.render_atlas(fids):
+                    self.report_completed(renderer.completed(fea_id), errors)
+                    if self.isCanceled():
+                        return False
                     self.setProgress(float(ifeat * 100 / total_num))
                     ifeat += 1
-                    continue
-
-                feature = next(self.block_layer.getFeatures())
-
-                geom = feature.geometry()
-                project_name = os.path.join(out_path, "project_files", f"{fea_id}.qgs")
-
-                layoutName = "renderUP_layout"
-                manager = self.project.layoutManager()
-                layouts_list = manager.printLayouts()
-                # remove any duplicate layouts
-                for layout in layouts_list:
-                    if layout.name() == layoutName:
-                        manager.removeLayout(layout)
-
-                layout = QgsPrintLayout(self.project)
-                layout.initializeDefaults()
-                layout.setName(layoutName)
-                self.project.layoutManager().addLayout(layout)
-                pc = layout.pageCollection()
-                pc.pages()[0].setPageSize(QgsLayoutSize(out_width, out_height, QgsUnitTypes.LayoutUnit.LayoutPixels))
-
-                map_item = self.draw_layout_mapitem(layout, out_width, out_height, out_resolution)
-
-                # if self.block_layer.crs().isValid():
-                #     # if self.block_layer.crs().isGeographic():
-                #     if self.block_layer.crs().authid() != "EPSG:3857":
-                if bTransfer:
-                    geom.transform(geom_tr)
-                    # sourceCrs = QgsCoordinateReferenceSystem(epsg_code(self.block_layer.crs()))
-                    # destCrs = QgsCoordinateReferenceSystem(epsg_code(self.project.crs()))
-                    #
-                    # if sourceCrs != destCrs:
-                    #     tr = QgsCoordinateTransform(sourceCrs, destCrs, self.project)
-                    #     geom.transform(tr)
-
-                centroid = geom.pointOnSurface().asPoint()
-                # QgsMessageLog.logMessage("中心点坐标:{},{}".format(centroid.x(), centroid.y()), tag="Plugins",
-                #                          level=Qgis.MessageLevel.Info)
-                extent = QgsRectangle.fromCenterAndSize(centroid, 2 * radius, 2 * radius)
-                extent.scale(1.2)
-                map_item.zoomToExtent(extent)
+                return len(errors) == 0
 
+            for fea_id, feature in renderer.blocks.blocks(fids):
                 if self.isCanceled():
                     return False
 
-                if draw_circle:
-                    ele_circle = QgsLayoutItemShape(layout)
-                    ele_circle.setShapeType(QgsLayoutItemShape.Shape.Ellipse)
-                    ele_circle.setReferencePoint(QgsLayoutItem.ReferencePoint.Middle)
-                    ele_circle.setSymbol(circle_symbol)
-
-                    layout_centroid = map_item.mapToItemCoords(QPointF(centroid.x(), centroid.y()))
-                    layout_radius = self.layout_length(map_item, radius, centroid)
-
-                    ele_circle.attemptMove(QgsLayoutPoint(layout_centroid.x(), layout_centroid.y(), QgsUnitTypes.LayoutUnit.LayoutMillimeters))
-                    ele_circle.setFixedSize(QgsLayoutSize(2 * layout_radius, 2 * layout_radius))
-                    layout.addLayoutItem(ele_circle)
-
-                if draw_northarrow:
-                    north_path = os.path.join(IconDir, "north_arrow.svg")
-
-                    if not os.path.exists(north_path):
-                        north_path = os.path.join(QgsApplication.prefixPath(), "svg", "arrows", "NorthArrow_10.svg")
-                        if not os.path.exists(north_path):
-                            north_path = None
-
-                    if north_path is not None:
-                        out_north_width = 20 if out_width / 10 < 20 else int(out_width / 10)
-                        out_north_height = 20 if out_height / 10 < 20 else int(out_height / 10)
-
-                        north_item = QgsLayoutItemPicture(layout)
-                        north_item.setPicturePath(north_path)
-                        layout.addLayoutItem(north_item)
-                        north_item.attemptResize(QgsLayoutSize(out_north_width, out_north_height, QgsUnitTypes.LayoutUnit.LayoutPixels))
-                        north_item.attemptMove(QgsLayoutPoint(int(17 * out_width / 19), int(2 * out_height / 19), QgsUnitTypes.LayoutUnit.LayoutPixels))
-
-                if draw_scalebar:
-                    scalebar_item = QgsLayoutItemScaleBar(layout)
-                    scalebar_item.setLinkedMap(map_item)
-                    scalebar_item.setStyle("Line Ticks Up")
-                    scalebar_item.attemptMove(QgsLayoutPoint(int(1 * out_width / 19), int(16 * out_height / 19), QgsUnitTypes.LayoutUnit.LayoutPixels))
-                    scalebar_item.setUnitLabel("米")
-
-                    tf = QgsTextFormat()
-                    tf.setFont(QFont(DefaultFont))
-                    tf.setSize(scalebar_size)
-                    scalebar_item.setTextFormat(tf)
-                    scalebar_item.setLabelBarSpace(1)  # 文字和标尺的空间，单位毫米
-
-                    scalebar_item.setSegmentSizeMode(QgsScaleBarSettings.SegmentSizeMode.SegmentSizeFixed)
-                    scalebar_item.setNumberOfSegmentsLeft(0)
-                    scalebar_item.setNumberOfSegments(2)
-                    scalebar_item.setMaximumBarWidth(40)
-                    scalebar_item.setMinimumSize(QgsLayoutSize(40, 1.5))
-                    scalebar_item.setUnits(QgsUnitTypes.DistanceUnit.DistanceMeters)
-                    scalebar_item.setUnitsPerSegment(int(radius / 4))
-                    scalebar_item.setHeight(out_height / 500)
-
-                    layout.addLayoutItem(scalebar_item)
-
-                if draw_legend:
-                    legend_item = QgsLayoutItemLegend(layout)
-                    legend_item.setLinkedMap(map_item)
-                    title_style = QgsLegendStyle()
-                    font = QFont(DefaultFont, legend_title_size)
-                    font.setBold(True)
-                    title_style.setFont(font)
-                    legend_item.setStyle(QgsLegendStyle.Style.Title, title_style)
-                    legend_item.setTitle("图例")
-
-                    symbol_label_style = QgsLegendStyle()
-                    symbol_label_style.setFont(QFont(DefaultFont, legend_label_size, 1, False))
-                    legend_item.setStyle(QgsLegendStyle.Style.SymbolLabel, symbol_label_style)
-
-                    legend_item.rstyle(QgsLegendStyle.Style.Symbol).setMargin(QgsLegendStyle.Side.Top, 0.3)
-                    legend_item.rstyle(QgsLegendStyle.Style.Title).setMargin(QgsLegendStyle.Side.Bottom, 1)
-
-                    legend_item.setLegendFilterByMapEnabled(True)
-                    legend_item.setAutoUpdateModel(autoUpdate=False)
-                    m = legend_item.model()
-                    root = m.rootGroup()
-                    # group.clear()
-                    legend_item.model().setRootGroup(root)
-
-                    for tr in root.children():
-                        if tr.layerId() == checked_layer_ids["轨道站点"]:
-                            tr.setCustomProperty("legend/title-label", "轨道站点")
-                        elif tr.layerId() == checked_layer_ids["POI"]:
-                            tr.setCustomProperty("legend/title-label", "POI")
-                            QgsLegendRenderer.setNodeLegendStyle(tr, QgsLegendStyle.Style.Hidden)
-
-                    for lr in lyrsToRemove:
-                        root.removeLayer(self.project.mapLayer(lr))
-
-                    # root = QgsLayerTree()
-                    # for l_name, l_id in checked_layer_ids.items():
-                    #     tree_layer = root.addLayer(QgsProject.instance().mapLayer(l_id))
-                    #     tree_layer.setUseLayerName(False)
-                    #     tree_layer.setName(l_name)
-                    #     setattr(root, l_name, QgsLayerTree())
-
-                    # legend_item.updateLegend()
-                    legend_item.model().setRootGroup(root)
-                    legend_item.setBackgroundColor(QColor(255, 255, 255, 153))
-                    # legend_item.updateLegend()
-                    legend_item.adjustBoxSize()
-                    legend_item.refresh()
-                    layout.addLayoutItem(legend_item)
-
-                self.project.write(project_name)
-
-                exporter = QgsLayoutExporter(layout)
-                # QgsMessageLog.logMessage(project_name, tag="Plugins", level=Qgis.MessageLevel.Warning)
-
-                if out_format == 'pdf':
-                    exporter.exportToPdf(os.path.join(out_path, "pdf", f"out_{fea_id}.pdf"), QgsLayoutExporter.PdfExportSettings())
-                else:
-                    exporter.exportToImage(os.path.join(out_path, out_format, f"out_{fea_id}.{out_format}"), QgsLayoutExporter.ImageExportSettings())
+                self.telemetry.started(fea_id)
+                try:
+                    if renderer.render(fea_id, feature):
+                        self.report_completed(renderer.completed(fea_id), errors)
+                    else:
+                        self.telemetry.block_missing(fea_id)
+                        QgsMessageLog.logMessage("fid{}不存在".format(fea_id), tag="Plugins",
+                                                 level=Qgis.MessageLevel.Warning)
+                except:
+                    self.report_completed([(fea_id, traceback.format_exc())], errors)
 
                 self.setProgress(float(ifeat * 100 / total_num))
                 ifeat += 1
-            return True
-        except:
-            self.exception = Exception(traceback.format_exc())
+        finally:
+            try:
+                renderer.close()
+                # 编码线程在close之后才全部写完
+                self.report_completed(renderer.completed(), errors)
+            finally:
+                self.timer.merge(renderer.timer.blocks)
+
+        if len(errors) > 0:
+            self.exception = Exception("\n".join(errors))
             return False
+        return True
+
+    def run_parallel(self, fids, checked_layer_ids):
+        """把fid列表分片交给多个无界面的QGIS子进程渲染, 在当前任务中汇总进度、取消和错误"""
+        work_dir = os.path.join(self.config.out_path, "project_files")
+        project_path = os.path.join(work_dir, "_batch_export.qgs")
+
+        # 子进程从工程文件加载图层和样式, write会修改当前工程的文件名, 写完后恢复
+        file_name = self.project.fileName()
+        if not self.project.write(project_path):
+            raise Exception("工程文件{}写入失败.".format(project_path))
+        self.project.setFileName(file_name)
+
+        job = {
+            "project": project_path,
+            "block_layer_id": self.block_layer.id(),
+            "checked_layer_ids": checked_layer_ids,
+            "tile_cache": self.tile_cache,
+            "config": dataclasses.asdict(self.config)
+        }
+
+        pool = export_worker_pool(job, fids, self.config.export_workers, work_dir)
+        total_num = len(fids)
+        ifeat = 0
+        errors = []
+        try:
+            pool.start()
+            for event in pool.events():
+                if self.isCanceled():
+                    return False
+                if event is None:
+                    continue
+
+                if event["event"] == "done":
+                    self.block_done(event["fid"])
+                    ifeat += 1
+                elif event["event"] == "missing":
+                    self.telemetry.block_missing(event["fid"])
+                    QgsMessageLog.logMessage("fid{}不存在".format(event["fid"]), tag="Plugins",
+                                             level=Qgis.MessageLevel.Warning)
+                    ifeat += 1
+                elif event["event"] == "error":
+                    self.telemetry.block_failed(event["fid"])
+                    errors.append("fid{}: {}".format(event["fid"], event["error"]))
+                    ifeat += 1
+                elif event["event"] == "timing":
+                    self.timer.merge(event["blocks"])
+                    continue
+                elif event["event"] == "exit" and event["code"] != 0:
+                    errors.append("进程{}异常退出(代码{}): {}".format(event["worker"], event["code"], event["stderr"]))
+                self.setProgress(float(ifeat * 100 / total_num))
+        finally:
+            pool.terminate()
+            pool.cleanup()
+            try:
+                os.remove(project_path)
+            except OSError:
+                pass
+
+        if len(errors) > 0:
+            self.exception = Exception("\n".join(errors))
+            return False
+
+        if self.pdf_batch():
+            pdf_dir = os.path.join(self.config.out_path, "pdf")
+            with self.timer.batch_stage("merge"):
+                merged = merge_pdfs([os.path.join(pdf_dir, part_name(i)) for i in range(len(pool.shards))],
+                                    os.path.join(pdf_dir, PDF_BATCH_NAME))
+            if not merged:
+                self.exception = Exception("分段PDF合并失败, 各段结果保留在{}.".format(pdf_dir))
+                return False
+        return True
+
+    def pdf_batch(self):
+        """所有地块输出为一个多页PDF"""
+        return self.config.out_format == "pdf" and self.config.pdf_single
+
+    def report_completed(self, results, errors):
+        """按渲染器返回的[(地块fid, 错误信息)]记录完成或失败的地块, 错误信息加入errors"""
+        for fea_id, error in results:
+            if error is None:
+                self.block_done(fea_id)
+                continue
+            self.telemetry.block_failed(fea_id)
+            self.telemetry.write_status()
+            errors.append("fid{}: {}".format(fea_id, error))
+            QgsMessageLog.logMessage("fid{}出图失败: {}".format(fea_id, error), tag=MESSAGE_TAG,
+                                     level=Qgis.MessageLevel.Critical)
+
+    def block_done(self, fea_id):
+        if self.manifest is not None:
+            self.manifest.done(fea_id)
+        if self.telemetry is not None:
+            self.telemetry.block_done(fea_id)
+            if self.telemetry.description_due():
+                self.setDescription("{} ({})".format(self.base_description, self.telemetry.text()))
+            self.telemetry.write_status()
+
+    def finish_telemetry(self, result):
+        """写出最终状态, 任务描述恢复原样"""
+        if self.telemetry is None:
+            return
+        state = "finished" if result else ("canceled" if self.isCanceled() else "failed")
+        self.telemetry.write_status(state, force=True)
+        self.setDescription(self.base_description)
+
+    def write_timing(self):
+        """写出分阶段计时报告, 在日志中输出摘要"""
+        if len(self.timer.blocks) == 0:
+            return
+        try:
+            report = self.timer.write(self.config.out_path)
+        except OSError as e:
+            QgsMessageLog.logMessage("计时报告写入失败: {}".format(e), tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
+            return
+        QgsMessageLog.logMessage(stage_timer.summary(report), tag=MESSAGE_TAG, level=Qgis.MessageLevel.Info)
 
     def finished(self, result: bool) -> None:
         if result:
@@ -333,14 +407,548 @@ class bacth_export(QgsTask):
             MESSAGE_TAG, Qgis.MessageLevel.Info)
         super().cancel()
 
+
+def create_renderer(project, block_layer, config, checked_layer_ids, init_extent=None, tile_cache=None):
+    """
+    按导出引擎创建渲染器:
+        layout: 逐个地块过滤出图
+        atlas:  由QgsLayoutAtlas遍历地块
+        direct: 栅格格式跳过版面直接渲染地图
+        mosaic: 静态图层渲染成共用的拼接底图, 每个地块裁剪后只渲染地块相关的图层
+
+    tile_cache为tile_prefetcher预取的{XYZ图层id: MBTiles路径}, 出图时用本地缓存代替这些图层
+    """
+    if config.export_engine == "direct":
+        from .direct import direct_renderer
+        return direct_renderer(project, block_layer, config, checked_layer_ids, init_extent, tile_cache=tile_cache)
+    if config.export_engine == "mosaic":
+        from .mosaic import mosaic_renderer
+        return mosaic_renderer(project, block_layer, config, checked_layer_ids, init_extent, tile_cache=tile_cache)
+    if config.export_engine == "atlas":
+        return atlas_renderer(project, block_layer, config, checked_layer_ids, init_extent, tile_cache)
+    if config.export_engine == "layout":
+        return block_renderer(project, block_layer, config, checked_layer_ids, init_extent, tile_cache)
+    raise Exception("导出引擎{}不存在.".format(config.export_engine))
+
+
+class block_renderer:
+    """逐个地块输出专题图, QGIS任务和并行导出的子进程共用"""
+
+    layout_name = "renderUP_layout"
+    # 分条渲染时条带上下各多渲染的像素, 版面导出每个条带都按整个地图计算标注, 不需要重叠
+    strip_overlap = 0
+
+    def __init__(self, project: QgsProject, block_layer, config: PluginConfig, checked_layer_ids, init_extent=None,
+                 tile_cache=None):
+        self.project = project
+        self.block_layer = block_layer
+        self.config = config
+        self.checked_layer_ids = checked_layer_ids
+        self.init_extent = block_layer.extent() if init_extent is None else init_extent
+
+        out_diag = math.sqrt(config.out_width ** 2 + config.out_height ** 2)
+        self.scalebar_size = int(out_diag * default_scalebar_size * 72 / config.out_resolution)
+        self.legend_title_size = int(self.scalebar_size * 1.5)
+        self.legend_label_size = int(self.legend_title_size * 0.8)
+        # QgsMessageLog.logMessage("大小:{}".format(scalebar_size), tag="Plugins",
+        #                          level=Qgis.MessageLevel.Info)
+
+        self.lyrsToRemove = [l for l in self.project.mapLayers() if l not in list(checked_layer_ids.values())]
+
+        # QgsMessageLog.logMessage(str(self.project.mapLayers()), tag="Plugins",
+        #                          level=Qgis.MessageLevel.Info)
+
+        circle_symbol_layer = QgsSimpleFillSymbolLayer.create({
+            'outline_color': "64,64,64,77",
+            'color': '0,0,0,0',
+            'outline_style': 'dot',
+            'outline_width': "5",
+            'outline_width_unit': 'Pixel'
+        })
+        self.circle_symbol = QgsFillSymbol()
+        self.circle_symbol.changeSymbolLayer(0, circle_symbol_layer)
+
+        # lyrs_exist = [l for l in QgsProject().instance().layerTreeRoot().children() if l.isVisible()]
+
+        self.geom_tr = None
+        if self.block_layer.crs().isValid():
+            if self.block_layer.crs().authid() != "EPSG:3857":
+                sourceCrs = QgsCoordinateReferenceSystem(f"EPSG:{epsg_code(self.block_layer.crs())}")
+                destCrs = QgsCoordinateReferenceSystem(f"EPSG:{epsg_code(self.project.crs())}")
+                self.geom_tr = QgsCoordinateTransform(sourceCrs, destCrs, self.project)
+        else:
+            raise Exception("地块图层坐标系统不符合标准.")
+
+        # 地图中的地块图层替换为只含当前地块的内存图层, 出图时不修改地块图层的过滤条件;
+        # 预取过的XYZ图层替换为本地缓存, 不修改工程中图层的数据源
+        substitutes = {}
+        for layer_id, path in (tile_cache or {}).items():
+            layer = project.mapLayer(layer_id)
+            if layer is not None:
+                substitutes[layer_id] = cache_layer(layer, path)
+        self.overlay = block_overlay_layer(block_layer, substitutes)
+        self.fid_name = self.get_key_column()
+
+        # 图例项索引整批只建立一次, 代替每个地块按地图过滤图例时的隐藏渲染
+        self.legend_index = None
+        if config.draw_legend and config.legend_index:
+            self.legend_index = legend_presence_index(self.project, checked_layer_ids)
+
+        self.layout = None
+        self.map_item = None
+        self.circle_item = None
+        self.legend_item = None
+        self.block_info = None
+        # 混合PDF中放在地图下面的栅格底图图片, 以及图片所在的临时目录
+        self.underlay_item = None
+        self.underlay_layers = []
+        self.underlay_dir = None
+        self.underlay_path = None
+        self.underlay_count = 0
+
+        self.project_writer = project_file_writer(self.project, config.project_files,
+                                                  os.path.join(config.out_path, "project_files"), self.layout_name)
+        # 各地块分阶段计时, 由任务汇总成报告
+        self.timer = stage_timer()
+        # 地块按批流式读取, 每批的读取时间记入fetch阶段
+        self.blocks = block_stream(block_layer, self.timer)
+        self.layer_sample_count = 0
+        # 剖析器在创建渲染器的线程(渲染线程)中采样
+        self.profiler = None
+        if config.profile_every > 0 or config.profile_sample_ms > 0:
+            self.profiler = block_profiler(config.out_path, config.profile_every, config.profile_sample_ms)
+            self.timer.listeners.append(self.profiler)
+        # 每个地块结束时记录内存, 按需定期释放版面和缓存
+        self.keep_layout = False
+        self.timer.listeners.append(memory_monitor(self.timer, config.memory_warn_kb, config.cleanup_every,
+                                                   self.release_caches))
+        self.image_writer = image_writer(config.encode_workers, encoder_options(config), timer=self.timer)
+
+        # 输出图片超过内存上限时按条带渲染并流式写出
+        self.strips = None
+        if config.out_format in STRIP_FORMATS:
+            self.strips = strip_rows(config.out_width, config.out_height, config.strip_memory_mb, self.strip_overlap)
+            if self.strips is not None and config.out_format == "png" and config.png_palette:
+                raise Exception(PALETTE_STRIPS_ERROR)
+        elif config.out_format != "pdf" and config.out_width * config.out_height * 4 > config.strip_memory_mb * 1024 ** 2:
+            QgsMessageLog.logMessage("输出图片超过内存上限{}MB, {}格式不支持分条写出, 仍按整张图片渲染.".format(
+                config.strip_memory_mb, config.out_format), tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
+
+    def render(self, fea_id, feature=None) -> bool:
+        """feature为block_stream已经读取的地块要素, 为None时按fid读取"""
+        try:
+            if not self.prepare(fea_id, feature):
+                return False
+            self.export_layout(fea_id)
+        finally:
+            self.timer.end()
+
+        return True
+
+    def prepare(self, fea_id, feature=None) -> bool:
+        """把版面切换到地块fea_id并写出工程文件, 地块不存在时返回False"""
+        self.timer.begin(fea_id)
+        with self.timer.stage("query"):
+            if feature is None:
+                feature = self.blocks.get(fea_id)
+            if feature is None or not feature.isValid():
+                return False
+            self.overlay.set_feature(feature)
+
+        # 模板模式下版面和装饰元素整批只创建一次, 每个地块只更新范围、圆圈和图例;
+        # 多页PDF导出过程中QgsLayoutExporter一直持有同一个版面, 即使不用模板也不能重建
+        if self.layout is None or not (self.config.layout_template or self.keep_layout):
+            with self.timer.stage("layout"):
+                self.build_layout()
+
+        centroid = self.block_center(feature)
+        # QgsMessageLog.logMessage("中心点坐标:{},{}".format(centroid.x(), centroid.y()), tag="Plugins",
+        #                          level=Qgis.MessageLevel.Info)
+        self.update_layout(centroid)
+
+        with self.timer.stage("project"):
+            self.write_project(fea_id)
+        return True
+
+    def prepare_pages(self, fids):
+        """依次把版面切换到各个地块, 每切换一个返回其fid; fids为None时为全部地块"""
+        for fea_id, feature in self.blocks.blocks(fids):
+            if feature is not None and self.prepare(fea_id, feature):
+                yield fea_id
+            else:
+                QgsMessageLog.logMessage("fid{}不存在".format(fea_id), tag="Plugins",
+                                         level=Qgis.MessageLevel.Warning)
+
+    def render_pdf(self, fids, path, on_page=None, is_canceled=None):
+        """所有地块作为同一个PDF文档的各页输出, fids为None时输出全部地块"""
+        if self.layout is None:
+            self.build_layout()
+        count = self.block_layer.featureCount() if fids is None else len(fids)
+        iterator = block_page_iterator(self, self.prepare_pages(fids), count, on_page, is_canceled)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 导出过程中所有页面共用同一个版面, 切换地块和定期清理时都不能替换
+        self.keep_layout = True
+        try:
+            result, error = QgsLayoutExporter.exportToPdf(iterator, path, pdf_export_settings(self.config))
+        finally:
+            self.keep_layout = False
+        if iterator.exception is not None:
+            raise iterator.exception
+        if result != QgsLayoutExporter.ExportResult.Success and not (is_canceled is not None and is_canceled()):
+            raise Exception("PDF文件{}导出失败: {}".format(path, error))
+
+    def block_center(self, feature):
+        geom = feature.geometry()
+        if self.geom_tr is not None:
+            geom.transform(self.geom_tr)
+        return geom.pointOnSurface().asPoint()
+
+    def export_layout(self, fea_id):
+        out_format = self.config.out_format
+        out_path = os.path.join(self.config.out_path)
+
+        exporter = QgsLayoutExporter(self.layout)
+        # QgsMessageLog.logMessage(project_name, tag="Plugins", level=Qgis.MessageLevel.Warning)
+
+        if out_format == 'pdf':
+            with self.timer.stage("render"):
+                exporter.exportToPdf(os.path.join(out_path, "pdf", f"out_{fea_id}.pdf"),
+                                     pdf_export_settings(self.config))
+        elif self.strips is not None:
+            with self.timer.stage("render"):
+                self.export_strips(exporter, fea_id, os.path.join(out_path, out_format, f"out_{fea_id}.{out_format}"))
+        else:
+            # 只在当前线程渲染版面, 编码和写盘交给图片写出线程池
+            with self.timer.stage("render"):
+                image = exporter.renderPageToImage(0)
+            if image.isNull():
+                raise Exception("版面渲染失败, fid{}.".format(fea_id))
+            with self.timer.stage("write"):
+                self.image_writer.submit(image, os.path.join(out_path, out_format, f"out_{fea_id}.{out_format}"),
+                                         out_format, fea_id)
+
+    def export_strips(self, exporter: QgsLayoutExporter, fea_id, out_file):
+        """按条带渲染页面区域并流式写出, 内存中只保留一个条带"""
+        page = self.layout.pageCollection().page(0)
+        page_rect = QRectF(page.pos(), page.rect().size())
+        width = self.config.out_width
+        height = self.config.out_height
+        row_height = page_rect.height() / height
+        dpi = self.layout.renderContext().dpi()
+
+        def render_strip(y, rows):
+            region = QRectF(page_rect.x(), page_rect.y() + y * row_height, page_rect.width(), rows * row_height)
+            image = exporter.renderRegionToImage(region, QSize(width, rows), dpi)
+            if image.isNull():
+                raise Exception("版面渲染失败, fid{}.".format(fea_id))
+            return image
+
+        write_strips(out_file, self.config.out_format, width, height, encoder_options(self.config),
+                     self.config.out_resolution, self.strips, render_strip)
+
+    def build_layout(self):
+        """创建版面以及与地块无关的元素: 地图、圆圈、指北针、比例尺和图例"""
+        out_width = self.config.out_width
+        out_height = self.config.out_height
+        out_resolution = self.config.out_resolution
+        radius = self.config.radius
+        checked_layer_ids = self.checked_layer_ids
+
+        layoutName = self.layout_name
+        manager = self.project.layoutManager()
+        layouts_list = manager.printLayouts()
+        # remove any duplicate layouts
+        for layout in layouts_list:
+            if layout.name() == layoutName:
+                manager.removeLayout(layout)
+
+        layout = QgsPrintLayout(self.project)
+        layout.initializeDefaults()
+        layout.setName(layoutName)
+        self.project.layoutManager().addLayout(layout)
+        pc = layout.pageCollection()
+        pc.pages()[0].setPageSize(QgsLayoutSize(out_width, out_height, QgsUnitTypes.LayoutUnit.LayoutPixels))
+
+        self.layout = layout
+        self.map_item = self.draw_layout_mapitem(layout, out_width, out_height, out_resolution)
+        self.map_item.setLayers(self.overlay.map_layers(self.project))
+        self.map_item.setKeepLayerSet(True)
+        self.circle_item = None
+        self.legend_item = None
+
+        # 混合PDF: 最下面的栅格图层从地图中移出, 每个地块渲染成一张图片放在地图下面
+        self.underlay_item = None
+        self.underlay_layers = []
+        if self.config.out_format == "pdf" and self.config.pdf_hybrid:
+            layers, self.underlay_layers = split_underlay_layers(self.map_item.layers())
+            if len(self.underlay_layers) > 0:
+                self.map_item.setLayers(layers)
+                self.underlay_item = self.draw_layout_underlay(layout, out_width, out_height)
+
+        if self.config.draw_circle:
+            ele_circle = QgsLayoutItemShape(layout)
+            ele_circle.setShapeType(QgsLayoutItemShape.Shape.Ellipse)
+            ele_circle.setReferencePoint(QgsLayoutItem.ReferencePoint.Middle)
+            ele_circle.setSymbol(self.circle_symbol)
+            layout.addLayoutItem(ele_circle)
+            self.circle_item = ele_circle
+
+        if self.config.draw_northarrow:
+            north_path = os.path.join(IconDir, "north_arrow.svg")
+
+            if not os.path.exists(north_path):
+                north_path = os.path.join(QgsApplication.prefixPath(), "svg", "arrows", "NorthArrow_10.svg")
+                if not os.path.exists(north_path):
+                    north_path = None
+
+            if north_path is not None:
+                out_north_width = 20 if out_width / 10 < 20 else int(out_width / 10)
+                out_north_height = 20 if out_height / 10 < 20 else int(out_height / 10)
+
+                north_item = QgsLayoutItemPicture(layout)
+                north_item.setPicturePath(north_path)
+                layout.addLayoutItem(north_item)
+                north_item.attemptResize(QgsLayoutSize(out_north_width, out_north_height, QgsUnitTypes.LayoutUnit.LayoutPixels))
+                north_item.attemptMove(QgsLayoutPoint(int(17 * out_width / 19), int(2 * out_height / 19), QgsUnitTypes.LayoutUnit.LayoutPixels))
+
+        if self.config.draw_scalebar:
+            scalebar_item = QgsLayoutItemScaleBar(layout)
+            scalebar_item.setLinkedMap(self.map_item)
+            scalebar_item.setStyle("Line Ticks Up")
+            scalebar_item.attemptMove(QgsLayoutPoint(int(1 * out_width / 19), int(16 * out_height / 19), QgsUnitTypes.LayoutUnit.LayoutPixels))
+            scalebar_item.setUnitLabel("米")
+
+            tf = QgsTextFormat()
+            tf.setFont(QFont(DefaultFont))
+            tf.setSize(self.scalebar_size)
+            scalebar_item.setTextFormat(tf)
+            scalebar_item.setLabelBarSpace(1)  # 文字和标尺的空间，单位毫米
+
+            scalebar_item.setSegmentSizeMode(QgsScaleBarSettings.SegmentSizeMode.SegmentSizeFixed)
+            scalebar_item.setNumberOfSegmentsLeft(0)
+            scalebar_item.setNumberOfSegments(2)
+            scalebar_item.setMaximumBarWidth(40)
+            scalebar_item.setMinimumSize(QgsLayoutSize(40, 1.5))
+            scalebar_item.setUnits(QgsUnitTypes.DistanceUnit.DistanceMeters)
+            scalebar_item.setUnitsPerSegment(int(radius / 4))
+            scalebar_item.setHeight(out_height / 500)
+
+            layout.addLayoutItem(scalebar_item)
+
+        if self.config.draw_legend:
+            legend_item = QgsLayoutItemLegend(layout)
+            legend_item.setLinkedMap(self.map_item)
+            title_style = QgsLegendStyle()
+            font = QFont(DefaultFont, self.legend_title_size)
+            font.setBold(True)
+            title_style.setFont(font)
+            legend_item.setStyle(QgsLegendStyle.Style.Title, title_style)
+            legend_item.setTitle("图例")
+
+            symbol_label_style = QgsLegendStyle()
+            symbol_label_style.setFont(QFont(DefaultFont, self.legend_label_size, 1, False))
+            legend_item.setStyle(QgsLegendStyle.Style.SymbolLabel, symbol_label_style)
+
+            legend_item.rstyle(QgsLegendStyle.Style.Symbol).setMargin(QgsLegendStyle.Side.Top, 0.3)
+            legend_item.rstyle(QgsLegendStyle.Style.Title).setMargin(QgsLegendStyle.Side.Bottom, 1)
+
+            legend_item.setLegendFilterByMapEnabled(self.legend_index is None)
+            legend_item.setAutoUpdateModel(autoUpdate=False)
+            m = legend_item.model()
+            root = m.rootGroup()
+            # group.clear()
+            legend_item.model().setRootGroup(root)
+
+            for tr in root.children():
+                if tr.layerId() == checked_layer_ids["轨道站点"]:
+                    tr.setCustomProperty("legend/title-label", "轨道站点")
+                elif tr.layerId() == checked_layer_ids["POI"]:
+                    tr.setCustomProperty("legend/title-label", "POI")
+                    QgsLegendRenderer.setNodeLegendStyle(tr, QgsLegendStyle.Style.Hidden)
+
+            for lr in self.lyrsToRemove:
+                root.removeLayer(self.project.mapLayer(lr))
+
+            # root = QgsLayerTree()
+            # for l_name, l_id in checked_layer_ids.items():
+            #     tree_layer = root.addLayer(QgsProject.instance().mapLayer(l_id))
+            #     tree_layer.setUseLayerName(False)
+            #     tree_layer.setName(l_name)
+            #     setattr(root, l_name, QgsLayerTree())
+
+            # legend_item.updateLegend()
+            legend_item.model().setRootGroup(root)
+            legend_item.setBackgroundColor(QColor(255, 255, 255, 153))
+            layout.addLayoutItem(legend_item)
+            self.legend_item = legend_item
+
+    def update_layout(self, centroid):
+        """按地块中心点更新地图范围、圆圈位置大小以及图例过滤"""
+        radius = self.config.radius
+
+        with self.timer.stage("update"):
+            self.map_item.zoomToExtent(self.block_extent(centroid))
+            self.block_info = self.make_block_info(self.map_item.extent(), centroid)
+
+        if self.underlay_item is not None:
+            with self.timer.stage("underlay"):
+                self.render_underlay()
+
+        if self.circle_item is not None:
+            layout_centroid = self.map_item.mapToItemCoords(QPointF(centroid.x(), centroid.y()))
+            layout_radius = self.layout_length(self.map_item, radius, centroid)
+
+            self.circle_item.attemptMove(QgsLayoutPoint(layout_centroid.x(), layout_centroid.y(), QgsUnitTypes.LayoutUnit.LayoutMillimeters))
+            self.circle_item.setFixedSize(QgsLayoutSize(2 * layout_radius, 2 * layout_radius))
+            self.block_info["circle"] = {"x": layout_centroid.x(), "y": layout_centroid.y(), "size": 2 * layout_radius}
+
+        if self.legend_item is not None:
+            with self.timer.stage("legend"):
+                if self.legend_index is not None:
+                    self.legend_index.apply(self.legend_item.model(), self.map_item.extent())
+                else:
+                    self.legend_item.updateFilterByMap()
+                self.legend_item.adjustBoxSize()
+                self.legend_item.refresh()
+
+        self.sample_layer_times()
+
+    def sample_layer_times(self, settings: QgsMapSettings = None):
+        """
+        每layer_timing_every个地块按地图设置把每个图层单独渲染一次, 记录各图层的耗时.
+        渲染任务的perLayerRenderingTime没有导出到python, 只能逐个图层计时; 图层单独渲染,
+        不含与其他图层合成的开销. 抽样渲染本身记入批次级的layer_sample阶段, 不计入地块耗时.
+        """
+        every = self.config.layer_timing_every
+        if every <= 0:
+            return
+        self.layer_sample_count += 1
+        if (self.layer_sample_count - 1) % every != 0:
+            return
+
+        with self.timer.excluded("layer_sample"):
+            if settings is None:
+                settings = self.map_item.mapSettings(self.map_item.extent(), self.map_item.rect().size(),
+                                                     self.config.out_resolution, True)
+            times = {}
+            for layer in settings.layers():
+                layer_settings = QgsMapSettings(settings)
+                layer_settings.setLayers([layer])
+                job = QgsMapRendererSequentialJob(layer_settings)
+                start = time.perf_counter()
+                job.start()
+                job.waitForFinished()
+                times[layer.name()] = times.get(layer.name(), 0.0) + time.perf_counter() - start
+            self.timer.add_layers(times)
+
+    def block_extent(self, centroid):
+        radius = self.config.radius
+        extent = QgsRectangle.fromCenterAndSize(centroid, 2 * radius, 2 * radius)
+        extent.scale(1.2)
+        return extent
+
+    def make_block_info(self, map_extent, centroid):
+        """写入地块工程文件的差异信息"""
+        return {
+            "extent": [map_extent.xMinimum(), map_extent.yMinimum(), map_extent.xMaximum(), map_extent.yMaximum()],
+            "crs": self.project.crs().authid(),
+            "center": [centroid.x(), centroid.y()],
+            "radius": self.config.radius,
+            "circle": None,
+            "decorations": {
+                "circle": bool(self.config.draw_circle),
+                "northarrow": bool(self.config.draw_northarrow),
+                "scalebar": bool(self.config.draw_scalebar),
+                "legend": bool(self.config.draw_legend)
+            }
+        }
+
+    def write_project(self, fea_id):
+        """
+        写出地块的工程文件. 出图时地图使用不在工程中的内存图层, 写工程文件前换回工程中的图层;
+        地块图层的fid过滤条件只写入工程文件, 打开工程文件时只显示当前地块, 与逐个过滤地块出图时一致,
+        图层本身的过滤条件不变
+        """
+        self.block_info["block_layer"] = self.block_layer.id()
+        self.block_info["subset"] = "{}={}".format(self.fid_name, fea_id)
+        if not self.project_writer.needs_project():
+            self.project_writer.write(fea_id, self.block_info)
+            return
+
+        map_layers = None
+        if self.map_item is not None:
+            map_layers = self.map_item.layers()
+            self.map_item.setKeepLayerSet(False)
+            self.map_item.setLayers([])
+        # 工程文件中的地图显示全部图层, 不需要混合PDF的底图图片
+        if self.underlay_item is not None:
+            self.underlay_item.setVisibility(False)
+        try:
+            self.project_writer.write(fea_id, self.block_info)
+        finally:
+            if map_layers is not None:
+                self.map_item.setLayers(map_layers)
+                self.map_item.setKeepLayerSet(True)
+            if self.underlay_item is not None:
+                self.underlay_item.setVisibility(True)
+
+    def release_caches(self):
+        """释放整批复用的版面, 下一个地块重新创建"""
+        if self.keep_layout or self.layout is None:
+            return
+        self.project.layoutManager().removeLayout(self.layout)
+        self.layout = None
+        self.map_item = None
+        self.circle_item = None
+        self.legend_item = None
+        self.underlay_item = None
+
+    def completed(self, fea_id=None):
+        """
+        取出已经完成的地块. 图片交给编码线程写出时, 地块在写盘之后才算完成;
+        fea_id为刚渲染完的地块, 没有等待写出的图片时直接算作完成
+
+        Returns:
+            list: [(地块fid, 错误信息)], 写出成功时错误信息为None
+        """
+        # 先判断是否在等待写出再取结果, 两次调用之间写完的地块会出现在结果中
+        pending = fea_id is not None and self.image_writer.is_pending(fea_id)
+        results = self.image_writer.drain()
+        if fea_id is not None and not pending and all(fid != fea_id for fid, _ in results):
+            results.append((fea_id, None))
+        return results
+
+    def close(self):
+        self.timer.end()
+        try:
+            self.image_writer.close()
+        finally:
+            try:
+                self.project_writer.close()
+            finally:
+                if self.profiler is not None:
+                    self.profiler.close()
+                if self.underlay_dir is not None:
+                    shutil.rmtree(self.underlay_dir, ignore_errors=True)
+                    self.underlay_dir = None
+
+    def get_key_column(self):
+        """过滤地块图层用的主键字段名, 没有主键时用OGR的fid"""
+        key_list = self.block_layer.primaryKeyAttributes()
+        if len(key_list) > 0:
+            return self.block_layer.fields().at(key_list[0]).name()
+        else:
+            return "fid"
+
     def draw_layout_mapitem(self, layout, out_width, out_height, out_resolution):
         map_item = QgsLayoutItemMap(layout)
         # map_item.setAtlasDriven(True)
         # map_item.setAtlasScalingMode(QgsLayoutItemMap.AtlasScalingMode.Predefined)
-        map_item.mapSettings(self.iface.mapCanvas().extent(), QSizeF(out_width, out_height), dpi=out_resolution, includeLayerSettings=True)
+        map_item.mapSettings(self.init_extent, QSizeF(out_width, out_height), dpi=out_resolution, includeLayerSettings=True)
         # map.setAtlasMargin(0.05)
         map_item.setRect(0, 0, out_width, out_height)
-        map_item.zoomToExtent(self.iface.mapCanvas().extent())
+        map_item.zoomToExtent(self.init_extent)
         map_item.setBackgroundColor(QColor(255, 255, 255, 0))
         layout.addLayoutItem(map_item)
 
@@ -349,6 +957,41 @@ class bacth_export(QgsTask):
 
         return map_item
 
+    def draw_layout_underlay(self, layout, out_width, out_height):
+        """与地图重合、位于最下层的图片, 显示按pdf_raster_dpi渲染的栅格底图"""
+        underlay_item = QgsLayoutItemPicture(layout)
+        underlay_item.setResizeMode(QgsLayoutItemPicture.ResizeMode.Stretch)
+        layout.addLayoutItem(underlay_item)
+        underlay_item.attemptMove(QgsLayoutPoint(0, 0, QgsUnitTypes.LayoutUnit.LayoutPixels))
+        underlay_item.attemptResize(QgsLayoutSize(out_width, out_height, QgsUnitTypes.LayoutUnit.LayoutPixels))
+        layout.moveItemToBottom(underlay_item)
+        return underlay_item
+
+    def render_underlay(self):
+        """
+        按当前地图范围把底部的栅格图层以pdf_raster_dpi渲染成图片, 替换地图下面的底图图片.
+        栅格图层下面只有白色的页面, 底图直接画在白色背景上, 不需要透明通道.
+        """
+        settings = self.map_item.mapSettings(self.map_item.extent(), self.map_item.rect().size(),
+                                             self.config.pdf_raster_dpi, True)
+        settings.setLayers(self.underlay_layers)
+        settings.setBackgroundColor(QColor(255, 255, 255))
+        job = QgsMapRendererParallelJob(settings)
+        job.start()
+        job.waitForFinished()
+
+        # 图片项按路径缓存图片, 每个地块写到新的文件; 上一个地块的页面已经导出, 它的图片可以删除
+        if self.underlay_dir is None:
+            self.underlay_dir = tempfile.mkdtemp(prefix="renderUP_underlay_")
+        previous = self.underlay_path
+        self.underlay_count += 1
+        self.underlay_path = os.path.join(self.underlay_dir, f"underlay_{self.underlay_count}.png")
+        if not job.renderedImage().save(self.underlay_path, "PNG"):
+            raise Exception("栅格底图{}保存失败.".format(self.underlay_path))
+        self.underlay_item.setPicturePath(self.underlay_path, QgsLayoutItemPicture.Format.FormatRaster)
+        if previous is not None and os.path.exists(previous):
+            os.remove(previous)
+
     def layout_length(self, map_item, length, start_pt):
         layout_start_pt = map_item.mapToItemCoords(QPointF(start_pt.x(), start_pt.y()))
         map_length = self.convert_distance(length)
@@ -364,9 +1007,71 @@ class bacth_export(QgsTask):
         res = d.convertLengthMeasurement(distance, self.project.distanceUnits())
         return res
 
-    def get_key_column(self):
-        key_list = self.block_layer.primaryKeyAttributes()
-        if len(key_list) > 0:
-            return key_list[0]
+
+class atlas_renderer(block_renderer):
+    """
+    以地块图层为覆盖图层, 由QgsLayoutAtlas逐个遍历地块要素.
+    版面只创建一次, 地图中的地块图层替换为只含当前地块的内存图层, 不修改地块图层的过滤条件.
+    """
+
+    def render(self, fea_id, feature=None) -> bool:
+        try:
+            for _ in self.render_atlas([fea_id]):
+                return True
+            return False
+        finally:
+            self.timer.end()
+
+    def release_caches(self):
+        """图集遍历过程中版面不能替换, 只做垃圾回收"""
+        pass
+
+    def render_atlas(self, fids=None):
+        """依次输出覆盖图层中的地块, 每输出一个返回其fid; fids不为空时只输出其中的地块"""
+        for fea_id in self.prepare_pages(fids):
+            self.export_layout(fea_id)
+            yield fea_id
+
+    def prepare_pages(self, fids=None):
+        """由图集依次切换到覆盖图层中的地块, 每切换一个返回其fid"""
+        # 合并PDF时版面必须在导出开始前创建, 之后不能再替换
+        if self.layout is None:
+            self.build_layout()
+
+        atlas = self.layout.atlas()
+        atlas.setCoverageLayer(self.block_layer)
+        atlas.setHideCoverage(False)
+        atlas.setSortFeatures(False)
+        atlas.setFilenameExpression("'out_' || @atlas_featureid")
+        if fids is not None:
+            atlas.setFilterFeatures(True)
+            atlas.setFilterExpression("$id IN ({})".format(",".join(str(fid) for fid in fids)))
         else:
-            return "fid"
+            atlas.setFilterFeatures(False)
+        atlas.setEnabled(True)
+
+        if not atlas.beginRender():
+            return
+
+        try:
+            for i in range(atlas.count()):
+                self.timer.end()
+                start = time.perf_counter()
+                if not atlas.seekTo(i):
+                    continue
+                feature = self.layout.reportContext().feature()
+                fea_id = feature.id()
+                # 切换地块之后才知道fid, 计时从切换之前开始
+                self.timer.begin(fea_id, start)
+                self.timer.add(fea_id, "query", time.perf_counter() - start)
+
+                with self.timer.stage("query"):
+                    self.overlay.set_feature(feature)
+                self.update_layout(self.block_center(feature))
+
+                with self.timer.stage("project"):
+                    self.write_project(fea_id)
+                yield fea_id
+        finally:
+            self.timer.end()
+            atlas.endRender()
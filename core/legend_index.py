@@ -0,0 +1,95 @@
+from qgis._core import QgsProject, QgsSpatialIndex, QgsCoordinateTransform, QgsFeatureRequest, QgsRenderContext, \
+    QgsExpressionContext, QgsExpressionContextUtils, QgsLayerTreeModelLegendNode, QgsMapLayerLegendUtils, \
+    QgsLegendRenderer, QgsLegendStyle, QgsRectangle
+
+
+class legend_presence_index:
+    """
+    图例项出现位置的索引.
+    批量导出前遍历一次轨道站点和POI图层, 记录每个要素的位置和对应的图例项(rule key),
+    每个地块只需查询空间索引就能知道范围内出现了哪些图例项, 代替按地图过滤图例时额外的一次隐藏渲染.
+    """
+
+    def __init__(self, project: QgsProject, checked_layer_ids):
+        self.project = project
+        self.indexes = {}
+        self.legend_keys = {}
+        # 图层标题原来的样式, 范围内没有图例项时隐藏标题
+        self.title_styles = {}
+
+        for layer_id in checked_layer_ids.values():
+            layer = project.mapLayer(layer_id)
+            if layer is None or layer.renderer() is None:
+                continue
+            self.index_layer(layer)
+
+    def index_layer(self, layer):
+        transform = None
+        if layer.crs() != self.project.crs():
+            transform = QgsCoordinateTransform(layer.crs(), self.project.crs(), self.project)
+
+        context = QgsRenderContext()
+        expression_context = QgsExpressionContext()
+        expression_context.appendScope(QgsExpressionContextUtils.globalScope())
+        expression_context.appendScope(QgsExpressionContextUtils.projectScope(self.project))
+        expression_context.appendScope(QgsExpressionContextUtils.layerScope(layer))
+        context.setExpressionContext(expression_context)
+
+        renderer = layer.renderer().clone()
+        renderer.startRender(context, layer.fields())
+        request = QgsFeatureRequest().setSubsetOfAttributes(renderer.usedAttributes(context), layer.fields())
+
+        index = QgsSpatialIndex()
+        keys = {}
+        try:
+            for feature in layer.getFeatures(request):
+                if not feature.hasGeometry():
+                    continue
+                geom = feature.geometry()
+                if transform is not None:
+                    geom.transform(transform)
+                expression_context.setFeature(feature)
+                feature_keys = renderer.legendKeysForFeature(feature, context)
+                if not feature_keys:
+                    continue
+                index.addFeature(feature.id(), geom.boundingBox())
+                keys[feature.id()] = frozenset(feature_keys)
+        finally:
+            renderer.stopRender(context)
+
+        self.indexes[layer.id()] = index
+        self.legend_keys[layer.id()] = keys
+
+    def visible_keys(self, extent: QgsRectangle):
+        """
+        Returns:
+            dict: {图层id: 范围内出现的图例项rule key集合}
+        """
+        visible = {}
+        for layer_id, index in self.indexes.items():
+            keys = self.legend_keys[layer_id]
+            found = set()
+            for fid in index.intersects(extent):
+                found |= keys[fid]
+            visible[layer_id] = found
+        return visible
+
+    def apply(self, model, extent: QgsRectangle):
+        """按范围内出现的图例项设置图例模型中各图层显示的图例项"""
+        visible = self.visible_keys(extent)
+        for node in model.rootGroup().findLayers():
+            if node.layerId() not in visible:
+                continue
+            keys = visible[node.layerId()]
+
+            original = model.layerOriginalLegendNodes(node)
+            order = [i for i, legend_node in enumerate(original)
+                     if legend_node.data(QgsLayerTreeModelLegendNode.RuleKeyRole) in keys]
+            QgsMapLayerLegendUtils.setLegendNodeOrder(node, order)
+
+            if node.layerId() not in self.title_styles:
+                self.title_styles[node.layerId()] = QgsLegendRenderer.nodeLegendStyle(node, model)
+            title_style = self.title_styles[node.layerId()] if order else QgsLegendStyle.Style.Hidden
+            QgsLegendRenderer.setNodeLegendStyle(node, title_style)
+
+            model.refreshLayerLegend(node)
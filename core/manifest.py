@@ -0,0 +1,154 @@
+"""
+增量导出的清单文件out_path/manifest.json
+
+    settings: 影响出图结果的设置, 以及参与出图的图层的样式和数据版本的哈希, 变化时所有地块都要重新出图
+    blocks:   {fid: {"hash": 地块几何和属性的哈希, "output": 输出文件相对路径}}
+
+出图过程中定期写入清单, 任务取消或异常退出后重新运行时只渲染内容变化或者还没有完成的地块.
+"""
+import hashlib
+import json
+import os
+import time
+
+from qgis._core import QgsProject, QgsMapLayerStyle, QgsMessageLog, Qgis, QgsProviderRegistry, QgsVectorLayer
+
+from ..utils import MESSAGE_TAG
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 3
+
+# 影响输出图片或PDF的设置, 其中任何一个变化时所有地块都要重新出图
+OUTPUT_SETTINGS = ["out_width", "out_height", "out_resolution", "out_format", "radius", "draw_northarrow",
+                   "draw_scalebar", "draw_legend", "draw_circle", "export_engine", "layout_template",
+                   "decoration_cache", "legend_index", "mosaic_poi", "encoder_preset", "png_compression",
+                   "png_palette", "jpg_quality", "jpg_progressive", "webp_quality", "tif_compress", "pdf_single",
+                   "pdf_hybrid", "pdf_raster_dpi"]
+
+
+def output_file(config, fea_id):
+    """地块输出文件相对于out_path的路径"""
+    out_format = config.out_format
+    return os.path.join(out_format, f"out_{fea_id}.{out_format}")
+
+
+class export_manifest:
+    def __init__(self, out_path, checkpoint_interval=2):
+        self.out_path = out_path
+        self.path = os.path.join(out_path, MANIFEST_NAME)
+        self.checkpoint_interval = checkpoint_interval
+        self.settings = None
+        self.blocks = {}
+        self.block_hashes = {}
+        self.config = None
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+    def load(self, project: QgsProject, block_layer, config, checked_layer_ids=None):
+        """
+        读取已有清单并计算当前的设置哈希. 地块的哈希在出图前扫描地块时由check逐个计算,
+        不单独读取地块图层
+        """
+        self.config = config
+        self.settings = self.settings_hash(project, block_layer, config, checked_layer_ids)
+        self.block_hashes = {}
+
+        self.blocks = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            QgsMessageLog.logMessage("清单文件{}无法读取, 重新导出全部地块.".format(self.path),
+                                     tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
+            return
+        if manifest.get("version") == MANIFEST_VERSION and manifest.get("settings") == self.settings:
+            self.blocks = manifest.get("blocks", {})
+
+    def check(self, feature):
+        """
+        计算地块的哈希, 返回是否需要出图. 只保留需要出图的地块的哈希, 供done记录
+        """
+        key = str(feature.id())
+        block_hash = self.block_hash(feature)
+        if self.unchanged(key, block_hash):
+            return False
+        self.block_hashes[key] = block_hash
+        return True
+
+    def unchanged(self, key, block_hash):
+        """地块已经按相同的内容出图, 并且输出文件仍然存在"""
+        block = self.blocks.get(key)
+        return block is not None and block["hash"] == block_hash and \
+            os.path.exists(os.path.join(self.out_path, block["output"]))
+
+    def done(self, fea_id):
+        key = str(fea_id)
+        if key not in self.block_hashes:
+            return
+        self.blocks[key] = {"hash": self.block_hashes[key], "output": output_file(self.config, fea_id)}
+        self.dirty = True
+        if time.monotonic() - self.last_save >= self.checkpoint_interval:
+            self.save()
+
+    def save(self):
+        """先写临时文件再替换, 写入过程中中断也不会损坏已有的清单"""
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "settings": self.settings,
+            "blocks": self.blocks
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+    def close(self):
+        if self.dirty:
+            self.save()
+
+    @staticmethod
+    def block_hash(feature):
+        """地块的几何和属性; 扫描时只读取地块样式用到的字段, 其余字段为NULL, 不影响出图的字段变化时不会重新出图"""
+        h = hashlib.sha1()
+        if feature.hasGeometry():
+            h.update(bytes(feature.geometry().asWkb()))
+        h.update(json.dumps(feature.attributes(), ensure_ascii=False, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    @staticmethod
+    def settings_hash(project: QgsProject, block_layer, config, checked_layer_ids=None):
+        """影响出图结果的输出设置和图例图层, 以及参与出图的图层的数据源、数据版本和样式"""
+        settings = {name: getattr(config, name) for name in OUTPUT_SETTINGS}
+        settings["crs"] = project.crs().authid()
+        settings["checked_layer_ids"] = checked_layer_ids or {}
+        h = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+        for layer in project.mapThemeCollection().masterVisibleLayers():
+            style = QgsMapLayerStyle()
+            style.readFromLayer(layer)
+            h.update(layer.id().encode("utf-8"))
+            # 地块的变化由各地块的哈希判断, 只比较样式
+            if layer.id() != block_layer.id():
+                h.update(layer.source().encode("utf-8"))
+                h.update(layer_version(layer).encode("utf-8"))
+            h.update(style.xmlData().encode("utf-8"))
+        return h.hexdigest()
+
+
+def layer_version(layer):
+    """
+    图层数据的版本: 文件数据源取文件的修改时间和大小, 矢量图层再加上要素数和范围.
+    POI、线网等图层的数据修改后设置哈希随之变化, 所有地块重新出图
+    """
+    parts = []
+    path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get("path")
+    if path and os.path.exists(path):
+        stat = os.stat(path)
+        parts.append("{}:{}".format(stat.st_mtime_ns, stat.st_size))
+    if isinstance(layer, QgsVectorLayer):
+        parts.append(str(layer.featureCount()))
+        parts.append(layer.extent().toString())
+    return "|".join(parts)
@@ -0,0 +1,87 @@
+"""
+长批次出图的内存跟踪
+
+每个地块结束时记录进程RSS(MB)和Python分配的内存块数, 写入分阶段计时报告.
+最近一段地块的RSS按地块数线性拟合, 每个地块增长超过memory_warn_kb时在日志中警告.
+cleanup_every大于0时每隔N个地块释放整批复用的版面和缓存, 并执行一次垃圾回收.
+"""
+import collections
+import ctypes
+import gc
+import os
+import sys
+
+from qgis._core import QgsMessageLog, Qgis
+
+from ..utils import MESSAGE_TAG
+from .timing import growth_per_block
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_bytes():
+    """当前进程的常驻内存, 无法获取时返回None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    if sys.platform == "win32":
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+class memory_monitor:
+    """挂在stage_timer上, 每个地块结束时采样"""
+
+    # 拟合增长量的地块数
+    window = 50
+
+    def __init__(self, timer, warn_kb=512, cleanup_every=0, cleanup=None):
+        self.timer = timer
+        self.warn_kb = warn_kb
+        self.cleanup_every = cleanup_every
+        self.cleanup = cleanup
+        self.count = 0
+        self.samples = collections.deque(maxlen=self.window)
+        self.available = rss_bytes() is not None
+
+    def block_begin(self, fea_id):
+        pass
+
+    def block_end(self, fea_id):
+        self.count += 1
+        if self.cleanup_every > 0 and self.count % self.cleanup_every == 0:
+            if self.cleanup is not None:
+                self.cleanup()
+            gc.collect()
+
+        self.timer.annotate("py_blocks", sys.getallocatedblocks())
+        self.timer.annotate("pid", os.getpid())
+        if not self.available:
+            return
+        rss_mb = rss_bytes() / 1024 ** 2
+        self.timer.annotate("rss_mb", round(rss_mb, 1))
+        self.samples.append(rss_mb)
+
+        # 每个窗口最多警告一次
+        if len(self.samples) == self.window and self.count % self.window == 0:
+            growth_kb = growth_per_block(list(self.samples)) * 1024
+            if growth_kb > self.warn_kb:
+                QgsMessageLog.logMessage(
+                    "最近{}个地块内存每个增长{:.0f}KB, 当前{:.0f}MB, 可以开启定期清理(cleanup_every).".format(
+                        self.window, growth_kb, rss_mb), tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
@@ -0,0 +1,153 @@
+import collections
+import os.path
+import shutil
+
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QImage, QPainter
+from qgis._core import QgsMapSettings, QgsMapRendererParallelJob, QgsRectangle
+
+from .direct import direct_renderer
+
+
+def align_extent(extent: QgsRectangle, map_units_per_pixel, width, height) -> QgsRectangle:
+    """左上角对齐到拼接底图的像素网格, 大小为width x height像素"""
+    mupp = map_units_per_pixel
+    xmin = round(extent.xMinimum() / mupp) * mupp
+    ymax = round(extent.yMaximum() / mupp) * mupp
+    return QgsRectangle(xmin, ymax - height * mupp, xmin + width * mupp, ymax)
+
+
+def tile_range(pixel, length, tile_size):
+    """覆盖第pixel到pixel+length-1个像素的分块编号"""
+    return range(pixel // tile_size, (pixel + length - 1) // tile_size + 1)
+
+
+def tile_extent(col, row, tile_size, margin, map_units_per_pixel) -> QgsRectangle:
+    """
+    分块(col, row)连同四周margin像素的地图范围. 像素行号向下增大, 第0行的上边是y=0
+    """
+    mupp = map_units_per_pixel
+    return QgsRectangle((col * tile_size - margin) * mupp, -((row + 1) * tile_size + margin) * mupp,
+                        ((col + 1) * tile_size + margin) * mupp, -(row * tile_size - margin) * mupp)
+
+
+class mosaic_renderer(direct_renderer):
+    """
+    相邻地块的出图范围大量重叠, 底图部分每张图都要重新渲染一次.
+    mosaic引擎把地块图层以下的静态图层(影像底图、轨道线网, 可选POI)按输出分辨率渲染成一张分块的拼接底图,
+    分块在第一次用到时才渲染并保存到磁盘, 每个地块从中裁剪, 只在上面渲染地块图层以上的图层和装饰元素.
+
+    所有地块的像素网格对齐到同一原点, 地图范围最多平移不到一个像素.
+    """
+
+    tile_size = 1024
+    # 分块渲染时四周多渲染的像素, 使跨分块的标注在相邻分块中位置一致
+    tile_margin = 256
+
+    def __init__(self, project, block_layer, config, checked_layer_ids, init_extent=None, max_tiles=16,
+                 tile_cache=None):
+        super(mosaic_renderer, self).__init__(project, block_layer, config, checked_layer_ids, init_extent, tile_cache)
+
+        layers = self.overlay.map_layers(project)
+        poi_id = checked_layer_ids.get("POI")
+        # 从最底层开始, 直到地块图层(或者不拼接时的POI图层)为止的图层都是静态图层
+        self.mosaic_layers = []
+        for layer in reversed(layers):
+            if layer.id() == self.overlay.layer.id() or (not config.mosaic_poi and layer.id() == poi_id):
+                break
+            self.mosaic_layers.insert(0, layer)
+        self.block_layers = layers[:len(layers) - len(self.mosaic_layers)]
+
+        self.tile_dir = os.path.join(config.out_path, f"_mosaic_{os.getpid()}")
+        self.tiles = collections.OrderedDict()
+        self.max_tiles = max_tiles
+        self.map_units_per_pixel = None
+
+    def block_map_settings(self, centroid):
+        settings = self.map_settings(self.block_extent(centroid))
+        map_units_per_pixel = settings.mapUnitsPerPixel()
+        if self.map_units_per_pixel is None or \
+                abs(map_units_per_pixel - self.map_units_per_pixel) > 1e-9 * self.map_units_per_pixel:
+            # 分辨率变化时原有分块不能再用
+            self.clear_tiles()
+            self.map_units_per_pixel = map_units_per_pixel
+
+        # 左上角对齐到拼接底图的像素网格, 像素行号向下增大
+        return self.map_settings(align_extent(settings.visibleExtent(), self.map_units_per_pixel,
+                                              self.config.out_width, self.config.out_height))
+
+    def draw_map(self, painter: QPainter, settings: QgsMapSettings):
+        # settings可能是整个地块或者分条渲染的一个条带, 范围都已对齐到像素网格
+        extent = settings.visibleExtent()
+        output_size = settings.outputSize()
+        pixel_x = int(round(extent.xMinimum() / self.map_units_per_pixel))
+        pixel_y = int(round(-extent.yMaximum() / self.map_units_per_pixel))
+
+        size = self.tile_size
+        for col in tile_range(pixel_x, output_size.width(), size):
+            for row in tile_range(pixel_y, output_size.height(), size):
+                painter.drawImage(col * size - pixel_x, row * size - pixel_y, self.tile(col, row))
+
+        if len(self.block_layers) > 0:
+            job = QgsMapRendererParallelJob(self.map_settings(settings.extent(), self.block_layers, output_size))
+            job.start()
+            job.waitForFinished()
+            painter.drawImage(0, 0, job.renderedImage())
+
+    def tile(self, col, row) -> QImage:
+        key = (col, row)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        path = os.path.join(self.tile_dir, f"{col}_{row}.bmp")
+        image = QImage(path) if os.path.exists(path) else None
+        if image is None or image.isNull():
+            image = self.render_tile(col, row)
+            os.makedirs(self.tile_dir, exist_ok=True)
+            image.save(path, "BMP")
+
+        self.tiles[key] = image
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return image
+
+    def render_tile(self, col, row) -> QImage:
+        size = self.tile_size
+        margin = self.tile_margin
+        extent = tile_extent(col, row, size, margin, self.map_units_per_pixel)
+
+        image = QImage(QSize(size, size), QImage.Format_RGB32)
+        image.setDotsPerMeterX(self.dots_per_meter)
+        image.setDotsPerMeterY(self.dots_per_meter)
+        image.fill(Qt.white)
+        if len(self.mosaic_layers) == 0:
+            return image
+
+        job = QgsMapRendererParallelJob(self.map_settings(extent, self.mosaic_layers,
+                                                          QSize(size + 2 * margin, size + 2 * margin)))
+        job.start()
+        job.waitForFinished()
+
+        painter = QPainter(image)
+        try:
+            painter.drawImage(-margin, -margin, job.renderedImage())
+        finally:
+            painter.end()
+        return image
+
+    def release_caches(self):
+        # 内存中的分块释放后仍可以从磁盘读回
+        super(mosaic_renderer, self).release_caches()
+        self.tiles.clear()
+
+    def clear_tiles(self):
+        self.tiles.clear()
+        if os.path.exists(self.tile_dir):
+            shutil.rmtree(self.tile_dir, ignore_errors=True)
+
+    def close(self):
+        try:
+            self.clear_tiles()
+        finally:
+            super(mosaic_renderer, self).close()
@@ -0,0 +1,36 @@
+from qgis._core import QgsVectorLayer, QgsWkbTypes, QgsFeature, QgsProject
+
+
+class block_overlay_layer:
+    """
+    只包含当前地块的内存图层, 样式从地块图层复制.
+    出图时用它替换地块图层, 效果与按fid过滤地块图层相同, 但不会修改地块图层的过滤条件.
+    substitutes为{图层id: 图层}, 出图时同样替换掉的其它图层(例如底图瓦片的本地缓存), 都不加入工程.
+    """
+
+    def __init__(self, block_layer: QgsVectorLayer, substitutes=None):
+        self.block_layer = block_layer
+        self.substitutes = {} if substitutes is None else substitutes
+        self.layer = QgsVectorLayer(QgsWkbTypes.displayString(block_layer.wkbType()), block_layer.name(), "memory")
+        self.layer.setCrs(block_layer.crs())
+        self.layer.dataProvider().addAttributes(block_layer.fields().toList())
+        self.layer.updateFields()
+
+        self.layer.setRenderer(block_layer.renderer().clone())
+        self.layer.setOpacity(block_layer.opacity())
+        self.layer.setBlendMode(block_layer.blendMode())
+        if block_layer.labeling() is not None:
+            self.layer.setLabeling(block_layer.labeling().clone())
+            self.layer.setLabelsEnabled(block_layer.labelsEnabled())
+
+    def set_feature(self, feature):
+        provider = self.layer.dataProvider()
+        provider.truncate()
+        provider.addFeatures([QgsFeature(feature)])
+        self.layer.updateExtents()
+
+    def map_layers(self, project: QgsProject):
+        """当前工程中可见的图层, 其中的地块图层替换为内存图层, 顺序与地图画布一致"""
+        layers = project.mapThemeCollection().masterVisibleLayers()
+        return [self.layer if layer.id() == self.block_layer.id() else self.substitutes.get(layer.id(), layer)
+                for layer in layers]
@@ -0,0 +1,137 @@
+"""
+整批地块输出为一个多页PDF
+
+逐个地块输出PDF时每个文件都要重复嵌入字体和SVG符号. 合并模式下由block_page_iterator依次把版面切换到各个地块,
+QgsLayoutExporter把所有页面写入同一个文档, 字体和符号在各页之间共用.
+混合PDF中最下面的栅格图层按较低的分辨率渲染成一张图片放在地图下面, 其余图层保持矢量.
+并行导出时每个子进程输出自己那一段地块的PDF, 最后按顺序合并, 合并只拼接页面不会重新栅格化.
+"""
+import os
+import traceback
+
+from qgis._core import QgsAbstractLayoutIterator, QgsMessageLog, Qgis, QgsLayoutExporter, QgsMapLayerType
+
+from ..utils import MESSAGE_TAG
+
+PDF_BATCH_NAME = "batch.pdf"
+
+
+def pdf_export_settings(config):
+    """
+    混合PDF中栅格底图已经由渲染器按pdf_raster_dpi渲染成地图下面的图片, 版面中的地图只含矢量图层,
+    按输出分辨率简化几何; 不强制矢量输出, 含有透明度等效果的地图项仍可以栅格化
+    """
+    settings = QgsLayoutExporter.PdfExportSettings()
+    if config.pdf_hybrid:
+        settings.rasterizeWholeImage = False
+        settings.forceVectorOutput = False
+        settings.simplifyGeometries = True
+    return settings
+
+
+def split_underlay_layers(layers):
+    """
+    把地图图层(从上到下)分为保持矢量的图层和最下面连续的栅格图层.
+    只有压在所有矢量图层下面的栅格图层(影像、XYZ底图及其缓存)可以单独渲染成图片而不改变叠加顺序,
+    夹在矢量图层之间的栅格图层仍留在地图中.
+
+    Returns:
+        tuple: (地图中保留的图层, 渲染成底图图片的栅格图层)
+    """
+    split = len(layers)
+    while split > 0 and layers[split - 1].type() == QgsMapLayerType.RasterLayer:
+        split -= 1
+    return layers[:split], layers[split:]
+
+
+def part_name(index):
+    return f"_part_{index}.pdf"
+
+
+class block_page_iterator(QgsAbstractLayoutIterator):
+    """
+    把渲染器的prepare_pages包装成版面迭代器, 每次next把版面切换到下一个地块.
+    next在QGIS的导出过程中调用, 异常不能直接抛出, 先记录下来导出结束后再抛出.
+    """
+
+    def __init__(self, renderer, pages, count, on_page=None, is_canceled=None):
+        super(block_page_iterator, self).__init__()
+        self.renderer = renderer
+        self.pages = pages
+        self.page_count = count
+        self.on_page = on_page
+        self.is_canceled = is_canceled
+        self.exception = None
+
+    def layout(self):
+        return self.renderer.layout
+
+    def beginRender(self):
+        return True
+
+    def endRender(self):
+        return True
+
+    def count(self):
+        return self.page_count
+
+    def filePath(self, baseFilePath, extension):
+        return baseFilePath
+
+    def next(self):
+        if self.exception is not None or (self.is_canceled is not None and self.is_canceled()):
+            return False
+        try:
+            fea_id = next(self.pages)
+        except StopIteration:
+            return False
+        except:
+            self.exception = Exception(traceback.format_exc())
+            return False
+
+        if self.on_page is not None:
+            self.on_page(fea_id)
+        return True
+
+
+def merge_available():
+    """合并各子进程的PDF需要pypdf"""
+    try:
+        import pypdf
+    except ImportError:
+        return False
+    return True
+
+
+def merge_pdfs(parts, path):
+    """
+    按顺序合并各子进程输出的PDF, 需要安装pypdf; 没有安装或缺少某段PDF时保留各段PDF
+
+    Returns:
+        bool: 是否合并成功
+    """
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        QgsMessageLog.logMessage("没有安装pypdf, 无法合并PDF, 各段结果保留在{}.".format(os.path.dirname(path)),
+                                 tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
+        return False
+
+    missing = [part for part in parts if not os.path.exists(part)]
+    if len(missing) > 0:
+        QgsMessageLog.logMessage("缺少分段PDF{}, 无法合并.".format(", ".join(missing)),
+                                 tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
+        return False
+
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(part)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        writer.write(f)
+    writer.close()
+    os.replace(tmp_path, path)
+
+    for part in parts:
+        os.remove(part)
+    return True
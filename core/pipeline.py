@@ -0,0 +1,204 @@
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtGui import QImage, QImageWriter
+from osgeo import gdal
+
+# 输出格式对应的Qt图片格式名称
+IMAGE_FORMATS = {"png": "PNG", "jpg": "JPG", "bmp": "BMP", "tif": "TIFF", "webp": "WEBP"}
+TIF_COMPRESS = ["NONE", "LZW", "DEFLATE"]
+
+
+def encoder_options(config):
+    """各格式的编码参数"""
+    return {
+        "png_compression": config.png_compression,
+        "png_palette": config.png_palette,
+        "jpg_quality": config.jpg_quality,
+        "jpg_progressive": config.jpg_progressive,
+        "webp_quality": config.webp_quality,
+        "tif_compress": config.tif_compress
+    }
+
+
+def png_quality(compression):
+    """
+    Qt的PNG插件用quality表示压缩级别, 换算为 level = (100 - quality) * 9 // 91,
+    这里取能得到给定压缩级别的最大quality
+    """
+    compression = min(max(int(compression), 0), 9)
+    return 100 - math.ceil(compression * 91 / 9)
+
+
+def write_palette_png(image: QImage, path, compression):
+    """
+    用Pillow把图片量化为最多256色的调色板PNG.
+    QImage直接转换为Indexed8只是映射到固定色表, 渐变和半透明边缘会出现明显色带.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise Exception("PNG调色板量化需要安装Pillow, 请安装后重试或关闭PNG调色板选项.")
+
+    image = image.convertToFormat(QImage.Format_RGBA8888)
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    rgba = Image.frombuffer("RGBA", (image.width(), image.height()), bytes(bits), "raw", "RGBA",
+                            image.bytesPerLine(), 1)
+    quantized = rgba.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    quantized.save(path, format="PNG", compress_level=min(max(int(compression), 0), 9))
+
+
+class image_writer:
+    """
+    出图流水线中的编码和写盘阶段.
+    渲染线程提交图片后立即返回继续渲染下一个地块, 由编码线程池压缩并写入磁盘;
+    等待编码的图片数量有上限, 编码跟不上时阻塞渲染线程, 避免积压的图片占满内存.
+    workers为0时在渲染线程中同步写出.
+    有timer时编码线程的耗时按地块记入encode阶段.
+
+    编码线程写完的地块由drain取出, 写出失败的地块带有错误信息, 只报告一次,
+    不影响之后提交的地块.
+    """
+
+    def __init__(self, workers=2, options=None, max_pending=None, timer=None):
+        self.workers = workers
+        self.options = {} if options is None else options
+        self.timer = timer
+        self.executor = None
+        # 已提交还没有写完的地块, 以及写完等待取出的(地块, 错误信息)
+        self.pending = set()
+        self.results = []
+        self.lock = threading.Lock()
+        if workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+            self.slots = threading.Semaphore(2 * workers if max_pending is None else max_pending)
+
+    def submit(self, image: QImage, path, out_format, fea_id=None):
+        """
+        Args:
+            image (QImage): 渲染好的图片, 提交后不能再修改, 复用的图片需要先copy
+            path: 输出文件路径
+            out_format: 输出格式, 例如png
+            fea_id: 图片所属的地块, 用于计时和报告写出结果
+        """
+        if self.executor is None:
+            self.write(image, path, out_format)
+            return
+
+        self.slots.acquire()
+        with self.lock:
+            self.pending.add(fea_id)
+        try:
+            future = self.executor.submit(self._write, image, path, out_format, fea_id)
+        except:
+            with self.lock:
+                self.pending.discard(fea_id)
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+
+    def _write(self, image, path, out_format, fea_id):
+        error = None
+        try:
+            start = time.perf_counter()
+            self.write(image, path, out_format)
+            if self.timer is not None and fea_id is not None:
+                self.timer.add(fea_id, "encode", time.perf_counter() - start)
+        except:
+            error = traceback.format_exc()
+        with self.lock:
+            self.pending.discard(fea_id)
+            self.results.append((fea_id, error))
+
+    def is_pending(self, fea_id):
+        """地块的图片是否还在等待编码线程写出"""
+        with self.lock:
+            return fea_id in self.pending
+
+    def drain(self):
+        """
+        取出编码线程已经写完的地块
+
+        Returns:
+            list: [(地块fid, 错误信息)], 写出成功时错误信息为None
+        """
+        with self.lock:
+            results = self.results
+            self.results = []
+        return results
+
+    def write(self, image: QImage, path, out_format):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换, 中断时不会留下不完整的输出文件
+        tmp_path = path + ".tmp"
+        if out_format == "tif":
+            write_tiff(image, tmp_path, self.options.get("tif_compress", "LZW"))
+        else:
+            self.write_image(image, tmp_path, out_format)
+        os.replace(tmp_path, path)
+
+    def write_image(self, image: QImage, path, out_format):
+        options = self.options
+        if out_format == "png" and options.get("png_palette", False):
+            write_palette_png(image, path, options.get("png_compression", 4))
+            return
+
+        writer = QImageWriter(path, IMAGE_FORMATS.get(out_format, out_format.upper()).encode())
+        if out_format == "png":
+            writer.setQuality(png_quality(options.get("png_compression", 4)))
+        elif out_format == "jpg":
+            writer.setQuality(options.get("jpg_quality", 90))
+            writer.setProgressiveScanWrite(options.get("jpg_progressive", False))
+        elif out_format == "webp":
+            writer.setQuality(options.get("webp_quality", 100))
+
+        result = writer.write(image)
+        error = writer.errorString()
+        writer.device().close()
+        if not result:
+            raise Exception("图片{}保存失败: {}".format(path, error))
+
+    def close(self):
+        """等待所有图片写完, 写出结果仍由drain取出"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+def write_tiff(image: QImage, path, compress="LZW"):
+    """用GDAL写出分块压缩的RGBA TIFF"""
+    if compress not in TIF_COMPRESS:
+        raise Exception("TIFF压缩方式{}不存在, 可选: {}.".format(compress, ", ".join(TIF_COMPRESS)))
+
+    image = image.convertToFormat(QImage.Format_ARGB32)
+    width, height = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * height)
+
+    options = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "PHOTOMETRIC=RGB", "ALPHA=YES"]
+    if compress != "NONE":
+        options += [f"COMPRESS={compress}", "PREDICTOR=2"]
+    dataset = gdal.GetDriverByName("GTiff").Create(path, width, height, 4, gdal.GDT_Byte, options)
+    if dataset is None:
+        raise Exception("图片{}创建失败: {}".format(path, gdal.GetLastErrorMsg()))
+
+    dpi = image.dotsPerMeterX() * 0.0254
+    if dpi > 0:
+        dataset.SetMetadataItem("TIFFTAG_XRESOLUTION", str(round(dpi)))
+        dataset.SetMetadataItem("TIFFTAG_YRESOLUTION", str(round(dpi)))
+        dataset.SetMetadataItem("TIFFTAG_RESOLUTIONUNIT", "2")
+
+    # ARGB32按32位整数存储, 小端机器上内存中的字节顺序为B, G, R, A
+    band_list = [3, 2, 1, 4] if sys.byteorder == "little" else [4, 1, 2, 3]
+    err = dataset.WriteRaster(0, 0, width, height, bytes(bits), width, height, gdal.GDT_Byte, band_list,
+                              4, image.bytesPerLine(), 1)
+    dataset.FlushCache()
+    dataset = None
+    if err != 0:
+        raise Exception("图片{}写入失败: {}".format(path, gdal.GetLastErrorMsg()))
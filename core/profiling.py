@@ -0,0 +1,134 @@
+"""
+出图和符号化的性能剖析
+
+    profile_every:     每隔N个地块用cProfile剖析一个地块, 写出out_path/profile/block_<fid>.prof
+    profile_sample_ms: 采样间隔(毫秒), 后台线程定期采样渲染线程的Python调用栈,
+                       写出out_path/profile/samples_<pid>.folded, 每行"调用栈 次数", 可直接用flamegraph.pl或speedscope打开
+
+两者为0时不剖析, 没有额外开销.
+"""
+import cProfile
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+PROFILE_DIR = "profile"
+
+
+def profile_dir(out_path):
+    return os.path.join(out_path, PROFILE_DIR)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class sampling_profiler:
+    """在后台线程中按固定间隔采样目标线程的调用栈, 累计相同调用栈出现的次数"""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stacks = collections.Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="renderUP-sampler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def write(self, path):
+        """折叠栈格式, 按次数从多到少排列"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class block_profiler:
+    """
+    挂在stage_timer上, 由地块的开始和结束驱动, 所有导出引擎和并行子进程的用法一致.
+    合并PDF时地块在下一个地块开始时才结束, 剖析结果包含QGIS导出该页的时间.
+    """
+
+    def __init__(self, out_path, every=0, sample_ms=0):
+        self.dir = profile_dir(out_path)
+        self.every = every
+        self.count = 0
+        self.profile = None
+        self.fea_id = None
+        self.sampler = None
+        if sample_ms > 0:
+            self.sampler = sampling_profiler(sample_ms / 1000)
+            self.sampler.start()
+
+    def block_begin(self, fea_id):
+        if self.every <= 0:
+            return
+        self.count += 1
+        if (self.count - 1) % self.every != 0:
+            return
+        self.fea_id = fea_id
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def block_end(self, fea_id):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        os.makedirs(self.dir, exist_ok=True)
+        self.profile.dump_stats(os.path.join(self.dir, f"block_{self.fea_id}.prof"))
+        self.profile = None
+
+    def close(self):
+        if self.profile is not None:
+            self.block_end(self.fea_id)
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler.write(os.path.join(self.dir, f"samples_{os.getpid()}.folded"))
+            self.sampler = None
+
+
+@contextlib.contextmanager
+def profile_call(out_path, name, enabled=True, sample_ms=5):
+    """剖析一次调用(例如一键符号化), 写出<name>_<时间>.prof和.folded"""
+    if not enabled:
+        yield
+        return
+
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    base = os.path.join(profile_dir(out_path), f"{name}_{stamp}")
+    sampler = sampling_profiler(max(sample_ms, 1) / 1000)
+    profile = cProfile.Profile()
+    sampler.start()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        sampler.stop()
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        profile.dump_stats(base + ".prof")
+        sampler.write(base + ".folded")
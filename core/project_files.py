@@ -0,0 +1,183 @@
+"""
+批量导出时每个地块对应的工程文件
+
+    full:    每个地块完整写出一个{fid}.qgs(原有方式)
+    none:    不写工程文件
+    sidecar: 整批只写一个template.qgs, 每个地块写一个很小的{fid}.json记录差异
+    qgz:     整批只序列化一次工程, 由后台线程按地块修改版面中的地图范围和圆圈后压缩写出{fid}.qgz
+"""
+import io
+import json
+import os
+import queue
+import threading
+import traceback
+import zipfile
+import xml.etree.ElementTree as ET
+
+from qgis._core import QgsProject, QgsLayoutItemRegistry, QgsProviderRegistry
+
+PROJECT_FILE_MODES = ["full", "none", "sidecar", "qgz"]
+TEMPLATE_NAME = "template.qgs"
+
+
+class project_file_writer:
+    def __init__(self, project: QgsProject, mode, work_dir, layout_name, max_pending=8):
+        if mode not in PROJECT_FILE_MODES:
+            raise Exception("工程文件输出方式{}不存在, 可选: {}.".format(mode, ", ".join(PROJECT_FILE_MODES)))
+
+        self.project = project
+        self.mode = mode
+        self.work_dir = work_dir
+        self.layout_name = layout_name
+        self.template_path = os.path.join(work_dir, TEMPLATE_NAME)
+        self.template_xml = None
+        self.exception = None
+
+        self.queue = None
+        self.thread = None
+        if mode == "qgz":
+            # 有界队列, 写盘跟不上渲染时阻塞渲染线程, 避免积压的工程内容占满内存
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self._write_loop, daemon=True)
+            self.thread.start()
+
+    def needs_project(self):
+        """这次写出是否要序列化当前工程: full每个地块都要, 模板方式只在第一个地块写模板时需要"""
+        return self.mode == "full" or (self.mode != "none" and self.template_xml is None)
+
+    def write(self, fea_id, block_info: dict):
+        """
+        Args:
+            fea_id: 地块fid
+            block_info (dict): 地块差异信息, 包括地图范围extent, 圆圈位置circle(版面毫米坐标), 装饰元素开关,
+                               以及地块图层block_layer和只显示当前地块的过滤条件subset
+        """
+        if self.mode == "none":
+            return
+        if self.mode == "full":
+            path = os.path.join(self.work_dir, f"{fea_id}.qgs")
+            if not self.project.write(path):
+                raise Exception("工程文件{}写入失败.".format(path))
+            # 地块图层本身不设置过滤条件, 只在写出的工程文件中过滤当前地块
+            if block_info.get("block_layer") is not None:
+                with open(path, "rb") as f:
+                    xml = patch_block_layer_xml(f.read(), block_info)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(xml)
+                os.replace(path + ".tmp", path)
+            return
+
+        if self.template_xml is None:
+            self.write_template()
+
+        if self.mode == "sidecar":
+            sidecar = dict(block_info, fid=fea_id, template=TEMPLATE_NAME, layout=self.layout_name)
+            with open(os.path.join(self.work_dir, f"{fea_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(sidecar, f, ensure_ascii=False, indent=2)
+        else:
+            if self.exception is not None:
+                raise self.exception
+            self.queue.put((fea_id, block_info))
+
+    def write_template(self):
+        # 并行导出时多个进程共用同一目录, 先写到各自的临时文件再替换
+        # write会修改当前工程的文件名, 写完后恢复
+        tmp_path = os.path.join(self.work_dir, f"_template_{os.getpid()}.qgs")
+        file_name = self.project.fileName()
+        if not self.project.write(tmp_path):
+            raise Exception("工程文件{}写入失败.".format(tmp_path))
+        self.project.setFileName(file_name)
+
+        with open(tmp_path, "rb") as f:
+            self.template_xml = f.read()
+        if self.mode == "sidecar":
+            os.replace(tmp_path, self.template_path)
+        else:
+            os.remove(tmp_path)
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.exception is not None:
+            raise self.exception
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.exception is not None:
+                continue
+
+            fea_id, block_info = item
+            try:
+                xml = patch_layout_xml(self.template_xml, self.layout_name, block_info)
+                path = os.path.join(self.work_dir, f"{fea_id}.qgz")
+                with zipfile.ZipFile(path + ".tmp", "w", compression=zipfile.ZIP_DEFLATED) as z:
+                    z.writestr(f"{fea_id}.qgs", xml)
+                os.replace(path + ".tmp", path)
+            except:
+                self.exception = Exception(traceback.format_exc())
+
+
+def subset_source(provider, source, subset):
+    """把图层数据源中的过滤条件替换为subset"""
+    parts = QgsProviderRegistry.instance().decodeUri(provider, source)
+    # postgres等数据库图层的过滤条件为sql, ogr为subset
+    parts["sql" if "sql" in parts else "subset"] = subset
+    return QgsProviderRegistry.instance().encodeUri(provider, parts)
+
+
+def set_block_subset(root, block_info: dict):
+    """把工程XML中地块图层数据源的过滤条件替换为只显示当前地块"""
+    if block_info.get("block_layer") is None:
+        return
+    for maplayer in root.iter("maplayer"):
+        if maplayer.findtext("id") != block_info["block_layer"]:
+            continue
+        datasource = maplayer.find("datasource")
+        provider = maplayer.find("provider")
+        if datasource is not None and provider is not None:
+            datasource.text = subset_source(provider.text, datasource.text, block_info["subset"])
+
+
+def patch_block_layer_xml(project_xml: bytes, block_info: dict) -> bytes:
+    """只修改地块图层的过滤条件"""
+    tree = ET.parse(io.BytesIO(project_xml))
+    set_block_subset(tree.getroot(), block_info)
+    out = io.BytesIO()
+    tree.write(out, encoding="utf-8", xml_declaration=False)
+    return out.getvalue()
+
+
+def patch_layout_xml(template_xml: bytes, layout_name, block_info: dict) -> bytes:
+    """把模板工程中出图版面的地图范围、圆圈位置以及地块图层的过滤条件替换为当前地块的值"""
+    tree = ET.parse(io.BytesIO(template_xml))
+
+    set_block_subset(tree.getroot(), block_info)
+    map_type = str(QgsLayoutItemRegistry.LayoutMap)
+    shape_type = str(QgsLayoutItemRegistry.LayoutShape)
+
+    for layout in tree.getroot().iter("Layout"):
+        if layout.get("name") != layout_name:
+            continue
+        for item in layout.iter("LayoutItem"):
+            if item.get("type") == map_type:
+                extent = item.find("Extent")
+                if extent is not None:
+                    xmin, ymin, xmax, ymax = block_info["extent"]
+                    extent.set("xmin", repr(xmin))
+                    extent.set("ymin", repr(ymin))
+                    extent.set("xmax", repr(xmax))
+                    extent.set("ymax", repr(ymax))
+            elif item.get("type") == shape_type and block_info.get("circle") is not None:
+                circle = block_info["circle"]
+                item.set("position", "{},{},mm".format(circle["x"], circle["y"]))
+                item.set("size", "{},{},mm".format(circle["size"], circle["size"]))
+
+    out = io.BytesIO()
+    tree.write(out, encoding="utf-8", xml_declaration=False)
+    return out.getvalue()
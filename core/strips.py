@@ -0,0 +1,170 @@
+"""
+超大尺寸输出的分条渲染
+
+输出图片超过内存上限时按水平条带渲染, 每个条带渲染完立即写入分块TIFF或者流式PNG, 内存中最多只有一个条带.
+"""
+import os
+import struct
+import sys
+import zlib
+
+from PyQt5.QtGui import QImage
+from osgeo import gdal
+
+# 可以按条带流式写出的格式
+STRIP_FORMATS = ["png", "tif"]
+# 调色板量化需要整张图片的颜色分布, 各条带分别量化时色表不一致
+PALETTE_STRIPS_ERROR = "PNG调色板不能与分条写出同时使用, 请关闭PNG调色板或调大条带内存上限."
+
+
+def strip_rows(width, height, max_mb, overlap=0):
+    """
+    按内存上限划分条带
+
+    Args:
+        width, height: 输出图片大小(像素)
+        max_mb: 单个条带缓冲区(含上下重叠部分)的内存上限(MB)
+        overlap: 条带上下各多渲染的像素
+
+    Returns:
+        list: [(起始行, 行数)], 整张图片不超过上限时返回None
+    """
+    max_bytes = max_mb * 1024 * 1024
+    if width * height * 4 <= max_bytes:
+        return None
+    # 缓冲区能容纳的行数减去上下重叠的行数才是每个条带实际输出的行数
+    rows = max_bytes // (width * 4) - 2 * overlap
+    if rows < 1:
+        raise Exception("条带内存上限{}MB不足以容纳宽{}像素的1行输出及上下各{}行重叠, 请调大条带内存上限.".format(
+            max_mb, width, overlap))
+    return [(y, min(rows, height - y)) for y in range(0, height, rows)]
+
+
+class png_stream_writer:
+    """逐行压缩写出RGBA PNG, 不需要整张图片的缓冲区"""
+
+    def __init__(self, path, width, height, compression=4, dpi=None):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.compressor = zlib.compressobj(min(max(int(compression), 0), 9))
+
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        if dpi:
+            pixels_per_meter = int(round(dpi / 0.0254))
+            self.chunk(b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1))
+
+    def chunk(self, chunk_type, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def write_strip(self, image: QImage):
+        # RGBA8888的字节顺序与机器字节序无关, 每行前加过滤类型0
+        image = image.convertToFormat(QImage.Format_RGBA8888)
+        bits = image.constBits()
+        bits.setsize(image.bytesPerLine() * image.height())
+        data = bytes(bits)
+        row_bytes = self.width * 4
+        raw = bytearray()
+        for y in range(image.height()):
+            start = y * image.bytesPerLine()
+            raw += b"\x00"
+            raw += data[start:start + row_bytes]
+        compressed = self.compressor.compress(bytes(raw))
+        if compressed:
+            self.chunk(b"IDAT", compressed)
+        self.rows += image.height()
+
+    def close(self):
+        self.chunk(b"IDAT", self.compressor.flush())
+        self.chunk(b"IEND", b"")
+        self.file.close()
+        if self.rows != self.height:
+            os.remove(self.tmp_path)
+            raise Exception("图片{}只写出{}行, 应为{}行.".format(self.path, self.rows, self.height))
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+class tiff_stream_writer:
+    """用GDAL按条带写出分块压缩的RGBA TIFF"""
+
+    def __init__(self, path, width, height, compress="LZW", dpi=None):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.width = width
+        self.height = height
+        self.rows = 0
+
+        options = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "PHOTOMETRIC=RGB", "ALPHA=YES", "BIGTIFF=IF_SAFER"]
+        if compress != "NONE":
+            options += [f"COMPRESS={compress}", "PREDICTOR=2"]
+        self.dataset = gdal.GetDriverByName("GTiff").Create(self.tmp_path, width, height, 4, gdal.GDT_Byte, options)
+        if self.dataset is None:
+            raise Exception("图片{}创建失败: {}".format(path, gdal.GetLastErrorMsg()))
+        if dpi:
+            self.dataset.SetMetadataItem("TIFFTAG_XRESOLUTION", str(round(dpi)))
+            self.dataset.SetMetadataItem("TIFFTAG_YRESOLUTION", str(round(dpi)))
+            self.dataset.SetMetadataItem("TIFFTAG_RESOLUTIONUNIT", "2")
+
+    def write_strip(self, image: QImage):
+        image = image.convertToFormat(QImage.Format_ARGB32)
+        bits = image.constBits()
+        bits.setsize(image.bytesPerLine() * image.height())
+        band_list = [3, 2, 1, 4] if sys.byteorder == "little" else [4, 1, 2, 3]
+        err = self.dataset.WriteRaster(0, self.rows, self.width, image.height(), bytes(bits),
+                                       self.width, image.height(), gdal.GDT_Byte, band_list,
+                                       4, image.bytesPerLine(), 1)
+        if err != 0:
+            raise Exception("图片{}写入失败: {}".format(self.path, gdal.GetLastErrorMsg()))
+        self.rows += image.height()
+
+    def close(self):
+        self.dataset.FlushCache()
+        self.dataset = None
+        if self.rows != self.height:
+            os.remove(self.tmp_path)
+            raise Exception("图片{}只写出{}行, 应为{}行.".format(self.path, self.rows, self.height))
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.dataset = None
+        os.remove(self.tmp_path)
+
+
+def open_strip_writer(path, out_format, width, height, options, dpi=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if out_format == "png":
+        if options.get("png_palette", False):
+            raise Exception(PALETTE_STRIPS_ERROR)
+        return png_stream_writer(path, width, height, options.get("png_compression", 4), dpi)
+    if out_format == "tif":
+        return tiff_stream_writer(path, width, height, options.get("tif_compress", "LZW"), dpi)
+    raise Exception("{}格式不支持分条写出, 可选: {}.".format(out_format, ", ".join(STRIP_FORMATS)))
+
+
+def write_strips(path, out_format, width, height, options, dpi, strips, render_strip):
+    """
+    依次渲染并写出各个条带
+
+    Args:
+        strips: strip_rows划分的条带
+        render_strip: render_strip(y, rows)返回该条带的QImage
+    """
+    writer = open_strip_writer(path, out_format, width, height, options, dpi)
+    try:
+        for y, rows in strips:
+            writer.write_strip(render_strip(y, rows))
+    except:
+        writer.abort()
+        raise
+    writer.close()
@@ -0,0 +1,148 @@
+"""
+批量出图的实时状态
+
+按最近一段时间内完成的地块计算出图速度(个/分钟)和预计剩余时间, 显示在任务描述中,
+并定期写入out_path/status.json, 供外部监控读取:
+
+    state:         running, finished, failed, canceled
+    total, done:   需要出图和已经完成的地块数
+    errors:        出错的地块数, missing为不存在的地块数
+    current_fid:   正在出图(并行时为最近完成)的地块
+    rate_per_min:  滑动窗口内的出图速度
+    eta_seconds:   按当前速度估算的剩余时间
+    last_latency:  最近两个地块完成的时间间隔(秒)
+"""
+import collections
+import json
+import os
+import time
+
+STATUS_NAME = "status.json"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours > 0:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class export_telemetry:
+    # 计算速度的滑动窗口(秒)
+    window = 300
+    # 状态文件的写入间隔(秒)
+    status_interval = 5
+    # 任务描述的刷新间隔(秒)
+    description_interval = 1
+
+    def __init__(self, total, out_path):
+        self.total = total
+        self.path = os.path.join(out_path, STATUS_NAME)
+        self.done = 0
+        self.errors = 0
+        self.missing = 0
+        self.current_fid = None
+        self.last_latency = None
+        self.start_time = time.monotonic()
+        self.last_done = self.start_time
+        self.completions = collections.deque()
+        self.last_status = 0.0
+        self.last_description = 0.0
+
+    def reset_clock(self):
+        """出图正式开始时调用, 之前的准备时间(例如瓦片预取)不计入速度"""
+        self.start_time = time.monotonic()
+        self.last_done = self.start_time
+
+    def started(self, fea_id):
+        self.current_fid = fea_id
+
+    def block_done(self, fea_id):
+        now = time.monotonic()
+        self.done += 1
+        self.current_fid = fea_id
+        self.last_latency = now - self.last_done
+        self.last_done = now
+        self.completions.append(now)
+        while len(self.completions) > 0 and now - self.completions[0] > self.window:
+            self.completions.popleft()
+
+    def block_failed(self, fea_id):
+        self.errors += 1
+        self.current_fid = fea_id
+
+    def block_missing(self, fea_id):
+        self.missing += 1
+
+    def rate(self):
+        """滑动窗口内每分钟完成的地块数; 窗口未满时按实际经过的时间计算"""
+        if len(self.completions) == 0:
+            return 0.0
+        now = time.monotonic()
+        span = min(self.window, now - self.start_time)
+        if span <= 0:
+            return 0.0
+        return len(self.completions) * 60 / span
+
+    def eta(self):
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        remaining = max(0, self.total - self.done - self.errors - self.missing)
+        return remaining * 60 / rate
+
+    def status(self, state="running"):
+        eta = self.eta()
+        return {
+            "state": state,
+            "total": self.total,
+            "done": self.done,
+            "errors": self.errors,
+            "missing": self.missing,
+            "current_fid": self.current_fid,
+            "rate_per_min": round(self.rate(), 2),
+            "eta_seconds": None if eta is None else round(eta),
+            "last_latency": None if self.last_latency is None else round(self.last_latency, 3),
+            "elapsed": round(time.monotonic() - self.start_time),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "pid": os.getpid()
+        }
+
+    def text(self):
+        """任务描述中显示的状态"""
+        parts = ["{}/{}".format(self.done, self.total), "{:.1f}个/分钟".format(self.rate())]
+        eta = self.eta()
+        if eta is not None:
+            parts.append("剩余" + format_duration(eta))
+        if self.current_fid is not None:
+            parts.append("fid{}".format(self.current_fid))
+        if self.last_latency is not None:
+            parts.append("上一个{:.1f}秒".format(self.last_latency))
+        if self.errors > 0:
+            parts.append("错误{}".format(self.errors))
+        return ", ".join(parts)
+
+    def description_due(self):
+        now = time.monotonic()
+        if now - self.last_description < self.description_interval:
+            return False
+        self.last_description = now
+        return True
+
+    def write_status(self, state="running", force=False):
+        """按间隔写入状态文件, 先写临时文件再替换, 读取方不会读到写了一半的文件"""
+        now = time.monotonic()
+        if not force and now - self.last_status < self.status_interval:
+            return
+        self.last_status = now
+        tmp_path = self.path + ".tmp"
+        # 状态文件只用于监控, 写入失败不影响出图
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.status(state), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
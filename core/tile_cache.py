@@ -0,0 +1,308 @@
+"""
+批量导出前预取底图瓦片
+
+按输出分辨率和半径确定瓦片级别, 列出所有地块范围需要的瓦片, 并发下载到本地MBTiles文件,
+出图时渲染器用这些本地文件上的栅格图层代替工程中的XYZ图层, 渲染时不再受网络延迟影响.
+工程中的图层和保存的工程文件都不会改动.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import urllib.parse
+from multiprocessing.pool import ThreadPool
+
+import requests
+from qgis._core import QgsProject, QgsRasterLayer, QgsProviderRegistry, QgsCoordinateReferenceSystem, \
+    QgsCoordinateTransform, QgsRectangle, QgsMultiBandColorRenderer, \
+    QgsMessageLog, Qgis
+
+from ..utils import HEADER, MESSAGE_TAG, ExportDir
+
+# web墨卡托的半周长和瓦片大小
+ORIGIN_SHIFT = 20037508.342789244
+TILE_SIZE = 256
+
+
+def zoom_for_resolution(map_units_per_pixel, zmin=0, zmax=18):
+    """与地图分辨率最接近的瓦片级别"""
+    z = int(round(math.log2(2 * ORIGIN_SHIFT / TILE_SIZE / map_units_per_pixel)))
+    return min(max(z, zmin), zmax)
+
+
+def tile_bounds(z, x, y):
+    """XYZ瓦片的web墨卡托范围(xmin, ymin, xmax, ymax)"""
+    size = 2 * ORIGIN_SHIFT / (1 << z)
+    return (-ORIGIN_SHIFT + x * size, ORIGIN_SHIFT - (y + 1) * size,
+            -ORIGIN_SHIFT + (x + 1) * size, ORIGIN_SHIFT - y * size)
+
+
+def tiles_for_extent(extent, z):
+    """
+    Args:
+        extent: web墨卡托范围(xmin, ymin, xmax, ymax)
+        z (int): 瓦片级别
+
+    Returns:
+        list: 覆盖范围的XYZ瓦片(z, x, y)
+    """
+    n = 1 << z
+    size = 2 * ORIGIN_SHIFT / n
+    xmin, ymin, xmax, ymax = extent
+    x0 = min(max(int(math.floor((xmin + ORIGIN_SHIFT) / size)), 0), n - 1)
+    x1 = min(max(int(math.floor((xmax + ORIGIN_SHIFT) / size)), 0), n - 1)
+    y0 = min(max(int(math.floor((ORIGIN_SHIFT - ymax) / size)), 0), n - 1)
+    y1 = min(max(int(math.floor((ORIGIN_SHIFT - ymin) / size)), 0), n - 1)
+    return [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def tile_url(template, z, x, y):
+    return template.replace("{z}", str(z)).replace("{x}", str(x)).replace("{y}", str(y)) \
+        .replace("{-y}", str((1 << z) - 1 - y))
+
+
+def mercator_to_lonlat(x, y):
+    lon = x / ORIGIN_SHIFT * 180
+    lat = math.degrees(2 * math.atan(math.exp(y / ORIGIN_SHIFT * math.pi)) - math.pi / 2)
+    return lon, lat
+
+
+class mbtiles_store:
+    """MBTiles瓦片库, 行号按规范使用TMS方向(自下向上)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tiles "
+                          "(zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        self.conn.commit()
+
+    def existing(self, z):
+        """已缓存的XYZ瓦片(z, x, y)"""
+        cursor = self.conn.execute("SELECT tile_column, tile_row FROM tiles WHERE zoom_level=?", (z,))
+        return {(z, x, (1 << z) - 1 - row) for x, row in cursor}
+
+    def put(self, z, x, y, data):
+        self.conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (z, x, (1 << z) - 1 - y, data))
+
+    def get(self, z, x, y):
+        row = self.conn.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                                (z, x, (1 << z) - 1 - y)).fetchone()
+        return None if row is None else row[0]
+
+    def metadata(self):
+        return dict(self.conn.execute("SELECT name, value FROM metadata"))
+
+    def update_metadata(self, name, tile_format):
+        """按库中全部瓦片更新级别和范围, GDAL以此确定栅格范围"""
+        zmin, zmax = self.conn.execute("SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles").fetchone()
+        if zmax is None:
+            return
+        xmin, xmax, rmin, rmax = self.conn.execute(
+            "SELECT MIN(tile_column), MAX(tile_column), MIN(tile_row), MAX(tile_row) FROM tiles WHERE zoom_level=?",
+            (zmax,)).fetchone()
+        n = 1 << zmax
+        left, bottom = mercator_to_lonlat(*tile_bounds(zmax, xmin, n - 1 - rmin)[:2])
+        right, top = mercator_to_lonlat(*tile_bounds(zmax, xmax, n - 1 - rmax)[2:])
+
+        values = {
+            "name": name,
+            "type": "baselayer",
+            "version": "1.1",
+            "format": tile_format,
+            "minzoom": str(zmin),
+            "maxzoom": str(zmax),
+            "bounds": "{},{},{},{}".format(left, bottom, right, top)
+        }
+        self.conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", values.items())
+        self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def download_tiles(url_template, tiles, store: mbtiles_store, headers=None, workers=8, retries=2, is_canceled=None):
+    """
+    用共享连接池的requests.Session并发下载瓦片, 在调用线程中写入瓦片库
+
+    Returns:
+        tuple: (下载成功数量, 失败数量, 瓦片格式)
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADER if headers is None else headers)
+
+    def fetch(tile):
+        url = tile_url(url_template, *tile)
+        for _ in range(retries + 1):
+            try:
+                res = session.get(url, timeout=10)
+                if res.status_code == 200 and len(res.content) > 0:
+                    return tile, res.content
+            except requests.RequestException:
+                pass
+        return tile, None
+
+    downloaded = 0
+    failed = 0
+    tile_format = "png"
+    pool = ThreadPool(workers)
+    try:
+        for tile, data in pool.imap_unordered(fetch, tiles):
+            if data is None:
+                failed += 1
+                continue
+            if data[:3] == b"\xff\xd8\xff":
+                tile_format = "jpg"
+            store.put(*tile, data)
+            downloaded += 1
+            if downloaded % 256 == 0:
+                store.commit()
+            if is_canceled is not None and is_canceled():
+                pool.terminate()
+                break
+    finally:
+        pool.close()
+        pool.join()
+        session.close()
+        store.commit()
+    return downloaded, failed, tile_format
+
+
+def xyz_source(layer):
+    """XYZ图层的瓦片地址模板、级别范围和请求头, 不是XYZ图层时返回None"""
+    if not isinstance(layer, QgsRasterLayer) or layer.providerType() != "wms":
+        return None
+    params = QgsProviderRegistry.instance().decodeUri("wms", layer.source())
+    if params.get("type") != "xyz" or "url" not in params:
+        return None
+
+    url = params["url"]
+    if "{x}" not in url:
+        url = urllib.parse.unquote(url)
+    headers = dict(HEADER)
+    referer = params.get("http-header:referer", params.get("referer", ""))
+    if referer != "":
+        headers["Referer"] = referer
+    return {
+        "url": url,
+        "zmin": int(params.get("zmin", 0)),
+        "zmax": int(params.get("zmax", 18)),
+        "headers": headers
+    }
+
+
+def cache_layer(layer, path):
+    """MBTiles缓存上的栅格图层, 不加入工程, 出图时代替原XYZ图层"""
+    cached = QgsRasterLayer(path, layer.name(), "gdal")
+    if not cached.isValid():
+        raise Exception("瓦片缓存{}无法打开.".format(path))
+
+    # MBTiles按RGBA多波段读取
+    if cached.bandCount() >= 3:
+        band_renderer = QgsMultiBandColorRenderer(cached.dataProvider(), 1, 2, 3)
+        if cached.bandCount() >= 4:
+            band_renderer.setAlphaBand(4)
+        cached.setRenderer(band_renderer)
+    cached.setOpacity(layer.opacity())
+    cached.setBlendMode(layer.blendMode())
+    return cached
+
+
+class tile_prefetcher:
+    """把工程中可见的XYZ图层预取到本地MBTiles"""
+
+    def __init__(self, project: QgsProject, config, cache_dir=None):
+        self.project = project
+        self.config = config
+        self.cache_dir = os.path.join(ExportDir, "tile_cache") if cache_dir is None else cache_dir
+
+    def xyz_layers(self):
+        layers = []
+        for layer in self.project.mapThemeCollection().masterVisibleLayers():
+            source = xyz_source(layer)
+            if source is not None:
+                layers.append((layer, source))
+        return layers
+
+    def extent_function(self, block_layer):
+        """
+        Returns:
+            function: 地块要素 -> 出图范围的web墨卡托坐标(xmin, ymin, xmax, ymax), 没有几何时返回None.
+                      范围与block_renderer的一致, 并按输出宽高比扩展
+        """
+        project_crs = self.project.crs()
+        to_project = QgsCoordinateTransform(block_layer.crs(), project_crs, self.project)
+        to_mercator = QgsCoordinateTransform(project_crs, QgsCoordinateReferenceSystem("EPSG:3857"), self.project)
+
+        side = 2 * self.config.radius * 1.2
+        ratio = self.config.out_width / self.config.out_height
+        width, height = (side * ratio, side) if ratio >= 1 else (side, side / ratio)
+
+        def block_extent(feature):
+            if not feature.hasGeometry():
+                return None
+            geom = feature.geometry()
+            geom.transform(to_project)
+            centroid = geom.pointOnSurface().asPoint()
+            extent = to_mercator.transformBoundingBox(QgsRectangle.fromCenterAndSize(centroid, width, height))
+            return extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()
+
+        return block_extent
+
+    def prefetch(self, extents, is_canceled=None):
+        """
+        Args:
+            extents: 需要出图的地块范围, extent_function的返回值, 在出图前扫描地块时一并计算
+
+        Returns:
+            dict: {XYZ图层id: MBTiles路径}, 取消时不包含还没有预取的图层;
+                  有瓦片下载失败的图层也不包含, 出图时仍使用在线的XYZ图层, 避免底图缺块
+        """
+        cache = {}
+        layers = self.xyz_layers()
+        if len(layers) == 0 or len(extents) == 0:
+            return cache
+        # 所有地块出图范围相同, 用第一个地块的范围计算分辨率
+        map_units_per_pixel = (extents[0][2] - extents[0][0]) / self.config.out_width
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for layer, source in layers:
+            z = zoom_for_resolution(map_units_per_pixel, source["zmin"], source["zmax"])
+            tiles = set()
+            for extent in extents:
+                tiles.update(tiles_for_extent(extent, z))
+
+            url_hash = hashlib.md5(source["url"].encode("utf-8")).hexdigest()[:12]
+            path = os.path.join(self.cache_dir, f"{url_hash}_z{z}.mbtiles")
+            store = mbtiles_store(path)
+            try:
+                missing = sorted(tiles - store.existing(z))
+                downloaded, failed, tile_format = download_tiles(source["url"], missing, store, source["headers"],
+                                                                 self.config.tile_workers, is_canceled=is_canceled)
+                store.update_metadata(layer.name(), store.metadata().get("format", tile_format))
+            finally:
+                store.close()
+
+            QgsMessageLog.logMessage("图层{}: 级别{}共{}个瓦片, 已缓存{}个, 下载{}个, 失败{}个.".format(
+                layer.name(), z, len(tiles), len(tiles) - len(missing), downloaded, failed),
+                tag=MESSAGE_TAG, level=Qgis.MessageLevel.Info if failed == 0 else Qgis.MessageLevel.Warning)
+
+            if is_canceled is not None and is_canceled():
+                return cache
+            if failed > 0:
+                # 已经下载的瓦片保留在缓存中, 下次预取时只需要补齐失败的瓦片
+                QgsMessageLog.logMessage("图层{}有{}个瓦片下载失败, 本次出图不使用瓦片缓存, 仍使用在线图层.".format(
+                    layer.name(), failed), tag=MESSAGE_TAG, level=Qgis.MessageLevel.Warning)
+                continue
+            cache[layer.id()] = path
+        return cache
@@ -0,0 +1,268 @@
+"""
+批量出图的分阶段计时
+
+每个地块记录各阶段耗时(查询、创建版面、更新版面、图例过滤、渲染、编码、写工程文件等),
+批次级的阶段(收集地块、增量清单、瓦片预取、合并PDF)单独记录. 有渲染任务的地块还记录各图层的渲染耗时.
+出图结束后在out_path写出timing.json(各阶段和各图层的合计、分位数以及最慢的地块)和timing.csv(每个地块一行).
+"""
+import collections
+import contextlib
+import csv
+import json
+import math
+import os
+import threading
+import time
+
+TIMING_JSON = "timing.json"
+TIMING_CSV = "timing.csv"
+# 报告中列出的最慢地块个数
+SLOWEST_COUNT = 10
+
+
+def percentile(values, p):
+    """最近秩分位数, values已排序"""
+    if len(values) == 0:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+def growth_per_block(values):
+    """最小二乘拟合的每个地块增长量"""
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    denominator = sum((x - mean_x) ** 2 for x in range(n))
+    return numerator / denominator
+
+
+def summarize(values):
+    values = sorted(values)
+    total = sum(values)
+    return {
+        "total": round(total, 4),
+        "mean": round(total / len(values), 4) if len(values) > 0 else 0.0,
+        "p50": round(percentile(values, 50), 4),
+        "p90": round(percentile(values, 90), 4),
+        "p95": round(percentile(values, 95), 4),
+        "max": round(values[-1], 4) if len(values) > 0 else 0.0
+    }
+
+
+class stage_timer:
+    """
+    renderer在每个地块开始时调用begin, 用stage包住各个阶段; 下一个地块begin或者end时结束当前地块.
+    地块总耗时中没有被任何阶段覆盖的部分记为other, 例如合并PDF时QGIS导出页面的时间.
+    编码线程可以在地块结束后用add补记阶段耗时.
+    listeners中的对象在地块开始和结束时收到block_begin(fid)和block_end(fid), 例如剖析器.
+    """
+
+    def __init__(self):
+        self.blocks = {}
+        self.batch = {}
+        self.listeners = []
+        self.current = None
+        self.current_fid = None
+        self.block_start = None
+        # 正在计时的阶段中已经计入子阶段的时间, 嵌套的阶段只记各自独占的时间
+        self.stack = []
+        self.batch_start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def begin(self, fea_id, start=None):
+        """start为perf_counter时间, 默认为当前时间"""
+        self.end()
+        self.current = self.block(fea_id)
+        self.current_fid = fea_id
+        self.block_start = time.perf_counter() if start is None else start
+        for listener in self.listeners:
+            listener.block_begin(fea_id)
+
+    def end(self):
+        if self.current is None:
+            return
+        for listener in self.listeners:
+            listener.block_end(self.current_fid)
+        with self.lock:
+            self.current["total"] = self.current.get("total", 0.0) + time.perf_counter() - self.block_start
+        self.current = None
+        self.current_fid = None
+
+    def block(self, fea_id):
+        with self.lock:
+            return self.blocks.setdefault(str(fea_id), {"stages": {}})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """当前地块的一个阶段, 同名阶段累加"""
+        record = self.current
+        start = time.perf_counter()
+        self.stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if len(self.stack) > 0:
+                self.stack[-1] += elapsed
+            if record is not None:
+                self._add(record, name, elapsed - children)
+
+    @contextlib.contextmanager
+    def excluded(self, name):
+        """
+        地块处理过程中与出图本身无关的额外工作, 例如图层耗时抽样.
+        耗时记入批次级的name阶段, 不计入当前地块的总耗时和所在的阶段, 不影响地块的分位数和最慢地块
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.batch[name] = self.batch.get(name, 0.0) + elapsed
+            if len(self.stack) > 0:
+                self.stack[-1] += elapsed
+            if self.current is not None:
+                self.block_start += elapsed
+
+    @contextlib.contextmanager
+    def batch_stage(self, name):
+        """与具体地块无关的阶段"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.batch[name] = self.batch.get(name, 0.0) + time.perf_counter() - start
+
+    def annotate(self, key, value):
+        """给当前地块附加一个数值, 例如内存占用, 写入timing.csv的同名列"""
+        if self.current is None:
+            return
+        with self.lock:
+            self.current[key] = value
+
+    def add(self, fea_id, name, seconds):
+        self._add(self.block(fea_id), name, seconds)
+
+    def _add(self, record, name, seconds):
+        with self.lock:
+            record["stages"][name] = record["stages"].get(name, 0.0) + seconds
+
+    def add_layers(self, times):
+        """当前地块各图层的渲染耗时"""
+        if self.current is None:
+            return
+        with self.lock:
+            layers = self.current.setdefault("layers", {})
+            for name, seconds in times.items():
+                layers[name] = layers.get(name, 0.0) + seconds
+
+    def merge(self, blocks):
+        """合并子进程或者其他渲染器的计时"""
+        for fea_id, record in blocks.items():
+            target = self.block(fea_id)
+            with self.lock:
+                for key, value in record.items():
+                    if isinstance(value, dict):
+                        merged = target.setdefault(key, {})
+                        for name, seconds in value.items():
+                            merged[name] = merged.get(name, 0.0) + seconds
+                    elif key == "total":
+                        target[key] = target.get(key, 0.0) + value
+                    else:
+                        target[key] = value
+
+    def records(self):
+        """各地块的记录, 补上other阶段"""
+        with self.lock:
+            result = {}
+            for fea_id, record in self.blocks.items():
+                stages = dict(record["stages"])
+                total = record.get("total", 0.0)
+                other = total - sum(seconds for name, seconds in stages.items() if name != "encode")
+                if other > 0:
+                    stages["other"] = other
+                result[fea_id] = dict(record, stages=stages, total=total)
+            return result
+
+    def report(self):
+        records = self.records()
+        names = sorted({name for record in records.values() for name in record["stages"]})
+        stages = {name: summarize([record["stages"].get(name, 0.0) for record in records.values()])
+                  for name in names}
+        totals = summarize([record["total"] for record in records.values()])
+        slowest = sorted(records.items(), key=lambda item: item[1]["total"], reverse=True)[:SLOWEST_COUNT]
+
+        # 图层耗时只统计有记录的地块, 版面引擎按抽样的地块统计
+        layer_blocks = [record["layers"] for record in records.values() if "layers" in record]
+        layer_names = {name for layers in layer_blocks for name in layers}
+        layers = [dict(layer=name, blocks=sum(1 for l in layer_blocks if name in l),
+                       **summarize([l[name] for l in layer_blocks if name in l])) for name in layer_names]
+        layers.sort(key=lambda item: item["total"], reverse=True)
+
+        # 内存按进程统计, 记录按各进程中地块完成的顺序排列
+        rss = collections.OrderedDict()
+        for record in records.values():
+            if "rss_mb" in record:
+                rss.setdefault(str(record.get("pid", "")), []).append(record["rss_mb"])
+        memory = {pid: {"blocks": len(values), "start_mb": values[0], "end_mb": values[-1], "peak_mb": max(values),
+                        "growth_kb_per_block": round(growth_per_block(values) * 1024, 1)}
+                  for pid, values in rss.items()}
+        return {
+            "blocks": len(records),
+            "wall": round(time.perf_counter() - self.batch_start, 4),
+            "batch": {name: round(seconds, 4) for name, seconds in self.batch.items()},
+            "total": totals,
+            "stages": stages,
+            "layers": layers,
+            "memory": memory,
+            "slowest": [dict(fid=fea_id, total=round(record["total"], 4),
+                             stages={name: round(s, 4) for name, s in record["stages"].items()},
+                             layers={name: round(s, 4) for name, s in record.get("layers", {}).items()})
+                        for fea_id, record in slowest]
+        }
+
+    def write(self, out_path):
+        """写出timing.json和timing.csv, 返回报告"""
+        report = self.report()
+        os.makedirs(out_path, exist_ok=True)
+        with open(os.path.join(out_path, TIMING_JSON), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        records = self.records()
+        names = sorted(report["stages"])
+        extra = sorted({key for record in records.values() for key, value in record.items()
+                        if key not in ("stages", "total") and not isinstance(value, dict)})
+        with open(os.path.join(out_path, TIMING_CSV), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["fid", "total"] + names + extra)
+            for fea_id, record in records.items():
+                writer.writerow([fea_id, round(record["total"], 4)] +
+                                [round(record["stages"].get(name, 0.0), 4) for name in names] +
+                                [record.get(key, "") for key in extra])
+        return report
+
+    @staticmethod
+    def summary(report):
+        """一行文字的摘要, 按合计耗时列出前几个阶段"""
+        stages = sorted(report["stages"].items(), key=lambda item: item[1]["total"], reverse=True)
+        stage_total = sum(s["total"] for name, s in stages if name != "encode") or 1.0
+        parts = ["{} {:.0%}".format(name, s["total"] / stage_total) for name, s in stages[:5] if name != "encode"]
+        text = "出图{}个地块, 用时{:.1f}秒, 每个地块平均{:.2f}秒, p95 {:.2f}秒".format(
+            report["blocks"], report["wall"], report["total"]["mean"], report["total"]["p95"])
+        if len(parts) > 0:
+            text += "; 阶段占比: " + ", ".join(parts)
+        if "encode" in report["stages"]:
+            text += "; 编码合计{:.1f}秒".format(report["stages"]["encode"]["total"])
+        if len(report["memory"]) > 0:
+            text += "; 内存峰值{:.0f}MB, 每个地块增长{:.0f}KB".format(
+                max(m["peak_mb"] for m in report["memory"].values()),
+                max(m["growth_kb_per_block"] for m in report["memory"].values()))
+        if len(report["layers"]) > 0:
+            text += "; 最慢图层: " + ", ".join("{} p95 {:.2f}秒".format(l["layer"], l["p95"])
+                                          for l in report["layers"][:3])
+        return text
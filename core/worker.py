@@ -0,0 +1,249 @@
+"""
+并行批量导出
+
+父进程(QgsTask)把地块fid分片, 每个分片交给一个无界面的QGIS子进程渲染.
+子进程只加载一次工程, 通过stdout逐行回报JSON事件, 由父进程汇总进度、取消和错误.
+子进程中的渲染崩溃不会影响当前的QGIS会话.
+
+子进程入口:
+    python worker.py <job.json>
+"""
+import collections
+import importlib.util
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import traceback
+
+EVENT_PREFIX = "@renderUP "
+PluginDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def python_executable():
+    """QGIS内嵌python时sys.executable指向qgis主程序, 需要找到同一环境下的python解释器"""
+    exe = sys.executable
+    if os.path.basename(exe).lower().startswith("python"):
+        return exe
+
+    names = ["python.exe", "python3.exe"] if sys.platform == "win32" else ["python3", "python"]
+    dirs = [sys.exec_prefix, os.path.join(sys.exec_prefix, "bin"), os.path.join(os.path.dirname(exe), "bin")]
+    for d in dirs:
+        for name in names:
+            candidate = os.path.join(d, name)
+            if os.path.isfile(candidate):
+                return candidate
+    raise Exception("找不到python解释器, 无法启动并行导出进程.")
+
+
+def worker_environment(prefix_path=None):
+    """
+    子进程的环境变量. QGIS在运行时才把自带的python目录和插件目录加入sys.path, 不经过PYTHONPATH,
+    需要把当前的sys.path传给子进程; Windows独立安装包和OSGeo4W中再补上python-qgis.bat设置的
+    PATH、PYTHONHOME和QT_PLUGIN_PATH, 否则单独启动的python.exe无法导入qgis.
+
+    Args:
+        prefix_path: QgsApplication.prefixPath()
+    """
+    env = os.environ.copy()
+    env["QT_QPA_PLATFORM"] = "offscreen"
+
+    paths = []
+    for path in sys.path + env.get("PYTHONPATH", "").split(os.pathsep):
+        if path and os.path.isdir(path) and path not in paths:
+            paths.append(path)
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+
+    if prefix_path:
+        env["QGIS_PREFIX_PATH"] = prefix_path
+    if sys.platform == "win32":
+        env["PYTHONHOME"] = sys.base_prefix
+        if prefix_path:
+            # prefix_path为<OSGEO4W_ROOT>/apps/qgis
+            root = os.path.dirname(os.path.dirname(prefix_path))
+            bins = [os.path.join(prefix_path, "bin"), os.path.join(root, "bin"), os.path.join(root, "apps", "Qt5", "bin")]
+            env["PATH"] = os.pathsep.join([d for d in bins if os.path.isdir(d)] + [env.get("PATH", "")])
+            plugins = [os.path.join(prefix_path, "qtplugins"), os.path.join(root, "apps", "Qt5", "plugins")]
+            plugins = [d for d in plugins if os.path.isdir(d)]
+            if len(plugins) > 0:
+                env["QT_PLUGIN_PATH"] = os.pathsep.join(plugins)
+    return env
+
+
+def split_shards(fids, n):
+    """把fid列表切成n个连续分片, 相邻地块落在同一进程中, 便于复用底图瓦片缓存"""
+    n = max(1, min(n, len(fids)))
+    size, rest = divmod(len(fids), n)
+    shards = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < rest else 0)
+        shards.append(fids[start:end])
+        start = end
+    return shards
+
+
+class export_worker_pool:
+    def __init__(self, job: dict, fids, worker_count, work_dir):
+        self.job = job
+        self.shards = split_shards(list(fids), worker_count)
+        self.work_dir = work_dir
+        self.job_paths = []
+        self.processes = []
+        self.events_queue = queue.Queue()
+
+    def start(self):
+        from qgis.core import QgsApplication
+
+        env = worker_environment(QgsApplication.prefixPath())
+
+        for i, shard in enumerate(self.shards):
+            job_path = os.path.join(self.work_dir, f"_worker_{i}.json")
+            job = dict(self.job, fids=shard, part=i)
+            with open(job_path, "w", encoding="utf-8") as f:
+                json.dump(job, f, ensure_ascii=False)
+            self.job_paths.append(job_path)
+
+            proc = subprocess.Popen([python_executable(), os.path.abspath(__file__), job_path],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                                    creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+            self.processes.append(proc)
+            threading.Thread(target=self._read_worker, args=(i, proc), daemon=True).start()
+
+    def _read_worker(self, index, proc):
+        stderr_tail = collections.deque(maxlen=20)
+
+        def read_stderr():
+            for line in proc.stderr:
+                stderr_tail.append(line.decode("utf-8", errors="replace").rstrip())
+
+        stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+        stderr_thread.start()
+
+        for line in proc.stdout:
+            line = line.decode("utf-8", errors="replace")
+            if line.startswith(EVENT_PREFIX):
+                self.events_queue.put(json.loads(line[len(EVENT_PREFIX):]))
+
+        code = proc.wait()
+        stderr_thread.join(timeout=5)
+        self.events_queue.put({"event": "exit", "worker": index, "code": code, "stderr": "\n".join(stderr_tail)})
+
+    def events(self, timeout=0.5):
+        """逐个返回子进程事件, 超时返回None, 调用方借此检查任务是否被取消"""
+        running = len(self.processes)
+        while running > 0:
+            try:
+                event = self.events_queue.get(timeout=timeout)
+            except queue.Empty:
+                yield None
+                continue
+            if event["event"] == "exit":
+                running -= 1
+            yield event
+
+    def terminate(self):
+        for proc in self.processes:
+            if proc.poll() is None:
+                proc.terminate()
+
+    def cleanup(self):
+        """等待子进程退出后删除分片任务文件"""
+        for proc in self.processes:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for job_path in self.job_paths:
+            try:
+                os.remove(job_path)
+            except OSError:
+                pass
+        self.job_paths = []
+
+
+def emit(event: dict):
+    sys.stdout.write(EVENT_PREFIX + json.dumps(event, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def emit_completed(results):
+    """报告渲染器完成的地块, 编码线程写出失败的地块报告为出错"""
+    for fea_id, error in results:
+        if error is None:
+            emit({"event": "done", "fid": fea_id})
+        else:
+            emit({"event": "error", "fid": fea_id, "error": error})
+
+
+def load_plugin_package():
+    """插件目录名不一定是合法的包名, 以固定的别名加载插件包, 使相对导入可用"""
+    name = "renderUP_worker"
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PluginDir, "__init__.py"),
+                                                  submodule_search_locations=[PluginDir])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[name] = package
+    spec.loader.exec_module(package)
+    return name
+
+
+def main(job_path):
+    # 插件模块在导入时会用到QFontDatabase, 必须先创建QgsApplication
+    from qgis.core import QgsApplication, QgsProject
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    with open(job_path, encoding="utf-8") as f:
+        job = json.load(f)
+
+    package = load_plugin_package()
+    export = importlib.import_module(f"{package}.core.export")
+    utils = importlib.import_module(f"{package}.utils")
+
+    project = QgsProject.instance()
+    if not project.read(job["project"]):
+        sys.stderr.write("工程文件{}读取失败.\n".format(job["project"]))
+        return 1
+
+    block_layer = project.mapLayer(job["block_layer_id"])
+    if block_layer is None:
+        sys.stderr.write("地块图层{}不存在.\n".format(job["block_layer_id"]))
+        return 1
+
+    config = utils.PluginConfig(**job["config"])
+    renderer = export.create_renderer(project, block_layer, config, job["checked_layer_ids"],
+                                      tile_cache=job.get("tile_cache"))
+
+    try:
+        if config.out_format == "pdf" and config.pdf_single:
+            # 每个进程输出自己那一段地块的多页PDF, 由主进程合并
+            pdf_batch = importlib.import_module(f"{package}.core.pdf_batch")
+            path = os.path.join(config.out_path, "pdf", pdf_batch.part_name(job["part"]))
+            renderer.render_pdf(job["fids"], path, lambda fea_id: emit({"event": "done", "fid": fea_id}))
+        elif isinstance(renderer, export.atlas_renderer):
+            for fea_id in renderer.render_atlas(job["fids"]):
+                emit_completed(renderer.completed(fea_id))
+        else:
+            for fea_id, feature in renderer.blocks.blocks(job["fids"]):
+                try:
+                    if renderer.render(fea_id, feature):
+                        emit_completed(renderer.completed(fea_id))
+                    else:
+                        emit({"event": "missing", "fid": fea_id})
+                except:
+                    emit({"event": "error", "fid": fea_id, "error": traceback.format_exc()})
+    finally:
+        renderer.close()
+        emit_completed(renderer.completed())
+        # 编码线程的耗时在close之后才完整
+        emit({"event": "timing", "blocks": renderer.timer.blocks})
+
+    app.exitQgis()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1]))
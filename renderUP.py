@@ -37,7 +37,8 @@ from .resources_rc import *
 from .core.export import bacth_export
 from .core.image import add_tianditu_basemap, add_extra_map, get_extra_map_icon
 from .ui.setting_dlg import SettingDialog
-from .utils import iconlib, TianMapInfo, extra_maps, get_qset_name, PLUGIN_NAME, single_window, ExportDir, MESSAGE_TAG
+from .utils import iconlib, TianMapInfo, extra_maps, get_qset_name, PLUGIN_NAME, single_window, ExportDir, MESSAGE_TAG, \
+    ENCODER_PRESETS
 # Import the code for the dialog
 from .ui.render_dlg import renderDialog
 import os.path
@@ -118,6 +119,51 @@ class renderUP:
             self.qset.setValue(get_qset_name("draw_circle"), False)
         if not self.qset.contains(get_qset_name("radius")):
             self.qset.setValue(get_qset_name("radius"), 1000)
+        if not self.qset.contains(get_qset_name("export_workers")):
+            self.qset.setValue(get_qset_name("export_workers"), 1)
+        if not self.qset.contains(get_qset_name("layout_template")):
+            self.qset.setValue(get_qset_name("layout_template"), True)
+        if not self.qset.contains(get_qset_name("project_files")):
+            self.qset.setValue(get_qset_name("project_files"), "full")
+        if not self.qset.contains(get_qset_name("export_engine")):
+            self.qset.setValue(get_qset_name("export_engine"), "layout")
+        if not self.qset.contains(get_qset_name("decoration_cache")):
+            self.qset.setValue(get_qset_name("decoration_cache"), True)
+        if not self.qset.contains(get_qset_name("legend_index")):
+            self.qset.setValue(get_qset_name("legend_index"), True)
+        if not self.qset.contains(get_qset_name("tile_prefetch")):
+            self.qset.setValue(get_qset_name("tile_prefetch"), False)
+        if not self.qset.contains(get_qset_name("tile_workers")):
+            self.qset.setValue(get_qset_name("tile_workers"), 8)
+        if not self.qset.contains(get_qset_name("mosaic_poi")):
+            self.qset.setValue(get_qset_name("mosaic_poi"), False)
+        if not self.qset.contains(get_qset_name("incremental")):
+            self.qset.setValue(get_qset_name("incremental"), False)
+        if not self.qset.contains(get_qset_name("encode_workers")):
+            self.qset.setValue(get_qset_name("encode_workers"), 2)
+        if not self.qset.contains(get_qset_name("pdf_single")):
+            self.qset.setValue(get_qset_name("pdf_single"), False)
+        if not self.qset.contains(get_qset_name("pdf_hybrid")):
+            self.qset.setValue(get_qset_name("pdf_hybrid"), False)
+        if not self.qset.contains(get_qset_name("pdf_raster_dpi")):
+            self.qset.setValue(get_qset_name("pdf_raster_dpi"), 150)
+        if not self.qset.contains(get_qset_name("encoder_preset")):
+            self.qset.setValue(get_qset_name("encoder_preset"), "balanced")
+        for key, value in ENCODER_PRESETS["balanced"].items():
+            if not self.qset.contains(get_qset_name(key)):
+                self.qset.setValue(get_qset_name(key), value)
+        if not self.qset.contains(get_qset_name("strip_memory_mb")):
+            self.qset.setValue(get_qset_name("strip_memory_mb"), 512)
+        if not self.qset.contains(get_qset_name("layer_timing_every")):
+            self.qset.setValue(get_qset_name("layer_timing_every"), 0)
+        if not self.qset.contains(get_qset_name("profile_every")):
+            self.qset.setValue(get_qset_name("profile_every"), 0)
+        if not self.qset.contains(get_qset_name("profile_sample_ms")):
+            self.qset.setValue(get_qset_name("profile_sample_ms"), 0)
+        if not self.qset.contains(get_qset_name("memory_warn_kb")):
+            self.qset.setValue(get_qset_name("memory_warn_kb"), 512)
+        if not self.qset.contains(get_qset_name("cleanup_every")):
+            self.qset.setValue(get_qset_name("cleanup_every"), 0)
 
         self.qset.setValue(get_qset_name("draw_circle"), Qt.CheckState.Checked)
         self.qset.setValue(get_qset_name("draw_northarrow"), Qt.CheckState.Checked)
@@ -0,0 +1,452 @@
+# coding=utf-8
+"""Headless benchmark suite.
+
+在offscreen平台上用data目录中的示例数据测量插件启动、一键符号化和批量出图的耗时与内存峰值,
+结果写成JSON, 供性能回归比较使用.
+
+    cd test
+    python benchmark.py [--quick] [--repeat 3] [--output benchmark_results.json]
+
+出图场景是输出大小、分辨率、格式、装饰元素和导出引擎的组合, 每个场景测量:
+    seconds:     bacth_export.run()端到端耗时
+    block_mean:  渲染器逐个地块出图的平均耗时, block_p95为95分位
+    peak_rss_mb: 场景运行期间进程RSS的峰值
+
+一键符号化的render_poi需要带type字段的POI; 示例数据的POI没有这个字段, 测试时用synthetic_data生成,
+render_image使用test目录中的tenbytenraster.asc.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import argparse
+import importlib
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.PyQt.QtGui import QKeyEvent
+from qgis.PyQt.QtWidgets import QMainWindow, QToolBar
+from qgis.core import Qgis, QgsProject, QgsVectorLayer, QgsRasterLayer, QgsSettings, QgsCoordinateReferenceSystem, \
+    QgsWkbTypes
+
+from utilities import get_qgis_app
+from qgis_interface import QgisInterface
+from core.worker import load_plugin_package
+import synthetic_data
+
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+PACKAGE = load_plugin_package()
+plugin = importlib.import_module(PACKAGE)
+export = importlib.import_module(f"{PACKAGE}.core.export")
+memory = importlib.import_module(f"{PACKAGE}.core.memory")
+timing = importlib.import_module(f"{PACKAGE}.core.timing")
+render_dlg = importlib.import_module(f"{PACKAGE}.ui.render_dlg")
+utils = importlib.import_module(f"{PACKAGE}.utils")
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+# render_image使用的栅格图层
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tenbytenraster.asc")
+# synthetic_data.py写出的数据集说明
+DATASET_NAME = "dataset.json"
+
+# 各角色使用的示例数据
+DATA_FILES = {
+    "block": "blocks.shp",
+    "metro_network": "2035年地铁线路_WGS84_2023-12-28_19-14-32_CGCS2000投影_2023-12-28_21-05-15.shp",
+    "metro_station": "c2035年地铁站点_CGCS2000投影_2023-12-28_21-05-15.shp",
+    "poi": "ST.shp",
+    "road_network": "GD.shp"
+}
+
+SIZES = [(1280, 960), (2529, 1829)]
+DPIS = [96, 150]
+FORMATS = ["png", "jpg", "pdf"]
+DECORATIONS = {
+    "all": {"draw_circle": 2, "draw_northarrow": 2, "draw_scalebar": 2, "draw_legend": 2},
+    "none": {"draw_circle": 0, "draw_northarrow": 0, "draw_scalebar": 0, "draw_legend": 0}
+}
+ENGINES = ["layout", "direct"]
+
+
+class benchMainWindow(QMainWindow):
+    keyPressed = pyqtSignal(QKeyEvent)
+
+
+class benchLayerTreeView:
+    def refreshLayerSymbology(self, layer_id):
+        pass
+
+
+class benchInterface(QgisInterface):
+    """测试用QgisInterface补上插件启动、符号化和出图任务用到的接口"""
+
+    def __init__(self, canvas):
+        super(benchInterface, self).__init__(canvas)
+        self.main_window = benchMainWindow()
+        self.tree_view = benchLayerTreeView()
+
+    def mainWindow(self):
+        return self.main_window
+
+    def layerTreeView(self):
+        return self.tree_view
+
+    def addToolBar(self, name):
+        return QToolBar(name, self.main_window)
+
+    def addPluginToMenu(self, name, action):
+        pass
+
+
+class peak_rss:
+    """后台线程每隔interval秒采样RSS, 记录峰值(MB)"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self.stop_event = threading.Event()
+
+    def sample(self):
+        rss = memory.rss_bytes()
+        if rss is not None:
+            self.peak = max(self.peak, rss / 1024 ** 2)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+
+
+def dataset_info(data_dir):
+    """synthetic_data.py生成的数据目录中有dataset.json, 否则使用示例数据"""
+    path = os.path.join(data_dir, DATASET_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def machine_info():
+    """记录基线的机器: CPU型号、逻辑核数和物理内存, 比较不同机器上的结果时用来判断差异是否来自硬件"""
+    cpu = platform.processor()
+    memory_gb = None
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    try:
+        import psutil
+        memory_gb = round(psutil.virtual_memory().total / 1024 ** 3, 1)
+    except ImportError:
+        if hasattr(os, "sysconf") and "SC_PHYS_PAGES" in os.sysconf_names:
+            memory_gb = round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3, 1)
+    return {"cpu": cpu, "cpu_count": os.cpu_count(), "memory_gb": memory_gb}
+
+
+def load_layers(data_dir=TEST_DATA_DIR, files=None):
+    """把示例数据加载到当前工程, 返回{角色: 图层}"""
+    project = QgsProject.instance()
+    project.removeAllMapLayers()
+    layers = {}
+    if files is None:
+        dataset = dataset_info(data_dir)
+        files = DATA_FILES if dataset is None else dataset["files"]
+    for role, file_name in files.items():
+        layer = QgsVectorLayer(os.path.join(data_dir, file_name), role, "ogr")
+        if not layer.isValid():
+            raise Exception("图层{}加载失败.".format(file_name))
+        project.addMapLayer(layer)
+        layers[role] = layer
+    project.setCrs(QgsCoordinateReferenceSystem("EPSG:3857"))
+    return layers
+
+
+def checked_layer_ids(layers):
+    return {"轨道站点": layers["metro_station"].id(), "POI": layers["poi"].id()}
+
+
+def scenarios(quick=False):
+    """出图场景矩阵, quick时只保留最小的输出和png"""
+    sizes = SIZES[:1] if quick else SIZES
+    dpis = DPIS[:1] if quick else DPIS
+    formats = FORMATS[:1] if quick else FORMATS
+    for (width, height), dpi, out_format, decoration, engine in itertools.product(
+            sizes, dpis, formats, DECORATIONS, ENGINES):
+        yield {"out_width": width, "out_height": height, "out_resolution": dpi, "out_format": out_format,
+               "decorations": decoration, "export_engine": engine}
+
+
+def scenario_name(params):
+    return "export/{export_engine}/{out_format}/{out_width}x{out_height}/{out_resolution}dpi/{decorations}".format(
+        **params)
+
+
+def scenario_settings(params, out_path, layers):
+    """场景对应的插件设置, 出图任务从QgsSettings读取"""
+    settings = dict(DECORATIONS[params["decorations"]])
+    settings.update({
+        "out_path": out_path,
+        "out_width": params["out_width"],
+        "out_height": params["out_height"],
+        "out_resolution": params["out_resolution"],
+        "out_format": params["out_format"],
+        "export_engine": params["export_engine"],
+        "radius": 1000.0,
+        "export_workers": 1,
+        "incremental": False,
+        "tile_prefetch": False,
+        "metro_station_layer_id": layers["metro_station"].id(),
+        "poi_layer_id": layers["poi"].id()
+    })
+    return settings
+
+
+class saved_settings:
+    """临时修改插件设置, 结束后恢复原值"""
+
+    def __init__(self, values):
+        self.values = values
+        self.qset = QgsSettings()
+        self.saved = {}
+
+    def __enter__(self):
+        for key, value in self.values.items():
+            name = utils.get_qset_name(key)
+            self.saved[name] = self.qset.value(name) if self.qset.contains(name) else None
+            self.qset.setValue(name, value)
+        return self
+
+    def __exit__(self, *args):
+        for name, value in self.saved.items():
+            if value is None:
+                self.qset.remove(name)
+            else:
+                self.qset.setValue(name, value)
+
+
+def timed(func, repeat):
+    """重复执行func, 返回各次耗时"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_startup(iface, repeat):
+    """插件对象创建和initGui"""
+    def start():
+        instance = plugin.classFactory(iface)
+        instance.initGui()
+        instance.unload()
+
+    with peak_rss() as peak:
+        times = timed(start, repeat)
+    return {"seconds": statistics.median(times), "runs": times, "peak_rss_mb": round(peak.peak, 1)}
+
+
+def styled_poi_layer(layers, work_dir):
+    """
+    render_poi按type字段配色, 没有这个字段时直接返回. 示例数据的POI(ST.shp)没有type字段,
+    这时用synthetic_data生成同样数量级的带type字段的POI, 数据目录是synthetic_data.py的输出时直接使用其中的POI
+    """
+    poi = layers["poi"]
+    fni, _ = utils.get_field_index_no_case(poi, utils.default_field.name_poi_type)
+    if fni >= 0:
+        return poi, False
+
+    path = os.path.join(work_dir, "poi.gpkg")
+    writer = synthetic_data.layer_writer(path, "GPKG", synthetic_data.poi_fields(), QgsWkbTypes.Point,
+                                         layers["block"].crs())
+    synthetic_data.generate_pois(writer, synthetic_data.BASE_POI_COUNT, layers["metro_station"],
+                                 layers["metro_network"].extent(), random.Random(2035))
+    writer.close()
+    layer = QgsVectorLayer(path, "poi_styled", "ogr")
+    if not layer.isValid():
+        raise Exception("图层{}加载失败.".format(path))
+    QgsProject.instance().addMapLayer(layer)
+    return layer, True
+
+
+def bench_styling(iface, layers, repeat):
+    """一键符号化中各个render_*方法以及categrorized_renderer"""
+    dialog = render_dlg.renderDialog(iface)
+    # 与一键符号化的计算方法一致, 按默认的输出大小和150分辨率
+    out_diag = utils.default_diag
+    label_size = int(out_diag * utils.default_label_size * 72 / 150)
+    network = layers["metro_network"]
+    fni, field_name = utils.get_field_index_no_case(network, utils.default_field.name_metro_line_id)
+    line_ids = {str(value): f"{value}号线" for value in network.uniqueValues(fni)}
+
+    project = QgsProject.instance()
+    work_dir = tempfile.mkdtemp(prefix="renderup_styling_")
+    added = []
+    try:
+        poi, generated = styled_poi_layer(layers, work_dir)
+        if generated:
+            added.append(poi.id())
+        image = QgsRasterLayer(IMAGE_PATH, "image")
+        if not image.isValid():
+            raise Exception("图层{}加载失败.".format(IMAGE_PATH))
+        project.addMapLayer(image)
+        added.append(image.id())
+
+        cases = {
+            "styling/categrorized_renderer": lambda: render_dlg.categrorized_renderer(network, fni, line_ids,
+                                                                                      field_name),
+            "styling/render_mertro_network": lambda: dialog.render_mertro_network(
+                network.id(), int(out_diag * utils.default_metro_network_width)),
+            "styling/render_metro_station": lambda: dialog.render_metro_station(
+                layers["metro_station"].id(), int(out_diag * utils.default_metro_station_size), int(label_size * 1.5)),
+            "styling/render_poi": lambda: dialog.render_poi(
+                poi.id(), int(out_diag * utils.default_poi_size), label_size),
+            "styling/render_image": lambda: dialog.render_image(image.id()),
+            "styling/render_block": lambda: dialog.render_block(
+                layers["block"].id(), int(out_diag * utils.default_block_outline_width))
+        }
+        results = {}
+        for name, func in cases.items():
+            with peak_rss() as peak:
+                times = timed(func, repeat)
+            results[name] = {"seconds": statistics.median(times), "runs": times, "peak_rss_mb": round(peak.peak, 1)}
+    finally:
+        project.removeMapLayers(added)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def bench_export(iface, layers, params, repeat):
+    """一个出图场景: 逐个地块渲染和bacth_export端到端"""
+    block_layer = layers["block"]
+    fids = [feature.id() for feature in block_layer.getFeatures()]
+    block_times = []
+    end_to_end = []
+    out_path = tempfile.mkdtemp(prefix="renderup_bench_")
+    try:
+        settings = scenario_settings(params, out_path, layers)
+        with saved_settings(settings), peak_rss() as peak:
+            # 与出图任务读取同样的设置
+            config = export.bacth_export("benchmark", iface, block_layer).config
+            for _ in range(repeat):
+                renderer = export.create_renderer(QgsProject.instance(), block_layer, config,
+                                                  checked_layer_ids(layers), block_layer.extent())
+                try:
+                    for fea_id, feature in renderer.blocks.blocks(fids):
+                        start = time.perf_counter()
+                        renderer.render(fea_id, feature)
+                        block_times.append(time.perf_counter() - start)
+                finally:
+                    renderer.close()
+
+                task = export.bacth_export("benchmark", iface, block_layer)
+                start = time.perf_counter()
+                if not task.run():
+                    raise Exception("场景{}出图失败: {}".format(scenario_name(params), task.exception))
+                end_to_end.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(out_path, ignore_errors=True)
+
+    return {
+        "params": params,
+        "seconds": statistics.median(end_to_end),
+        "runs": end_to_end,
+        "blocks": len(fids),
+        "block_mean": statistics.mean(block_times),
+        "block_p95": timing.percentile(sorted(block_times), 95),
+        "peak_rss_mb": round(peak.peak, 1)
+    }
+
+
+def run_benchmarks(quick=False, repeat=3, data_dir=TEST_DATA_DIR, only=None):
+    """
+    运行全部基准测试
+
+    Args:
+        only: 名称前缀, 例如export/direct, 只运行名称匹配的测试
+    """
+    iface = benchInterface(CANVAS)
+    results = {}
+
+    def selected(name):
+        return only is None or name.startswith(only)
+
+    if selected("startup"):
+        results["startup/plugin"] = bench_startup(iface, repeat)
+
+    layers = load_layers(data_dir)
+    if selected("styling"):
+        results.update({name: result for name, result in bench_styling(iface, layers, repeat).items()
+                        if selected(name)})
+
+    for params in scenarios(quick):
+        name = scenario_name(params)
+        if selected(name):
+            print(name, file=sys.stderr)
+            results[name] = bench_export(iface, layers, params, repeat)
+
+    return {
+        "meta": {
+            "qgis_version": Qgis.QGIS_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": machine_info(),
+            "repeat": repeat,
+            "quick": quick,
+            "dataset": dataset_info(data_dir),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "results": results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="renderUP headless benchmark")
+    parser.add_argument("--quick", action="store_true", help="只运行最小的出图场景")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测试重复次数, 取中位数")
+    parser.add_argument("--only", help="只运行名称以此开头的测试, 例如export/direct")
+    parser.add_argument("--data", default=TEST_DATA_DIR, help="数据目录")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果JSON文件")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.quick, args.repeat, args.data, args.only)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("结果已写入{}".format(args.output), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,575 @@
+# coding=utf-8
+"""Golden-image harness for the export engines.
+
+用data/test.qgz中固定的几个地块, 以原始的出图方式为基准: 逐个地块设置地块图层的过滤条件,
+每个地块新建版面和装饰元素, 由QgsLayoutExporter导出图片. 基准由本文件中的reference_export按原始代码实现,
+不经过core.export, 检查各出图路径得到的图片是否一致:
+
+    layout:         layout引擎, 地块图层不过滤, 地图中用只含当前地块的内存图层代替
+    atlas:          QgsLayoutAtlas遍历地块
+    direct:         跳过版面直接渲染地图, 不缓存装饰
+    direct_cached:  direct并预先栅格化指北针、比例尺和图例
+    mosaic:         共用拼接底图后裁剪
+    parallel:       layout引擎由两个子进程并行出图
+    strips:         layout引擎按条带渲染并流式写出
+    direct_strips:  direct引擎按条带渲染, 条带之间有重叠
+    layout_template: 整批复用同一个版面
+    legend_index:   用空间索引确定图例项
+    encode_workers: 编码写盘放在线程池中
+    mosaic_poi:     POI图层也渲染到拼接底图
+    pdf:            每个地块一个PDF
+    pdf_single:     所有地块输出为一个多页PDF
+    pdf_hybrid:     多页PDF, 底部的栅格图层按pdf_raster_dpi渲染成图片, 其余图层保持矢量
+
+基准的设置全部固定在BASE_SETTINGS中, 不受本机插件设置的影响.
+
+每张图片做两种比较:
+    像素容差:  任一通道相差超过pixel_tolerance的像素算不同, 不同像素的比例超过max_diff_ratio时失败
+    感知差异:  亮度的SSIM(8x8窗口), 低于min_ssim时失败, 对抗锯齿和标注的细微偏移不敏感
+
+PDF用PyMuPDF按输出图片的像素大小栅格化后比较, 文字和符号的抗锯齿与QGIS不同, 使用较宽的pdf_*阈值.
+失败时在输出目录的diff子目录中写出差异图: 基准图淡化为灰度, 不同的像素标红.
+在线底图的内容会变化, 默认隐藏工程中的网络图层; 加上--keep-online时底图参与比较, pdf_hybrid才会拆分出栅格底图.
+
+    cd test
+    python golden_images.py --output ../golden_output
+    python golden_images.py --engines direct,mosaic --fids 0,3 --min-ssim 0.99
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import argparse
+import importlib
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+from qgis.PyQt.QtCore import QPointF, QSizeF
+from qgis.PyQt.QtGui import QImage, QColor, QFont
+from qgis.core import QgsProject, QgsPrintLayout, QgsLayoutItemMap, QgsLayoutPoint, QgsLayoutSize, QgsUnitTypes, \
+    QgsLayoutExporter, QgsRectangle, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsDistanceArea, \
+    QgsLayoutItemShape, QgsSimpleFillSymbolLayer, QgsFillSymbol, QgsLayoutItem, QgsApplication, QgsLayoutItemPicture, \
+    QgsLayoutItemScaleBar, QgsScaleBarSettings, QgsLayoutItemLegend, QgsLegendStyle, QgsLegendRenderer, QgsTextFormat
+
+from benchmark import benchInterface, saved_settings, CANVAS, PACKAGE, TEST_DATA_DIR, export
+
+telemetry = importlib.import_module(f"{PACKAGE}.core.telemetry")
+utils = importlib.import_module(f"{PACKAGE}.utils")
+pdf_batch = importlib.import_module(f"{PACKAGE}.core.pdf_batch")
+
+PROJECT_PATH = os.path.join(TEST_DATA_DIR, "test.qgz")
+# 工程中作为POI出图的点图层
+POI_LAYER_NAME = "小学汇总"
+REFERENCE = "reference"
+
+# 各出图路径在基准设置上修改的设置
+VARIANTS = {
+    "layout": {"export_engine": "layout"},
+    "atlas": {"export_engine": "atlas"},
+    "direct": {"export_engine": "direct", "decoration_cache": False},
+    "direct_cached": {"export_engine": "direct", "decoration_cache": True},
+    "mosaic": {"export_engine": "mosaic"},
+    "parallel": {"export_engine": "layout", "export_workers": 2},
+    "strips": {"export_engine": "layout", "strip_memory_mb": 1},
+    "direct_strips": {"export_engine": "direct", "strip_memory_mb": 2},
+    "layout_template": {"export_engine": "layout", "layout_template": True},
+    "legend_index": {"export_engine": "layout", "legend_index": True},
+    "encode_workers": {"export_engine": "layout", "encode_workers": 2},
+    "mosaic_poi": {"export_engine": "mosaic", "mosaic_poi": True},
+    "pdf": {"export_engine": "layout", "out_format": "pdf"},
+    "pdf_single": {"export_engine": "layout", "out_format": "pdf", "pdf_single": True},
+    "pdf_hybrid": {"export_engine": "layout", "out_format": "pdf", "pdf_single": True, "pdf_hybrid": True}
+}
+
+BASE_SETTINGS = {
+    "out_width": 1280,
+    "out_height": 960,
+    "out_resolution": 96,
+    "out_format": "png",
+    "radius": 1000.0,
+    "draw_circle": 2,
+    "draw_northarrow": 2,
+    "draw_scalebar": 2,
+    "draw_legend": 2,
+    "export_engine": "layout",
+    "export_workers": 1,
+    # 与基准一致的逐个地块重建版面、按地图过滤图例、同步编码, 各项优化由VARIANTS单独打开
+    "layout_template": False,
+    "legend_index": False,
+    "decoration_cache": False,
+    "mosaic_poi": False,
+    "project_files": "full",
+    "incremental": False,
+    "tile_prefetch": False,
+    "encode_workers": 0,
+    "encoder_preset": "balanced",
+    "png_compression": 4,
+    "png_palette": False,
+    "jpg_quality": 90,
+    "jpg_progressive": False,
+    "webp_quality": 100,
+    "tif_compress": "LZW",
+    "pdf_single": False,
+    "pdf_hybrid": False,
+    "pdf_raster_dpi": 150,
+    "strip_memory_mb": 512,
+    "layer_timing_every": 0,
+    "profile_every": 0,
+    "profile_sample_ms": 0,
+    "cleanup_every": 0
+}
+
+# 默认取前几个地块
+DEFAULT_BLOCKS = 3
+PIXEL_TOLERANCE = 16
+MAX_DIFF_RATIO = 0.01
+MIN_SSIM = 0.97
+# PDF由另一个引擎栅格化, 文字和细线的抗锯齿不同
+PDF_MAX_DIFF_RATIO = 0.05
+PDF_MIN_SSIM = 0.9
+SSIM_WINDOW = 8
+
+
+def load_project(path=PROJECT_PATH, keep_online=False):
+    """打开工程, 返回(地块图层, checked_layer_ids); 默认隐藏在线底图等网络图层, POI使用工程中的小学点图层"""
+    project = QgsProject.instance()
+    if not project.read(path):
+        raise Exception("工程{}打开失败.".format(path))
+
+    block_layer = None
+    station_layer = None
+    poi_layer = None
+    for layer in project.mapLayers().values():
+        if layer.name() == "blocks":
+            block_layer = layer
+        elif "地铁站点" in layer.name():
+            station_layer = layer
+        elif layer.name() == POI_LAYER_NAME:
+            poi_layer = layer
+        if not keep_online and layer.providerType() in ("wms", "xyz", "arcgismapserver"):
+            node = project.layerTreeRoot().findLayer(layer.id())
+            if node is not None:
+                node.setItemVisibilityChecked(False)
+    if block_layer is None:
+        raise Exception("工程中没有blocks图层.")
+    if poi_layer is None:
+        raise Exception("工程中没有{}图层.".format(POI_LAYER_NAME))
+    # POI图层需要显示, 图例和mosaic_poi才会用到它
+    node = project.layerTreeRoot().findLayer(poi_layer.id())
+    if node is not None:
+        node.setItemVisibilityChecked(True)
+
+    station_id = station_layer.id() if station_layer is not None else None
+    return block_layer, {"轨道站点": station_id, "POI": poi_layer.id()}
+
+
+def reference_export(iface, block_layer, checked_layer_ids, fids, settings, out_path):
+    """
+    按原始代码出图作为基准: 逐个地块设置地块图层的过滤条件, 每个地块新建版面和各装饰元素后导出图片.
+    地块图层的主键字段按字段名过滤; 不写工程文件, 工程文件不影响图片.
+
+    Returns:
+        dict: {fid: (图片路径, None)}
+    """
+    project = QgsProject.instance()
+    out_width = settings["out_width"]
+    out_height = settings["out_height"]
+    out_resolution = settings["out_resolution"]
+    radius = settings["radius"]
+    out_format = settings["out_format"]
+
+    out_diag = math.sqrt(out_width ** 2 + out_height ** 2)
+    scalebar_size = int(out_diag * utils.default_scalebar_size * 72 / out_resolution)
+    legend_title_size = int(scalebar_size * 1.5)
+    legend_label_size = int(legend_title_size * 0.8)
+    lyrs_to_remove = [l for l in project.mapLayers() if l not in list(checked_layer_ids.values())]
+
+    circle_symbol = QgsFillSymbol()
+    circle_symbol.changeSymbolLayer(0, QgsSimpleFillSymbolLayer.create({
+        'outline_color': "64,64,64,77",
+        'color': '0,0,0,0',
+        'outline_style': 'dot',
+        'outline_width': "5",
+        'outline_width_unit': 'Pixel'
+    }))
+
+    if project.crs().isGeographic():
+        project.setCrs(QgsCoordinateReferenceSystem("EPSG:3857"))
+    geom_tr = None
+    if block_layer.crs().authid() != "EPSG:3857":
+        geom_tr = QgsCoordinateTransform(
+            QgsCoordinateReferenceSystem(f"EPSG:{utils.epsg_code(block_layer.crs())}"),
+            QgsCoordinateReferenceSystem(f"EPSG:{utils.epsg_code(project.crs())}"), project)
+
+    key_list = block_layer.primaryKeyAttributes()
+    fid_name = block_layer.fields().at(key_list[0]).name() if len(key_list) > 0 else "fid"
+
+    def layout_length(map_item, length, start_pt):
+        d = QgsDistanceArea()
+        d.setEllipsoid(project.ellipsoid())
+        map_length = d.convertLengthMeasurement(length, project.distanceUnits())
+        start = map_item.mapToItemCoords(QPointF(start_pt.x(), start_pt.y()))
+        end = map_item.mapToItemCoords(QPointF(start_pt.x() + map_length, start_pt.y()))
+        return end.x() - start.x()
+
+    outputs = {}
+    try:
+        for fea_id in fids:
+            if not block_layer.setSubsetString("{}={}".format(fid_name, fea_id)):
+                raise Exception("fid{}不存在.".format(fea_id))
+            feature = next(block_layer.getFeatures())
+            geom = feature.geometry()
+
+            manager = project.layoutManager()
+            for layout in manager.printLayouts():
+                if layout.name() == "golden_reference":
+                    manager.removeLayout(layout)
+            layout = QgsPrintLayout(project)
+            layout.initializeDefaults()
+            layout.setName("golden_reference")
+            manager.addLayout(layout)
+            layout.pageCollection().pages()[0].setPageSize(
+                QgsLayoutSize(out_width, out_height, QgsUnitTypes.LayoutUnit.LayoutPixels))
+
+            map_item = QgsLayoutItemMap(layout)
+            map_item.mapSettings(iface.mapCanvas().extent(), QSizeF(out_width, out_height), dpi=out_resolution,
+                                 includeLayerSettings=True)
+            map_item.setRect(0, 0, out_width, out_height)
+            map_item.zoomToExtent(iface.mapCanvas().extent())
+            map_item.setBackgroundColor(QColor(255, 255, 255, 0))
+            layout.addLayoutItem(map_item)
+            map_item.attemptMove(QgsLayoutPoint(0, 0, QgsUnitTypes.LayoutUnit.LayoutPixels))
+            map_item.attemptResize(QgsLayoutSize(out_width, out_height, QgsUnitTypes.LayoutUnit.LayoutPixels))
+
+            if geom_tr is not None:
+                geom.transform(geom_tr)
+            centroid = geom.pointOnSurface().asPoint()
+            extent = QgsRectangle.fromCenterAndSize(centroid, 2 * radius, 2 * radius)
+            extent.scale(1.2)
+            map_item.zoomToExtent(extent)
+
+            if settings["draw_circle"]:
+                ele_circle = QgsLayoutItemShape(layout)
+                ele_circle.setShapeType(QgsLayoutItemShape.Shape.Ellipse)
+                ele_circle.setReferencePoint(QgsLayoutItem.ReferencePoint.Middle)
+                ele_circle.setSymbol(circle_symbol.clone())
+                layout_centroid = map_item.mapToItemCoords(QPointF(centroid.x(), centroid.y()))
+                layout_radius = layout_length(map_item, radius, centroid)
+                ele_circle.attemptMove(QgsLayoutPoint(layout_centroid.x(), layout_centroid.y(),
+                                                      QgsUnitTypes.LayoutUnit.LayoutMillimeters))
+                ele_circle.setFixedSize(QgsLayoutSize(2 * layout_radius, 2 * layout_radius))
+                layout.addLayoutItem(ele_circle)
+
+            if settings["draw_northarrow"]:
+                north_path = os.path.join(utils.IconDir, "north_arrow.svg")
+                if not os.path.exists(north_path):
+                    north_path = os.path.join(QgsApplication.prefixPath(), "svg", "arrows", "NorthArrow_10.svg")
+                    if not os.path.exists(north_path):
+                        north_path = None
+                if north_path is not None:
+                    north_item = QgsLayoutItemPicture(layout)
+                    north_item.setPicturePath(north_path)
+                    layout.addLayoutItem(north_item)
+                    north_item.attemptResize(QgsLayoutSize(max(20, int(out_width / 10)), max(20, int(out_height / 10)),
+                                                           QgsUnitTypes.LayoutUnit.LayoutPixels))
+                    north_item.attemptMove(QgsLayoutPoint(int(17 * out_width / 19), int(2 * out_height / 19),
+                                                          QgsUnitTypes.LayoutUnit.LayoutPixels))
+
+            if settings["draw_scalebar"]:
+                scalebar_item = QgsLayoutItemScaleBar(layout)
+                scalebar_item.setLinkedMap(map_item)
+                scalebar_item.setStyle("Line Ticks Up")
+                scalebar_item.attemptMove(QgsLayoutPoint(int(1 * out_width / 19), int(16 * out_height / 19),
+                                                         QgsUnitTypes.LayoutUnit.LayoutPixels))
+                scalebar_item.setUnitLabel("米")
+                tf = QgsTextFormat()
+                tf.setFont(QFont(utils.DefaultFont))
+                tf.setSize(scalebar_size)
+                scalebar_item.setTextFormat(tf)
+                scalebar_item.setLabelBarSpace(1)
+                scalebar_item.setSegmentSizeMode(QgsScaleBarSettings.SegmentSizeMode.SegmentSizeFixed)
+                scalebar_item.setNumberOfSegmentsLeft(0)
+                scalebar_item.setNumberOfSegments(2)
+                scalebar_item.setMaximumBarWidth(40)
+                scalebar_item.setMinimumSize(QgsLayoutSize(40, 1.5))
+                scalebar_item.setUnits(QgsUnitTypes.DistanceUnit.DistanceMeters)
+                scalebar_item.setUnitsPerSegment(int(radius / 4))
+                scalebar_item.setHeight(out_height / 500)
+                layout.addLayoutItem(scalebar_item)
+
+            if settings["draw_legend"]:
+                legend_item = QgsLayoutItemLegend(layout)
+                legend_item.setLinkedMap(map_item)
+                title_style = QgsLegendStyle()
+                font = QFont(utils.DefaultFont, legend_title_size)
+                font.setBold(True)
+                title_style.setFont(font)
+                legend_item.setStyle(QgsLegendStyle.Style.Title, title_style)
+                legend_item.setTitle("图例")
+                symbol_label_style = QgsLegendStyle()
+                symbol_label_style.setFont(QFont(utils.DefaultFont, legend_label_size, 1, False))
+                legend_item.setStyle(QgsLegendStyle.Style.SymbolLabel, symbol_label_style)
+                legend_item.rstyle(QgsLegendStyle.Style.Symbol).setMargin(QgsLegendStyle.Side.Top, 0.3)
+                legend_item.rstyle(QgsLegendStyle.Style.Title).setMargin(QgsLegendStyle.Side.Bottom, 1)
+                legend_item.setLegendFilterByMapEnabled(True)
+                legend_item.setAutoUpdateModel(autoUpdate=False)
+                root = legend_item.model().rootGroup()
+                legend_item.model().setRootGroup(root)
+                for tr in root.children():
+                    if tr.layerId() == checked_layer_ids["轨道站点"]:
+                        tr.setCustomProperty("legend/title-label", "轨道站点")
+                    elif tr.layerId() == checked_layer_ids["POI"]:
+                        tr.setCustomProperty("legend/title-label", "POI")
+                        QgsLegendRenderer.setNodeLegendStyle(tr, QgsLegendStyle.Style.Hidden)
+                for lr in lyrs_to_remove:
+                    root.removeLayer(project.mapLayer(lr))
+                legend_item.model().setRootGroup(root)
+                legend_item.setBackgroundColor(QColor(255, 255, 255, 153))
+                legend_item.adjustBoxSize()
+                legend_item.refresh()
+                layout.addLayoutItem(legend_item)
+
+            path = os.path.join(out_path, out_format, f"out_{fea_id}.{out_format}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            result = QgsLayoutExporter(layout).exportToImage(path, QgsLayoutExporter.ImageExportSettings())
+            if result != QgsLayoutExporter.ExportResult.Success:
+                raise Exception("基准图片{}导出失败.".format(path))
+            outputs[fea_id] = (path, None)
+    finally:
+        block_layer.setSubsetString("")
+    return outputs
+
+
+def render_variant(iface, block_layer, checked_layer_ids, fids, settings, out_path):
+    """
+    按设置出图, 与出图任务走同样的render_blocks
+
+    Returns:
+        dict: {fid: (输出文件路径, PDF页码)}, 图片的页码为None
+    """
+    values = dict(settings, out_path=out_path)
+    with saved_settings(values):
+        task = export.bacth_export("golden", iface, block_layer)
+        task.telemetry = telemetry.export_telemetry(len(fids), out_path)
+        if not task.render_blocks(fids, checked_layer_ids):
+            raise Exception("出图失败: {}".format(task.exception))
+    out_format = settings["out_format"]
+    if out_format == "pdf" and settings["pdf_single"]:
+        path = os.path.join(out_path, "pdf", pdf_batch.PDF_BATCH_NAME)
+        return {fea_id: (path, page) for page, fea_id in enumerate(fids)}
+    page = 0 if out_format == "pdf" else None
+    return {fea_id: (os.path.join(out_path, out_format, f"out_{fea_id}.{out_format}"), page) for fea_id in fids}
+
+
+def output_array(path, page, width, height):
+    """读取出图结果, PDF页面栅格化为width x height"""
+    if page is None:
+        return image_array(path)
+    return pdf_page_array(path, page, width, height)
+
+
+def pdf_page_array(path, page, width, height):
+    """用PyMuPDF把PDF的一页栅格化为HxWx4的uint8数组(RGBA), 大小与输出图片相同"""
+    try:
+        import fitz
+    except ImportError:
+        raise Exception("比较PDF需要安装PyMuPDF: pip install pymupdf")
+    with fitz.open(path) as doc:
+        if page >= doc.page_count:
+            raise Exception("PDF{}只有{}页, 没有第{}页.".format(path, doc.page_count, page + 1))
+        pdf_page = doc[page]
+        matrix = fitz.Matrix(width / pdf_page.rect.width, height / pdf_page.rect.height)
+        pixmap = pdf_page.get_pixmap(matrix=matrix, alpha=False)
+        rgb = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.stride)
+        rgb = rgb[:, :pixmap.width * pixmap.n].reshape(pixmap.height, pixmap.width, pixmap.n)[:, :, :3]
+    return np.dstack([rgb, np.full(rgb.shape[:2], 255, np.uint8)])
+
+
+def image_array(path):
+    """读取为HxWx4的uint8数组(RGBA)"""
+    image = QImage(path)
+    if image.isNull():
+        raise Exception("图片{}读取失败.".format(path))
+    image = image.convertToFormat(QImage.Format_RGBA8888)
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    data = np.frombuffer(ptr, np.uint8).reshape(image.height(), image.bytesPerLine())
+    return data[:, :image.width() * 4].reshape(image.height(), image.width(), 4).copy()
+
+
+def luminance(array):
+    rgb = array[:, :, :3].astype(np.float64)
+    return rgb[:, :, 0] * 0.299 + rgb[:, :, 1] * 0.587 + rgb[:, :, 2] * 0.114
+
+
+def ssim(a, b, window=SSIM_WINDOW):
+    """不重叠窗口的平均SSIM, 输入为亮度数组"""
+    h = a.shape[0] // window * window
+    w = a.shape[1] // window * window
+    if h == 0 or w == 0:
+        return 1.0
+    shape = (h // window, window, w // window, window)
+    x = a[:h, :w].reshape(shape)
+    y = b[:h, :w].reshape(shape)
+    mx = x.mean(axis=(1, 3))
+    my = y.mean(axis=(1, 3))
+    vx = x.var(axis=(1, 3))
+    vy = y.var(axis=(1, 3))
+    cov = (x * y).mean(axis=(1, 3)) - mx * my
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    value = ((2 * mx * my + c1) * (2 * cov + c2)) / ((mx ** 2 + my ** 2 + c1) * (vx + vy + c2))
+    return float(value.mean())
+
+
+def compare_images(reference, candidate, pixel_tolerance=PIXEL_TOLERANCE):
+    """
+    Returns:
+        dict: diff_ratio, max_diff, ssim和不同像素的掩码mask; 尺寸不同时只有error
+    """
+    if reference.shape != candidate.shape:
+        return {"error": "尺寸不同: {}x{}, {}x{}".format(reference.shape[1], reference.shape[0],
+                                                      candidate.shape[1], candidate.shape[0])}
+    delta = np.abs(reference.astype(np.int16) - candidate.astype(np.int16)).max(axis=2)
+    mask = delta > pixel_tolerance
+    return {
+        "diff_ratio": float(mask.mean()),
+        "max_diff": int(delta.max()),
+        "ssim": ssim(luminance(reference), luminance(candidate)),
+        "mask": mask
+    }
+
+
+def write_diff(reference, mask, path):
+    """基准图淡化为灰度, 不同的像素标红"""
+    gray = (luminance(reference) * 0.3 + 255 * 0.7).astype(np.uint8)
+    out = np.dstack([gray, gray, gray, np.full(gray.shape, 255, np.uint8)])
+    out[mask] = [255, 0, 0, 255]
+    out = np.ascontiguousarray(out)
+    image = QImage(out.data, out.shape[1], out.shape[0], out.shape[1] * 4, QImage.Format_RGBA8888)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not image.save(path):
+        raise Exception("差异图{}保存失败.".format(path))
+
+
+def run_harness(output, engines=None, fids=None, project_path=PROJECT_PATH, keep_online=False,
+                pixel_tolerance=PIXEL_TOLERANCE, max_diff_ratio=MAX_DIFF_RATIO, min_ssim=MIN_SSIM,
+                pdf_max_diff_ratio=PDF_MAX_DIFF_RATIO, pdf_min_ssim=PDF_MIN_SSIM):
+    """
+    以原始的逐地块过滤出图为基准比较各出图路径
+
+    Returns:
+        list: 每个(出图路径, 地块)一项, passed为False时diff为差异图路径
+    """
+    iface = benchInterface(CANVAS)
+    block_layer, checked_layer_ids = load_project(project_path, keep_online)
+    if fids is None:
+        fids = sorted(feature.id() for feature in block_layer.getFeatures())[:DEFAULT_BLOCKS]
+    os.makedirs(output, exist_ok=True)
+
+    reference = reference_export(iface, block_layer, checked_layer_ids, fids, BASE_SETTINGS,
+                                 os.path.join(output, REFERENCE))
+    results = []
+    for name in (engines or list(VARIANTS)):
+        settings = dict(BASE_SETTINGS, **VARIANTS[name])
+        print(name, file=sys.stderr)
+        try:
+            outputs = render_variant(iface, block_layer, checked_layer_ids, fids, settings, os.path.join(output, name))
+        except Exception as e:
+            results.extend({"engine": name, "fid": fea_id, "passed": False, "error": str(e)} for fea_id in fids)
+            continue
+
+        is_pdf = settings["out_format"] == "pdf"
+        for fea_id in fids:
+            result = {"engine": name, "fid": fea_id}
+            path, page = outputs[fea_id]
+            if not os.path.exists(path):
+                result.update(passed=False, error="没有输出文件")
+                results.append(result)
+                continue
+            expected = image_array(reference[fea_id][0])
+            try:
+                actual = output_array(path, page, expected.shape[1], expected.shape[0])
+            except Exception as e:
+                result.update(passed=False, error=str(e))
+                results.append(result)
+                continue
+            diff = compare_images(expected, actual, pixel_tolerance)
+            mask = diff.pop("mask", None)
+            result.update(diff)
+            result["passed"] = "error" not in diff and \
+                diff["diff_ratio"] <= (pdf_max_diff_ratio if is_pdf else max_diff_ratio) and \
+                diff["ssim"] >= (pdf_min_ssim if is_pdf else min_ssim)
+            if not result["passed"] and mask is not None:
+                result["diff"] = os.path.join(output, "diff", f"{name}_{fea_id}.png")
+                write_diff(expected, mask, result["diff"])
+            results.append(result)
+    return results
+
+
+def format_results(results):
+    lines = []
+    for result in results:
+        status = "ok" if result["passed"] else "FAILED"
+        if "error" in result:
+            detail = result["error"]
+        else:
+            detail = "diff {:.3%}, max {}, ssim {:.4f}".format(result["diff_ratio"], result["max_diff"], result["ssim"])
+        if "diff" in result:
+            detail += ", " + result["diff"]
+        lines.append("{:<14} fid{:<6} {:<7} {}".format(result["engine"], result["fid"], status, detail))
+    failed = sum(1 for result in results if not result["passed"])
+    lines.append("{} passed, {} failed".format(len(results) - failed, failed))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="renderUP golden-image harness")
+    parser.add_argument("--output", help="输出目录, 默认为临时目录, 全部通过时删除")
+    parser.add_argument("--project", default=PROJECT_PATH, help="QGIS工程")
+    parser.add_argument("--engines", help="逗号分隔的出图路径, 默认全部: " + ",".join(VARIANTS))
+    parser.add_argument("--fids", help="逗号分隔的地块fid, 默认前{}个".format(DEFAULT_BLOCKS))
+    parser.add_argument("--keep-online", action="store_true", help="不隐藏在线底图")
+    parser.add_argument("--pixel-tolerance", type=int, default=PIXEL_TOLERANCE, help="单个通道允许的差值")
+    parser.add_argument("--max-diff-ratio", type=float, default=MAX_DIFF_RATIO, help="允许不同的像素比例")
+    parser.add_argument("--min-ssim", type=float, default=MIN_SSIM, help="SSIM下限")
+    parser.add_argument("--pdf-max-diff-ratio", type=float, default=PDF_MAX_DIFF_RATIO, help="PDF允许不同的像素比例")
+    parser.add_argument("--pdf-min-ssim", type=float, default=PDF_MIN_SSIM, help="PDF的SSIM下限")
+    args = parser.parse_args(argv)
+
+    engines = args.engines.split(",") if args.engines else None
+    for name in engines or []:
+        if name not in VARIANTS:
+            parser.error("出图路径{}不存在.".format(name))
+    fids = [int(fid) for fid in args.fids.split(",")] if args.fids else None
+    output = args.output or tempfile.mkdtemp(prefix="renderup_golden_")
+
+    results = run_harness(output, engines, fids, args.project, args.keep_online,
+                          args.pixel_tolerance, args.max_diff_ratio, args.min_ssim,
+                          args.pdf_max_diff_ratio, args.pdf_min_ssim)
+    with open(os.path.join(output, "results.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(format_results(results))
+
+    failed = any(not result["passed"] for result in results)
+    if not failed and args.output is None:
+        shutil.rmtree(output, ignore_errors=True)
+    elif failed:
+        print("差异图和结果在{}".format(output), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
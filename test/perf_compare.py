@@ -0,0 +1,179 @@
+# coding=utf-8
+"""Performance regression gate.
+
+把benchmark.py的结果与仓库中保存的基线(perf_baselines.json)比较,
+任何一项的耗时或峰值内存超出容差时列出差异并返回非0, 可以放在CI或提交前检查中:
+
+    cd test
+    python benchmark.py --output ../benchmark_results.json
+    python perf_compare.py ../benchmark_results.json
+    python perf_compare.py ../benchmark_results.json --update    # 确认后更新基线
+
+基线文件与benchmark.py的结果格式相同, 另外可以有tolerance:
+    "tolerance": {"seconds": 0.15, "peak_rss_mb": 0.10}   相对容差
+    "floor": {"seconds": 0.02, "peak_rss_mb": 20}         绝对容差, 差值小于它时不算退化, 避免很快的测试因抖动失败
+单项结果中也可以写tolerance, 覆盖全局的相对容差.
+
+基线中没有的测试列为missing并算作失败, 否则基线为空时检查总能通过; 新增测试时先用--update记录基线,
+或者加--allow-new把它们列为new, 不算失败. 本次没有运行的测试列为skipped, 不算失败.
+基线的meta中记录了QGIS版本、平台和机器(CPU、核数、内存), 与本次不同时给出提示.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import argparse
+import json
+import os
+import sys
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf_baselines.json")
+
+# 比较的指标, export场景另外比较单个地块的p95
+METRICS = ["seconds", "peak_rss_mb", "block_p95"]
+DEFAULT_TOLERANCE = {"seconds": 0.15, "peak_rss_mb": 0.10, "block_p95": 0.20}
+DEFAULT_FLOOR = {"seconds": 0.02, "peak_rss_mb": 20, "block_p95": 0.02}
+UNITS = {"seconds": "s", "peak_rss_mb": "MB", "block_p95": "s"}
+# 算作失败的状态
+FAILED = ["regressed", "missing"]
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline, current, allow_new=False):
+    """
+    逐项比较
+
+    Args:
+        allow_new: 基线中没有的测试列为new而不是missing
+
+    Returns:
+        list: 每行为dict(name, metric, base, value, change, limit, status),
+              status为ok, regressed, improved, missing, new, skipped
+    """
+    tolerance = dict(DEFAULT_TOLERANCE, **baseline.get("tolerance", {}))
+    floor = dict(DEFAULT_FLOOR, **baseline.get("floor", {}))
+    base_results = baseline.get("results", {})
+    results = current.get("results", {})
+    rows = []
+
+    for name in sorted(set(base_results) | set(results)):
+        if name not in base_results:
+            rows.append({"name": name, "metric": "", "status": "new" if allow_new else "missing"})
+            continue
+        if name not in results:
+            rows.append({"name": name, "metric": "", "status": "skipped"})
+            continue
+        base = base_results[name]
+        value = results[name]
+        limits = dict(tolerance, **base.get("tolerance", {}))
+        for metric in METRICS:
+            if base.get(metric) is None or value.get(metric) is None:
+                continue
+            delta = value[metric] - base[metric]
+            change = delta / base[metric] if base[metric] > 0 else 0.0
+            if change > limits[metric] and delta > floor[metric]:
+                status = "regressed"
+            elif change < -limits[metric] and -delta > floor[metric]:
+                status = "improved"
+            else:
+                status = "ok"
+            rows.append({"name": name, "metric": metric, "base": base[metric], "value": value[metric],
+                         "change": change, "limit": limits[metric], "status": status})
+    return rows
+
+
+def format_value(value, metric):
+    if metric == "peak_rss_mb":
+        return "{:.1f}{}".format(value, UNITS[metric])
+    return "{:.3f}{}".format(value, UNITS[metric])
+
+
+def format_report(rows, verbose=False):
+    """退化、改善和缺少基线的项目总是列出, verbose时列出全部"""
+    lines = []
+    shown = [row for row in rows if verbose or row["status"] in FAILED + ["improved"]]
+    if len(shown) > 0:
+        width = max(len(row["name"]) for row in shown)
+        lines.append("{:<{w}}  {:<12} {:>11} {:>11} {:>8} {:>6}  {}".format(
+            "test", "metric", "baseline", "current", "change", "limit", "status", w=width))
+        for row in shown:
+            if row["metric"] == "":
+                lines.append("{:<{w}}  {:<12} {:>11} {:>11} {:>8} {:>6}  {}".format(
+                    row["name"], "", "", "", "", "", row["status"], w=width))
+                continue
+            lines.append("{:<{w}}  {:<12} {:>11} {:>11} {:>+7.1%} {:>6.0%}  {}".format(
+                row["name"], row["metric"], format_value(row["base"], row["metric"]),
+                format_value(row["value"], row["metric"]), row["change"], row["limit"], row["status"], w=width))
+
+    counts = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    lines.append(", ".join("{} {}".format(count, status) for status, count in sorted(counts.items())))
+    return "\n".join(lines)
+
+
+def update_baseline(baseline, current, only=None):
+    """用本次结果更新基线, 保留容差设置和单项的tolerance"""
+    results = baseline.setdefault("results", {})
+    for name, value in current.get("results", {}).items():
+        if only is not None and not name.startswith(only):
+            continue
+        entry = {metric: value[metric] for metric in METRICS if value.get(metric) is not None}
+        if "tolerance" in results.get(name, {}):
+            entry["tolerance"] = results[name]["tolerance"]
+        results[name] = entry
+    baseline["meta"] = current.get("meta", {})
+    return baseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="renderUP performance regression gate")
+    parser.add_argument("current", help="benchmark.py输出的结果JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线JSON")
+    parser.add_argument("--update", action="store_true", help="用本次结果更新基线, 不做比较")
+    parser.add_argument("--only", help="只更新名称以此开头的测试")
+    parser.add_argument("--allow-new", action="store_true", help="基线中没有的测试不算失败")
+    parser.add_argument("--verbose", action="store_true", help="列出全部比较结果")
+    args = parser.parse_args(argv)
+
+    current = load(args.current)
+    baseline = load(args.baseline) if os.path.exists(args.baseline) else {}
+
+    if args.update:
+        update_baseline(baseline, current, args.only)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print("基线已更新: {}".format(args.baseline), file=sys.stderr)
+        return 0
+
+    baseline_meta = baseline.get("meta", {})
+    current_meta = current.get("meta", {})
+    for key in ("qgis_version", "platform", "machine"):
+        if baseline_meta.get(key) not in (None, current_meta.get(key)):
+            print("注意: 基线的{}为{}, 本次为{}".format(key, baseline_meta.get(key), current_meta.get(key)),
+                  file=sys.stderr)
+
+    rows = compare(baseline, current, args.allow_new)
+    print(format_report(rows, args.verbose))
+    if len(baseline.get("results", {})) == 0:
+        print("基线{}还没有记录结果: {}".format(args.baseline, baseline_meta.get("note", "")), file=sys.stderr)
+    elif any(row["status"] == "missing" for row in rows):
+        print("基线{}中缺少部分测试, 请在参考机器上运行make perf-baseline记录基线.".format(args.baseline),
+              file=sys.stderr)
+    return 1 if any(row["status"] in FAILED for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+# coding=utf-8
+"""Synthetic scale-up dataset generator.
+
+以data目录中的示例数据为基础生成更大的图层, 用于压力测试和基准测试:
+    block:          复制示例地块, 平移到轨道线网范围内的随机位置并稍作抖动, LandID重新编号
+    poi:            生成POI, type字段取一键符号化配色poi_type_color_dict中的类型, 多数聚集在轨道站点周围
+    metro_network:  复制示例线路并平移, lineID轮流取metro_line_color_dict中的线路号
+    metro_station:  与线路一起复制平移, 编号字段按份偏移, 站名加上份号
+    road_network:   与线路一起复制平移
+
+    cd test
+    python synthetic_data.py --scale 100 --format gpkg --output ../data/synthetic_100x
+    python benchmark.py --data ../data/synthetic_100x
+
+输出目录中的dataset.json记录各图层的文件和要素数, benchmark.py据此加载图层.
+随机数种子固定, 同样的参数生成同样的数据.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.PyQt.QtGui import QTransform
+from qgis.core import QgsVectorLayer, QgsVectorFileWriter, QgsFeature, QgsFields, QgsField, QgsGeometry, \
+    QgsPointXY, QgsWkbTypes, QgsCoordinateTransformContext, QgsCoordinateTransform, QgsProject
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+utils = importlib.import_module(f"{load_plugin_package()}.utils")
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+DATASET_NAME = "dataset.json"
+
+SOURCE_FILES = {
+    "block": "blocks.shp",
+    "metro_network": "2035年地铁线路_WGS84_2023-12-28_19-14-32_CGCS2000投影_2023-12-28_21-05-15.shp",
+    "metro_station": "c2035年地铁站点_CGCS2000投影_2023-12-28_21-05-15.shp",
+    "road_network": "GD.shp"
+}
+
+# 1倍时的POI个数, 示例数据中没有带type字段的POI图层
+BASE_POI_COUNT = 1000
+# POI各类型的相对权重, 是为了让各类样式的要素数有差别而假设的值, 不是统计数据;
+# 类型以poi_type_color_dict为准, 这里没有列出的类型权重为1
+POI_TYPE_WEIGHTS = {"商业服务": 6, "学校": 1.5, "医院": 0.8, "大型公服": 1.7}
+# 聚集在轨道站点周围的POI比例和离站点距离的标准差(米)
+POI_CLUSTER_RATIO = 0.8
+POI_CLUSTER_SIGMA = 800
+# 复制地块时的随机旋转角度(度)和缩放范围
+BLOCK_JITTER_ANGLE = 15
+BLOCK_JITTER_SCALE = (0.8, 1.25)
+
+FORMATS = {"gpkg": ("GPKG", "gpkg"), "shp": ("ESRI Shapefile", "shp")}
+BATCH_SIZE = 10000
+
+
+def load_layer(data_dir, file_name):
+    layer = QgsVectorLayer(os.path.join(data_dir, file_name), os.path.splitext(file_name)[0], "ogr")
+    if not layer.isValid():
+        raise Exception("图层{}加载失败.".format(file_name))
+    return layer
+
+
+class layer_writer:
+    """分批写出要素, 百万级要素时内存中最多保留一批"""
+
+    def __init__(self, path, driver, fields, wkb_type, crs):
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = driver
+        options.fileEncoding = "UTF-8"
+        if os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self.writer = QgsVectorFileWriter.create(path, fields, wkb_type, crs, QgsCoordinateTransformContext(), options)
+        if self.writer.hasError() != QgsVectorFileWriter.NoError:
+            raise Exception("图层{}创建失败: {}".format(path, self.writer.errorMessage()))
+        self.fields = fields
+        self.batch = []
+        self.count = 0
+
+    def add(self, geometry, attributes):
+        feature = QgsFeature(self.fields)
+        feature.setGeometry(geometry)
+        feature.setAttributes(attributes)
+        self.batch.append(feature)
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self.batch) == 0:
+            return
+        if not self.writer.addFeatures(self.batch):
+            raise Exception("图层{}写入失败: {}".format(self.path, self.writer.errorMessage()))
+        self.count += len(self.batch)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        del self.writer
+        return self.count
+
+
+def random_point(rng, extent):
+    return QgsPointXY(rng.uniform(extent.xMinimum(), extent.xMaximum()),
+                      rng.uniform(extent.yMinimum(), extent.yMaximum()))
+
+
+def field_value(field, value):
+    """按字段类型转换, lineID在不同数据中可能是整数或者字符串"""
+    if field.type() in (QVariant.Int, QVariant.LongLong):
+        return int(value)
+    if field.type() == QVariant.Double:
+        return float(value)
+    return str(value)
+
+
+def generate_blocks(source, writer, count, extent, rng):
+    """复制示例地块并平移到随机位置, 随机旋转和缩放; 地块编号重新编号"""
+    features = list(source.getFeatures())
+    fni, _ = utils.get_field_index_no_case(source, utils.default_field.name_block)
+    for i in range(count):
+        feature = features[i % len(features)]
+        geometry = QgsGeometry(feature.geometry())
+        center = geometry.centroid().asPoint()
+        geometry.rotate(rng.uniform(-BLOCK_JITTER_ANGLE, BLOCK_JITTER_ANGLE), center)
+        scale = rng.uniform(*BLOCK_JITTER_SCALE)
+        target = random_point(rng, extent)
+        # QgsGeometry没有按点缩放的方法, 先平移到原点缩放再平移到目标位置
+        geometry.translate(-center.x(), -center.y())
+        geometry.transform(QTransform.fromScale(scale, scale))
+        geometry.translate(target.x(), target.y())
+
+        attributes = list(feature.attributes())
+        if fni >= 0:
+            attributes[fni] = field_value(source.fields().at(fni), f"{i + 1}")
+        writer.add(geometry, attributes)
+
+
+def copy_offsets(copies, extent, rng):
+    """第一份保持原样, 其余每份整体平移到随机位置"""
+    offsets = [(0.0, 0.0)]
+    for _ in range(copies - 1):
+        offsets.append((rng.uniform(-extent.width() / 2, extent.width() / 2),
+                        rng.uniform(-extent.height() / 2, extent.height() / 2)))
+    return offsets
+
+
+def replicate(source, writer, offsets, crs, attributes_of=None):
+    """
+    按平移量复制全部要素, attributes_of(第几份, 属性)可以修改复制后的属性.
+    示例道路是Web墨卡托投影, 先转换到地块的坐标系再平移
+    """
+    transform = QgsCoordinateTransform(source.crs(), crs, QgsProject.instance())
+    features = list(source.getFeatures())
+    for feature in features:
+        if source.crs() != crs:
+            geometry = QgsGeometry(feature.geometry())
+            geometry.transform(transform)
+            feature.setGeometry(geometry)
+    for copy, (dx, dy) in enumerate(offsets):
+        for feature in features:
+            geometry = QgsGeometry(feature.geometry())
+            geometry.translate(dx, dy)
+            attributes = list(feature.attributes())
+            if attributes_of is not None:
+                attributes = attributes_of(copy, attributes)
+            writer.add(geometry, attributes)
+
+
+def line_id_mapper(network):
+    """
+    每份线路的lineID按metro_line_color_dict轮流分配,
+    同一份中原来相同的线路仍然是同一条线路, 出图时每条线路都有对应的颜色
+    """
+    line_ids = list(utils.metro_line_color_dict.keys())
+    fni, _ = utils.get_field_index_no_case(network, utils.default_field.name_metro_line_id)
+    if fni < 0:
+        raise Exception("线路图层没有lineID字段.")
+    field = network.fields().at(fni)
+    source_ids = sorted({str(feature.attributes()[fni]) for feature in network.getFeatures()})
+    index = {source_id: i for i, source_id in enumerate(source_ids)}
+
+    def mapper(copy, attributes):
+        attributes[fni] = field_value(field, line_ids[(copy * len(source_ids) + index[str(attributes[fni])])
+                                                      % len(line_ids)])
+        return attributes
+
+    return mapper
+
+
+def station_mapper(stations):
+    """
+    复制的站点编号不能与原站点重复: 以id结尾的整数字段(OBJECTID, StationID等)每份偏移原数据的最大值加1,
+    站名字段加上份号
+    """
+    id_fields = [i for i, field in enumerate(stations.fields())
+                 if field.type() in (QVariant.Int, QVariant.LongLong) and field.name().lower().endswith("id")]
+    max_ids = {i: max([int(value) for value in stations.uniqueValues(i) if value is not None] or [0])
+               for i in id_fields}
+    name_index, _ = utils.get_field_index_no_case(stations, utils.default_field.name_metro_station_name)
+
+    def mapper(copy, attributes):
+        if copy == 0:
+            return attributes
+        for i in id_fields:
+            if attributes[i] is not None:
+                attributes[i] = int(attributes[i]) + copy * (max_ids[i] + 1)
+        if name_index >= 0 and attributes[name_index] is not None:
+            attributes[name_index] = "{}{}".format(attributes[name_index], copy + 1)
+        return attributes
+
+    return mapper
+
+
+def generate_pois(writer, count, stations, extent, rng):
+    """按POI_TYPE_WEIGHTS的权重生成各类型POI, 多数聚集在轨道站点周围, 其余均匀分布"""
+    centers = [feature.geometry().asPoint() for feature in stations.getFeatures()
+               if not feature.geometry().isEmpty()]
+    types = list(utils.poi_type_color_dict.keys())
+    weights = [POI_TYPE_WEIGHTS.get(poi_type, 1) for poi_type in types]
+    for i in range(count):
+        if len(centers) > 0 and rng.random() < POI_CLUSTER_RATIO:
+            center = rng.choice(centers)
+            distance = abs(rng.gauss(0, POI_CLUSTER_SIGMA))
+            angle = rng.uniform(0, 2 * math.pi)
+            point = QgsPointXY(center.x() + distance * math.cos(angle), center.y() + distance * math.sin(angle))
+        else:
+            point = random_point(rng, extent)
+        poi_type = rng.choices(types, weights)[0]
+        writer.add(QgsGeometry.fromPointXY(point), [i + 1, f"{poi_type}{i + 1}", poi_type])
+
+
+def poi_fields():
+    fields = QgsFields()
+    fields.append(QgsField("id", QVariant.Int))
+    fields.append(QgsField("name", QVariant.String, len=50))
+    fields.append(QgsField("type", QVariant.String, len=20))
+    return fields
+
+
+def generate(output, scale=10, out_format="gpkg", data_dir=TEST_DATA_DIR, blocks=None, pois=None, seed=2035):
+    """
+    生成数据集
+
+    Args:
+        scale: 倍数, 地块、线路、站点和道路按示例数据的倍数复制, POI为BASE_POI_COUNT的倍数
+        blocks, pois: 指定时覆盖按倍数计算的要素数
+
+    Returns:
+        dict: 写入dataset.json的内容
+    """
+    driver, extension = FORMATS[out_format]
+    rng = random.Random(seed)
+    os.makedirs(output, exist_ok=True)
+
+    source = {role: load_layer(data_dir, file_name) for role, file_name in SOURCE_FILES.items()}
+    crs = source["block"].crs()
+    extent = source["metro_network"].extent()
+    # 复制的线网向四周扩展, 地块和POI分布在扩展后的范围内
+    grow = math.sqrt(scale)
+    city = extent.buffered(max(extent.width(), extent.height()) * (grow - 1) / 2)
+
+    files = {role: f"{role}.{extension}" for role in ("block", "poi", "metro_network", "metro_station",
+                                                      "road_network")}
+    counts = {}
+
+    def writer_for(role, layer):
+        return layer_writer(os.path.join(output, files[role]), driver, layer.fields(), layer.wkbType(), crs)
+
+    writer = writer_for("block", source["block"])
+    generate_blocks(source["block"], writer, blocks or int(source["block"].featureCount() * scale), city, rng)
+    counts["block"] = writer.close()
+
+    # 线路、站点和道路使用相同的平移量, 站点仍然在线路上
+    offsets = copy_offsets(max(1, int(round(scale))), city, rng)
+    for role in ("metro_network", "metro_station", "road_network"):
+        writer = writer_for(role, source[role])
+        mapper = None
+        if role == "metro_network":
+            mapper = line_id_mapper(source[role])
+        elif role == "metro_station":
+            mapper = station_mapper(source[role])
+        replicate(source[role], writer, offsets, crs, mapper)
+        counts[role] = writer.close()
+
+    writer = layer_writer(os.path.join(output, files["poi"]), driver, poi_fields(), QgsWkbTypes.Point, crs)
+    generate_pois(writer, pois or int(BASE_POI_COUNT * scale), load_layer(output, files["metro_station"]), city, rng)
+    counts["poi"] = writer.close()
+
+    dataset = {"scale": scale, "format": out_format, "seed": seed, "files": files, "counts": counts}
+    with open(os.path.join(output, DATASET_NAME), "w", encoding="utf-8") as f:
+        json.dump(dataset, f, ensure_ascii=False, indent=2)
+    return dataset
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="renderUP synthetic dataset generator")
+    parser.add_argument("--scale", type=float, default=10, help="相对示例数据的倍数, 例如10, 100, 1000")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="gpkg", help="输出格式")
+    parser.add_argument("--blocks", type=int, help="地块个数, 默认按倍数计算")
+    parser.add_argument("--pois", type=int, help="POI个数, 默认按倍数计算")
+    parser.add_argument("--seed", type=int, default=2035, help="随机数种子")
+    parser.add_argument("--data", default=TEST_DATA_DIR, help="示例数据目录")
+    parser.add_argument("--output", required=True, help="输出目录")
+    args = parser.parse_args(argv)
+
+    dataset = generate(args.output, args.scale, args.format, args.data, args.blocks, args.pois, args.seed)
+    print(json.dumps(dataset["counts"], ensure_ascii=False), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
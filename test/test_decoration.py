@@ -0,0 +1,87 @@
+# coding=utf-8
+"""Decoration cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import unittest
+
+from qgis.PyQt.QtCore import QSize, Qt
+from qgis.PyQt.QtGui import QColor
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+decoration = importlib.import_module(f"{load_plugin_package()}.core.decoration")
+
+
+class decorationTest(unittest.TestCase):
+    """Test decorations are drawn once per key and evicted least recently used first."""
+
+    def setUp(self):
+        self.cache = decoration.decoration_cache(96, max_entries=2)
+        self.draws = []
+
+    def get(self, key, size=QSize(20, 10)):
+        def draw(painter):
+            self.draws.append(key)
+            painter.fillRect(0, 0, 5, 5, QColor(Qt.red))
+        return self.cache.get(key, size, draw)
+
+    def test_hit(self):
+        """The same key draws once and returns the same image."""
+        image = self.get("a")
+        self.assertIs(self.get("a"), image)
+        self.assertEqual(self.draws, ["a"])
+
+    def test_image(self):
+        """Images are transparent outside the drawing and carry the dpi."""
+        image = self.get("a")
+        self.assertEqual(image.size(), QSize(20, 10))
+        self.assertEqual(image.pixelColor(1, 1), QColor(Qt.red))
+        self.assertEqual(image.pixelColor(15, 8).alpha(), 0)
+        self.assertEqual(image.dotsPerMeterX(), int(round(96 / 0.0254)))
+
+    def test_lazy_size(self):
+        """A callable size is only evaluated on a miss."""
+        sizes = []
+
+        def size():
+            sizes.append(1)
+            return QSize(4, 4)
+
+        self.get("a", size)
+        self.get("a", size)
+        self.assertEqual(len(sizes), 1)
+
+    def test_eviction(self):
+        """The least recently used key is evicted first."""
+        self.get("a")
+        self.get("b")
+        self.get("a")
+        self.get("c")
+        self.assertEqual(list(self.cache.images), ["a", "c"])
+        self.get("b")
+        self.assertEqual(self.draws, ["a", "b", "c", "b"])
+
+    def test_clear(self):
+        self.get("a")
+        self.cache.clear()
+        self.get("a")
+        self.assertEqual(self.draws, ["a", "a"])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(decorationTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,66 @@
+# coding=utf-8
+"""Direct renderer strip geometry test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import unittest
+
+from qgis.core import QgsRectangle
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+PACKAGE = load_plugin_package()
+direct = importlib.import_module(f"{PACKAGE}.core.direct")
+strips = importlib.import_module(f"{PACKAGE}.core.strips")
+
+
+class directTest(unittest.TestCase):
+    """Test strip extents overlap and tile the block extent."""
+
+    def setUp(self):
+        # 1000x800像素, 每像素2个地图单位
+        self.mupp = 2.0
+        self.extent = QgsRectangle(100, 200, 100 + 1000 * self.mupp, 200 + 800 * self.mupp)
+
+    def test_single_strip(self):
+        """Without overlap one strip covering all rows is the whole extent."""
+        extent = direct.strip_extent(self.extent, self.mupp, 0, 800, 0)
+        self.assertEqual(extent, self.extent)
+
+    def test_overlap(self):
+        """Each strip extends overlap rows above and below."""
+        extent = direct.strip_extent(self.extent, self.mupp, 100, 50, 10)
+        self.assertAlmostEqual(extent.yMaximum(), self.extent.yMaximum() - 90 * self.mupp)
+        self.assertAlmostEqual(extent.yMinimum(), self.extent.yMaximum() - 160 * self.mupp)
+        self.assertAlmostEqual(extent.height(), (50 + 2 * 10) * self.mupp)
+        self.assertEqual(extent.xMinimum(), self.extent.xMinimum())
+        self.assertEqual(extent.xMaximum(), self.extent.xMaximum())
+
+    def test_strips_tile_extent(self):
+        """Strips without their overlap rows cover the extent exactly once."""
+        overlap = direct.direct_renderer.strip_overlap
+        rows = strips.strip_rows(1000, 800, 1, overlap)
+        top = self.extent.yMaximum()
+        for y, count in rows:
+            extent = direct.strip_extent(self.extent, self.mupp, y, count, overlap)
+            self.assertAlmostEqual(extent.yMaximum() - overlap * self.mupp, top)
+            top = extent.yMinimum() + overlap * self.mupp
+        self.assertAlmostEqual(top, self.extent.yMinimum())
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(directTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,78 @@
+# coding=utf-8
+"""Legend presence index test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import unittest
+
+from qgis.core import QgsProject, QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY, QgsRectangle, \
+    QgsCategorizedSymbolRenderer, QgsRendererCategory, QgsSymbol, QgsWkbTypes, QgsCoordinateReferenceSystem
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+legend_index = importlib.import_module(f"{load_plugin_package()}.core.legend_index")
+
+
+class legendIndexTest(unittest.TestCase):
+    """Test legend items are found from the features inside an extent."""
+
+    def setUp(self):
+        self.project = QgsProject.instance()
+        self.project.setCrs(QgsCoordinateReferenceSystem("EPSG:3857"))
+        self.layer = QgsVectorLayer("Point?crs=EPSG:3857&field=type:string", "poi", "memory")
+        features = []
+        for x, y, poi_type in [(0, 0, "学校"), (10, 0, "学校"), (100, 100, "医院"), (500, 500, "其他")]:
+            feature = QgsFeature(self.layer.fields())
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            feature.setAttributes([poi_type])
+            features.append(feature)
+        self.layer.dataProvider().addFeatures(features)
+
+        categories = [QgsRendererCategory(value, QgsSymbol.defaultSymbol(QgsWkbTypes.PointGeometry), value)
+                      for value in ("学校", "医院")]
+        self.layer.setRenderer(QgsCategorizedSymbolRenderer("type", categories))
+        self.project.addMapLayer(self.layer)
+        self.keys = {item.label(): item.ruleKey() for item in self.layer.renderer().legendSymbolItems()}
+        self.index = legend_index.legend_presence_index(self.project, {"POI": self.layer.id(), "轨道站点": None})
+
+    def tearDown(self):
+        self.project.removeAllMapLayers()
+
+    def visible(self, xmin, ymin, xmax, ymax):
+        return self.index.visible_keys(QgsRectangle(xmin, ymin, xmax, ymax))[self.layer.id()]
+
+    def test_one_category(self):
+        self.assertEqual(self.visible(-5, -5, 20, 5), {self.keys["学校"]})
+
+    def test_two_categories(self):
+        self.assertEqual(self.visible(-5, -5, 200, 200), {self.keys["学校"], self.keys["医院"]})
+
+    def test_empty(self):
+        """No legend items where there are no features."""
+        self.assertEqual(self.visible(1000, 1000, 2000, 2000), set())
+
+    def test_unstyled_feature(self):
+        """Features outside every category add no legend item."""
+        self.assertEqual(self.visible(400, 400, 600, 600), set())
+
+    def test_missing_layer(self):
+        """Unset or unknown layers are skipped."""
+        self.assertEqual(list(self.index.indexes), [self.layer.id()])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(legendIndexTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,132 @@
+# coding=utf-8
+"""Incremental export manifest test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from qgis.core import QgsFeature, QgsGeometry, QgsPointXY
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+manifest = importlib.import_module(f"{load_plugin_package()}.core.manifest")
+
+
+class manifestTest(unittest.TestCase):
+    """Test blocks are skipped only when unchanged and already exported."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manifest = manifest.export_manifest(self.tmp_dir.name, checkpoint_interval=3600)
+        self.manifest.config = SimpleNamespace(out_format="png")
+        self.manifest.settings = "settings"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def touch_output(self, fea_id):
+        path = os.path.join(self.tmp_dir.name, manifest.output_file(self.manifest.config, fea_id))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"")
+
+    def make_feature(self, fea_id, value="a"):
+        feature = QgsFeature(fea_id)
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(fea_id, 2)))
+        feature.setAttributes([fea_id, value])
+        return feature
+
+    def rescan(self, features):
+        """Scan the blocks again like the next export run, return the fids that need exporting."""
+        self.manifest.block_hashes = {}
+        return [feature.id() for feature in features if self.manifest.check(feature)]
+
+    def test_first_run(self):
+        """Every block needs exporting on the first run."""
+        features = [self.make_feature(fea_id) for fea_id in (1, 2, 3)]
+        self.assertEqual(self.rescan(features), [1, 2, 3])
+
+    def test_done_skipped(self):
+        """Finished blocks with output files are skipped."""
+        features = [self.make_feature(fea_id) for fea_id in (1, 2, 3)]
+        self.rescan(features)
+        for fea_id in (1, 2):
+            self.touch_output(fea_id)
+            self.manifest.done(fea_id)
+        self.assertEqual(self.rescan(features), [3])
+
+    def test_changed_block(self):
+        """A block whose geometry or attributes changed is exported again."""
+        self.rescan([self.make_feature(1)])
+        self.touch_output(1)
+        self.manifest.done(1)
+        self.assertEqual(self.rescan([self.make_feature(1)]), [])
+        self.assertEqual(self.rescan([self.make_feature(1, "changed")]), [1])
+
+    def test_missing_output(self):
+        """A finished block whose output was deleted is exported again."""
+        self.rescan([self.make_feature(2)])
+        self.manifest.done(2)
+        self.assertEqual(self.rescan([self.make_feature(2)]), [2])
+
+    def test_unchanged(self):
+        """unchanged needs the same hash and an existing output file."""
+        self.manifest.blocks = {"1": {"hash": "a", "output": manifest.output_file(self.manifest.config, 1)}}
+        self.assertFalse(self.manifest.unchanged("1", "a"))
+        self.touch_output(1)
+        self.assertTrue(self.manifest.unchanged("1", "a"))
+        self.assertFalse(self.manifest.unchanged("1", "b"))
+        self.assertFalse(self.manifest.unchanged("2", "a"))
+
+    def test_check(self):
+        """check keeps hashes only for blocks that still need exporting."""
+        feature = self.make_feature(4)
+        self.assertTrue(self.manifest.check(feature))
+        self.touch_output(4)
+        self.manifest.done(4)
+
+        self.manifest.block_hashes = {}
+        self.assertFalse(self.manifest.check(feature))
+        self.assertNotIn("4", self.manifest.block_hashes)
+        self.assertTrue(self.manifest.check(self.make_feature(4, "b")))
+        self.assertIn("4", self.manifest.block_hashes)
+
+    def test_unknown_block(self):
+        """done ignores blocks that are not in the layer."""
+        self.manifest.done(9)
+        self.assertNotIn("9", self.manifest.blocks)
+
+    def test_save(self):
+        """close writes the manifest with the settings hash."""
+        feature = self.make_feature(1)
+        self.rescan([feature])
+        self.touch_output(1)
+        self.manifest.done(1)
+        self.manifest.close()
+        with open(os.path.join(self.tmp_dir.name, manifest.MANIFEST_NAME), encoding="utf-8") as f:
+            saved = json.load(f)
+        self.assertEqual(saved["version"], manifest.MANIFEST_VERSION)
+        self.assertEqual(saved["settings"], "settings")
+        self.assertEqual(saved["blocks"]["1"]["hash"], manifest.export_manifest.block_hash(feature))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(manifestTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""Mosaic tile grid test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import unittest
+
+from qgis.core import QgsRectangle
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+mosaic = importlib.import_module(f"{load_plugin_package()}.core.mosaic")
+
+
+class mosaicTest(unittest.TestCase):
+    """Test pixel alignment, tile coverage and tile extents with margins."""
+
+    def test_tile_range(self):
+        self.assertEqual(list(mosaic.tile_range(0, 1024, 1024)), [0])
+        self.assertEqual(list(mosaic.tile_range(1000, 100, 1024)), [0, 1])
+        self.assertEqual(list(mosaic.tile_range(-1, 2, 1024)), [-1, 0])
+        self.assertEqual(list(mosaic.tile_range(-2048, 3000, 1024)), [-2, -1, 0])
+
+    def test_tile_extent(self):
+        """Tiles without margin share edges; the margin grows every side."""
+        mupp = 2.0
+        tile = mosaic.tile_extent(0, 0, 1024, 0, mupp)
+        self.assertEqual((tile.xMinimum(), tile.yMinimum(), tile.xMaximum(), tile.yMaximum()),
+                         (0, -2048, 2048, 0))
+        right = mosaic.tile_extent(1, 0, 1024, 0, mupp)
+        below = mosaic.tile_extent(0, 1, 1024, 0, mupp)
+        self.assertEqual(tile.xMaximum(), right.xMinimum())
+        self.assertEqual(tile.yMinimum(), below.yMaximum())
+
+        with_margin = mosaic.tile_extent(0, 0, 1024, 256, mupp)
+        self.assertEqual(with_margin.width(), (1024 + 2 * 256) * mupp)
+        self.assertEqual(with_margin.height(), (1024 + 2 * 256) * mupp)
+        self.assertEqual(with_margin.center(), tile.center())
+
+    def test_align_extent(self):
+        """Aligned extents start on the pixel grid, keep the output size and move less than a pixel."""
+        mupp = 0.5
+        extent = QgsRectangle(10.3, 20.1, 410.3, 320.1)
+        aligned = mosaic.align_extent(extent, mupp, 800, 600)
+        self.assertAlmostEqual(aligned.xMinimum() / mupp, round(aligned.xMinimum() / mupp))
+        self.assertAlmostEqual(aligned.yMaximum() / mupp, round(aligned.yMaximum() / mupp))
+        self.assertAlmostEqual(aligned.width(), 800 * mupp)
+        self.assertAlmostEqual(aligned.height(), 600 * mupp)
+        self.assertLessEqual(abs(aligned.xMinimum() - extent.xMinimum()), mupp / 2)
+        self.assertLessEqual(abs(aligned.yMaximum() - extent.yMaximum()), mupp / 2)
+
+    def test_block_pixels_match_tiles(self):
+        """The block's top-left pixel falls on the same grid the tiles are rendered on."""
+        mupp = 2.0
+        size = 1024
+        aligned = mosaic.align_extent(QgsRectangle(5000.7, -9000.2, 7000.7, -7000.2), mupp, 1000, 1000)
+        pixel_x = int(round(aligned.xMinimum() / mupp))
+        pixel_y = int(round(-aligned.yMaximum() / mupp))
+        col = list(mosaic.tile_range(pixel_x, 1000, size))[0]
+        row = list(mosaic.tile_range(pixel_y, 1000, size))[0]
+        tile = mosaic.tile_extent(col, row, size, 0, mupp)
+        self.assertAlmostEqual((aligned.xMinimum() - tile.xMinimum()) / mupp, pixel_x - col * size)
+        self.assertAlmostEqual((tile.yMaximum() - aligned.yMaximum()) / mupp, pixel_y - row * size)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(mosaicTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,73 @@
+# coding=utf-8
+"""Hybrid PDF layer split test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import unittest
+from types import SimpleNamespace
+
+from qgis.core import QgsMapLayerType
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+pdf_batch = importlib.import_module(f"{load_plugin_package()}.core.pdf_batch")
+
+
+def layer(name, layer_type):
+    return SimpleNamespace(name=name, type=lambda: layer_type)
+
+
+VECTOR = QgsMapLayerType.VectorLayer
+RASTER = QgsMapLayerType.RasterLayer
+
+
+class pdfBatchTest(unittest.TestCase):
+    """Test only the raster layers below every vector layer go into the underlay image."""
+
+    def names(self, layers):
+        return [item.name for item in layers]
+
+    def test_basemap_at_bottom(self):
+        layers = [layer("站点", VECTOR), layer("线路", VECTOR), layer("影像", RASTER), layer("底图", RASTER)]
+        kept, underlay = pdf_batch.split_underlay_layers(layers)
+        self.assertEqual(self.names(kept), ["站点", "线路"])
+        self.assertEqual(self.names(underlay), ["影像", "底图"])
+
+    def test_raster_between_vectors_stays(self):
+        """A raster layer above a vector layer keeps its place in the map."""
+        layers = [layer("站点", VECTOR), layer("热力", RASTER), layer("地块", VECTOR), layer("底图", RASTER)]
+        kept, underlay = pdf_batch.split_underlay_layers(layers)
+        self.assertEqual(self.names(kept), ["站点", "热力", "地块"])
+        self.assertEqual(self.names(underlay), ["底图"])
+
+    def test_no_raster(self):
+        layers = [layer("站点", VECTOR), layer("地块", VECTOR)]
+        kept, underlay = pdf_batch.split_underlay_layers(layers)
+        self.assertEqual(self.names(kept), ["站点", "地块"])
+        self.assertEqual(underlay, [])
+
+    def test_export_settings(self):
+        """Hybrid mode keeps vectors and simplifies them; otherwise the QGIS defaults are used."""
+        settings = pdf_batch.pdf_export_settings(SimpleNamespace(pdf_hybrid=True, pdf_raster_dpi=150))
+        self.assertFalse(settings.rasterizeWholeImage)
+        self.assertTrue(settings.simplifyGeometries)
+        default = pdf_batch.pdf_export_settings(SimpleNamespace(pdf_hybrid=False, pdf_raster_dpi=150))
+        self.assertEqual(default.simplifyGeometries, type(default)().simplifyGeometries)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(pdfBatchTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
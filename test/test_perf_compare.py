@@ -0,0 +1,84 @@
+# coding=utf-8
+"""Performance regression gate test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import json
+import os
+import tempfile
+import unittest
+
+import perf_compare
+
+
+def result(seconds):
+    return {"seconds": seconds, "peak_rss_mb": 100.0}
+
+
+class perfCompareTest(unittest.TestCase):
+    """Test regressions and missing baselines fail the gate."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        return path
+
+    def statuses(self, rows):
+        return {(row["name"], row["metric"]): row["status"] for row in rows}
+
+    def test_regressed_and_improved(self):
+        baseline = {"results": {"a": result(1.0), "b": result(1.0)}}
+        current = {"results": {"a": result(1.5), "b": result(0.5)}}
+        statuses = self.statuses(perf_compare.compare(baseline, current))
+        self.assertEqual(statuses[("a", "seconds")], "regressed")
+        self.assertEqual(statuses[("b", "seconds")], "improved")
+        self.assertEqual(statuses[("a", "peak_rss_mb")], "ok")
+
+    def test_within_floor(self):
+        """Small absolute changes are not regressions."""
+        statuses = self.statuses(perf_compare.compare({"results": {"a": result(0.01)}},
+                                                      {"results": {"a": result(0.02)}}))
+        self.assertEqual(statuses[("a", "seconds")], "ok")
+
+    def test_missing_baseline(self):
+        """Tests without a baseline fail unless new tests are allowed."""
+        current = {"results": {"a": result(1.0)}}
+        self.assertEqual(self.statuses(perf_compare.compare({}, current))[("a", "")], "missing")
+        self.assertEqual(self.statuses(perf_compare.compare({}, current, allow_new=True))[("a", "")], "new")
+
+    def test_main_empty_baseline(self):
+        """An empty baseline fails the gate."""
+        baseline = self.write("baseline.json", {"results": {}})
+        current = self.write("current.json", {"results": {"a": result(1.0)}})
+        self.assertEqual(perf_compare.main([current, "--baseline", baseline]), 1)
+        self.assertEqual(perf_compare.main([current, "--baseline", baseline, "--allow-new"]), 0)
+
+    def test_update(self):
+        """Updating keeps per-test tolerances."""
+        baseline = {"results": {"a": dict(result(1.0), tolerance={"seconds": 0.5})}}
+        perf_compare.update_baseline(baseline, {"results": {"a": result(2.0)}, "meta": {"platform": "x"}})
+        self.assertEqual(baseline["results"]["a"]["seconds"], 2.0)
+        self.assertEqual(baseline["results"]["a"]["tolerance"], {"seconds": 0.5})
+        self.assertEqual(baseline["meta"], {"platform": "x"})
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(perfCompareTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
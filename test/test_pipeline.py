@@ -0,0 +1,95 @@
+# coding=utf-8
+"""Image encoder options and writer errors test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import unittest
+
+from PyQt5.QtGui import QImage
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+pipeline = importlib.import_module(f"{load_plugin_package()}.core.pipeline")
+
+
+class failing_writer:
+    """写出路径在failing中时抛出异常, 其余图片只记录路径"""
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.written = []
+
+    def __call__(self, image, path, out_format):
+        if path in self.failing:
+            raise Exception("写盘失败")
+        self.written.append(path)
+
+
+def qt_png_level(quality):
+    """Qt的PNG插件由quality换算压缩级别的公式"""
+    return (100 - min(quality, 100)) * 9 // 91
+
+
+class pipelineTest(unittest.TestCase):
+    """Test PNG compression levels map to the Qt quality and write errors are reported per block."""
+
+    def test_png_quality_levels(self):
+        """Every compression level 0-9 round trips through the Qt formula."""
+        for level in range(10):
+            self.assertEqual(qt_png_level(pipeline.png_quality(level)), level)
+
+    def test_png_quality_clamped(self):
+        """Levels outside 0-9 are clamped."""
+        self.assertEqual(pipeline.png_quality(-1), 100)
+        self.assertEqual(qt_png_level(pipeline.png_quality(12)), 9)
+
+    def test_write_error_reported_once(self):
+        """A failed write is drained once with its fid and later blocks still get written."""
+        writer = pipeline.image_writer(workers=2)
+        writer.write = failing_writer({"2.png"})
+        image = QImage(4, 4, QImage.Format_ARGB32)
+        for fea_id in range(1, 5):
+            writer.submit(image, f"{fea_id}.png", "png", fea_id)
+        writer.close()
+
+        results = dict(writer.drain())
+        self.assertEqual(sorted(results), [1, 2, 3, 4])
+        self.assertIn("写盘失败", results[2])
+        self.assertEqual([fea_id for fea_id, error in results.items() if error is None], [1, 3, 4])
+        self.assertEqual(sorted(writer.write.written), ["1.png", "3.png", "4.png"])
+        self.assertEqual(writer.drain(), [])
+
+    def test_pending_until_written(self):
+        """Submitted blocks stay pending until the encoder thread finishes them."""
+        writer = pipeline.image_writer(workers=1)
+        writer.write = failing_writer(set())
+        writer.submit(QImage(4, 4, QImage.Format_ARGB32), "1.png", "png", 1)
+        writer.close()
+        self.assertFalse(writer.is_pending(1))
+        self.assertEqual(writer.drain(), [(1, None)])
+
+    def test_sync_write_raises(self):
+        """Without encoder threads the error is raised to the render thread."""
+        writer = pipeline.image_writer(workers=0)
+        writer.write = failing_writer({"1.png"})
+        with self.assertRaises(Exception):
+            writer.submit(QImage(4, 4, QImage.Format_ARGB32), "1.png", "png", 1)
+        self.assertEqual(writer.drain(), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(pipelineTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,57 @@
+# coding=utf-8
+"""Per-block project file test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import unittest
+import xml.etree.ElementTree as ET
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+project_files = importlib.import_module(f"{load_plugin_package()}.core.project_files")
+
+PROJECT_XML = b"""<qgis>
+  <projectlayers>
+    <maplayer><id>blocks_1</id><datasource>./blocks.shp|layername=blocks</datasource><provider>ogr</provider></maplayer>
+    <maplayer><id>poi_1</id><datasource>./poi.shp</datasource><provider>ogr</provider></maplayer>
+  </projectlayers>
+</qgis>"""
+
+
+class projectFilesTest(unittest.TestCase):
+    """Test the fid filter is written into the project XML only."""
+
+    def datasources(self, xml):
+        return {maplayer.findtext("id"): maplayer.findtext("datasource")
+                for maplayer in ET.fromstring(xml).iter("maplayer")}
+
+    def test_block_subset(self):
+        """Only the block layer gets the fid filter."""
+        xml = project_files.patch_block_layer_xml(PROJECT_XML, {"block_layer": "blocks_1", "subset": "fid=7"})
+        sources = self.datasources(xml)
+        self.assertIn("subset=fid=7", sources["blocks_1"])
+        self.assertIn("blocks.shp", sources["blocks_1"])
+        self.assertEqual(sources["poi_1"], "./poi.shp")
+
+    def test_no_block_layer(self):
+        """Without a block layer the XML is unchanged."""
+        xml = project_files.patch_block_layer_xml(PROJECT_XML, {})
+        self.assertEqual(self.datasources(xml), self.datasources(PROJECT_XML))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(projectFilesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
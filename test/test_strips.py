@@ -0,0 +1,76 @@
+# coding=utf-8
+"""Strip rendering split test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+strips = importlib.import_module(f"{load_plugin_package()}.core.strips")
+
+MB = 1024 * 1024
+
+
+class stripsTest(unittest.TestCase):
+    """Test strips cover the image and every buffer fits the memory cap."""
+
+    def assert_strips(self, width, height, max_mb, overlap):
+        result = strips.strip_rows(width, height, max_mb, overlap)
+        self.assertEqual(result[0][0], 0)
+        for (y, rows), (next_y, _) in zip(result, result[1:]):
+            self.assertEqual(y + rows, next_y)
+        self.assertEqual(sum(rows for _, rows in result), height)
+        for _, rows in result:
+            self.assertLessEqual(width * 4 * (rows + 2 * overlap), max_mb * MB)
+        return result
+
+    def test_fits(self):
+        """No strips when the whole image fits."""
+        self.assertIsNone(strips.strip_rows(1024, 256, 1))
+
+    def test_no_overlap(self):
+        """Each strip holds exactly the budget."""
+        result = self.assert_strips(1024, 1000, 1, 0)
+        self.assertEqual(result[0], (0, 256))
+
+    def test_overlap_in_budget(self):
+        """Overlap rows come out of the budget."""
+        result = self.assert_strips(1024, 1000, 1, 28)
+        self.assertEqual(result[0], (0, 200))
+
+    def test_cap_too_small(self):
+        """A cap that cannot hold one row plus overlap is an error."""
+        self.assert_strips(1024, 1000, 1, 127)
+        with self.assertRaises(Exception):
+            strips.strip_rows(1024, 1000, 1, 128)
+
+    def test_palette_rejected(self):
+        """Palette PNG cannot be streamed in strips, nothing is written."""
+        out_dir = tempfile.mkdtemp()
+        path = os.path.join(out_dir, "png", "out_1.png")
+        with self.assertRaises(Exception):
+            strips.open_strip_writer(path, "png", 16, 16, {"png_palette": True})
+        self.assertFalse(os.path.exists(path + ".tmp"))
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(stripsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,71 @@
+# coding=utf-8
+"""Export status telemetry test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import json
+import os
+import tempfile
+import unittest
+
+from core.telemetry import export_telemetry, format_duration, STATUS_NAME
+
+
+class telemetryTest(unittest.TestCase):
+    """Test counts, eta and the status file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.telemetry = export_telemetry(10, self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_counts(self):
+        """Done, failed and missing blocks are counted separately."""
+        self.telemetry.block_done(1)
+        self.telemetry.block_done(2)
+        self.telemetry.block_failed(3)
+        self.telemetry.block_missing(4)
+        status = self.telemetry.status()
+        self.assertEqual((status["done"], status["errors"], status["missing"]), (2, 1, 1))
+        self.assertEqual(status["current_fid"], 3)
+        self.assertIn("错误1", self.telemetry.text())
+
+    def test_eta(self):
+        """No eta before the first block; failed blocks are not remaining work."""
+        self.assertIsNone(self.telemetry.eta())
+        self.telemetry.start_time -= 60
+        for fea_id in range(5):
+            self.telemetry.block_done(fea_id)
+        self.telemetry.block_failed(5)
+        self.assertAlmostEqual(self.telemetry.eta(), 4 * 60 / self.telemetry.rate(), places=2)
+
+    def test_write_status(self):
+        """The status file is written atomically with the final state."""
+        self.telemetry.block_done(1)
+        self.telemetry.write_status("finished", force=True)
+        with open(os.path.join(self.tmp_dir.name, STATUS_NAME), encoding="utf-8") as f:
+            status = json.load(f)
+        self.assertEqual(status["state"], "finished")
+        self.assertEqual(status["done"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, STATUS_NAME + ".tmp")))
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(65), "1:05")
+        self.assertEqual(format_duration(3725), "1:02:05")
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(telemetryTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
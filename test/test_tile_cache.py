@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Tile prefetch test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import os
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+tile_cache = importlib.import_module(f"{load_plugin_package()}.core.tile_cache")
+
+
+class tile_handler(BaseHTTPRequestHandler):
+    """本地瓦片服务, 返回内容为瓦片路径, 以4开头的列号返回404"""
+
+    requests_seen = []
+
+    def do_GET(self):
+        tile_handler.requests_seen.append(self.path)
+        z, x, y = self.path.strip("/").split(".")[0].split("/")
+        if x.startswith("4"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = f"{z}/{x}/{y}".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class tileCacheTest(unittest.TestCase):
+    """Test tiles are prefetched into MBTiles."""
+
+    def setUp(self):
+        tile_handler.requests_seen = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), tile_handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}.png".format(self.server.server_address[1])
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_zoom_for_resolution(self):
+        """Zoom level matches the map resolution."""
+        self.assertEqual(tile_cache.zoom_for_resolution(156543.03392804097 / 2 ** 15), 15)
+        self.assertEqual(tile_cache.zoom_for_resolution(0.01, zmax=18), 18)
+
+    def test_tiles_for_extent(self):
+        """Tiles cover the extent in XYZ order."""
+        xmin, ymin, xmax, ymax = tile_cache.tile_bounds(10, 300, 200)
+        tiles = tile_cache.tiles_for_extent((xmin + 1, ymin + 1, xmax + 10, ymax - 1), 10)
+        self.assertEqual(sorted(tiles), [(10, 300, 200), (10, 301, 200)])
+
+    def test_download_tiles(self):
+        """Tiles are downloaded once and stored with TMS rows."""
+        tiles = [(12, 3330, 1780), (12, 3331, 1780), (12, 3330, 1781), (12, 4000, 1780)]
+        store = tile_cache.mbtiles_store(os.path.join(self.tmp_dir.name, "cache.mbtiles"))
+        try:
+            downloaded, failed, tile_format = tile_cache.download_tiles(self.url, tiles, store, workers=4, retries=0)
+            store.update_metadata("test", tile_format)
+
+            self.assertEqual(failed, 1)
+            self.assertEqual(downloaded, len(tiles) - 1)
+            self.assertEqual(store.get(12, 3330, 1780), b"12/3330/1780")
+            row = store.conn.execute("SELECT tile_data FROM tiles WHERE tile_column=3330 AND tile_row=?",
+                                     ((1 << 12) - 1 - 1780,)).fetchone()
+            self.assertEqual(row[0], b"12/3330/1780")
+            self.assertEqual(store.existing(12), {t for t in tiles if t[1] != 4000})
+
+            metadata = store.metadata()
+            self.assertEqual(metadata["format"], "png")
+            self.assertEqual(metadata["maxzoom"], "12")
+        finally:
+            store.close()
+
+    def prefetcher(self):
+        """Prefetcher for one XYZ layer served by the local tile server."""
+        layer = SimpleNamespace(id=lambda: "xyz", name=lambda: "底图")
+        source = {"url": self.url, "zmin": 12, "zmax": 12, "headers": {}}
+        prefetcher = tile_cache.tile_prefetcher(None, SimpleNamespace(out_width=256, tile_workers=2),
+                                                os.path.join(self.tmp_dir.name, "cache"))
+        prefetcher.xyz_layers = lambda: [(layer, source)]
+        return prefetcher
+
+    def test_prefetch_complete(self):
+        """The cache replaces the layer when every tile was downloaded."""
+        cache = self.prefetcher().prefetch([tile_cache.tile_bounds(12, 3330, 1780)])
+        self.assertEqual(list(cache), ["xyz"])
+        self.assertTrue(os.path.exists(cache["xyz"]))
+
+    def test_prefetch_failed_tiles(self):
+        """A layer with failed tiles keeps the live XYZ layer."""
+        bounds = tile_cache.tile_bounds(12, 4000, 1780)
+        cache = self.prefetcher().prefetch([(bounds[0] + 1, bounds[1] + 1, bounds[2] - 1, bounds[3] - 1)])
+        self.assertEqual(cache, {})
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(tileCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,68 @@
+# coding=utf-8
+"""Stage timing statistics test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib
+import time
+import unittest
+
+from utilities import get_qgis_app
+from core.worker import load_plugin_package
+
+QGIS_APP = get_qgis_app()
+timing = importlib.import_module(f"{load_plugin_package()}.core.timing")
+
+
+class timingTest(unittest.TestCase):
+    """Test nearest-rank percentiles and time excluded from the block total."""
+
+    def test_percentile_empty(self):
+        """Empty input gives 0."""
+        self.assertEqual(timing.percentile([], 95), 0.0)
+
+    def test_percentile_nearest_rank(self):
+        """The p-th percentile is the ceil(p/100*n)-th smallest value."""
+        values = list(range(1, 11))
+        self.assertEqual(timing.percentile(values, 0), 1)
+        self.assertEqual(timing.percentile(values, 10), 1)
+        self.assertEqual(timing.percentile(values, 50), 5)
+        self.assertEqual(timing.percentile(values, 90), 9)
+        self.assertEqual(timing.percentile(values, 95), 10)
+        self.assertEqual(timing.percentile(values, 100), 10)
+
+    def test_percentile_small(self):
+        """With 20 values p95 is the 19th, not the maximum."""
+        values = list(range(1, 21))
+        self.assertEqual(timing.percentile(values, 95), 19)
+        self.assertEqual(timing.percentile([3.0], 50), 3.0)
+
+    def test_excluded_not_in_block(self):
+        """Excluded work is reported as a batch stage and left out of the block total and its stage."""
+        timer = timing.stage_timer()
+        timer.begin(1)
+        with timer.stage("update"):
+            with timer.excluded("layer_sample"):
+                time.sleep(0.05)
+        timer.end()
+
+        record = timer.records()["1"]
+        self.assertLess(record["total"], 0.04)
+        self.assertLess(record["stages"]["update"], 0.04)
+        self.assertGreaterEqual(timer.batch["layer_sample"], 0.05)
+        self.assertNotIn("layer_sample", timer.report()["stages"])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(timingTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
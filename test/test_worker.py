@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Parallel export shard test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'zou_mono@sina.com'
+__date__ = '2023-12-28'
+__copyright__ = 'Copyright 2023, mono zou'
+
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from core.worker import split_shards, python_executable, worker_environment
+
+HAS_QGIS = importlib.util.find_spec("qgis") is not None
+
+
+class workerTest(unittest.TestCase):
+    """Test fids are split into contiguous shards."""
+
+    def test_split_even(self):
+        """Shards keep order and differ in size by at most one."""
+        shards = split_shards(list(range(10)), 3)
+        self.assertEqual(shards, [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+
+    def test_split_more_workers_than_fids(self):
+        """No empty shards when there are fewer fids than workers."""
+        self.assertEqual(split_shards([5, 7], 4), [[5], [7]])
+
+    def test_split_single(self):
+        """At least one shard."""
+        self.assertEqual(split_shards([1, 2, 3], 0), [[1, 2, 3]])
+
+
+    def test_environment_passes_sys_path(self):
+        """Directories added to sys.path at runtime are importable in the worker."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "renderup_runtime_module.py"), "w") as f:
+                f.write("VALUE = 1\n")
+            sys.path.append(tmp_dir)
+            try:
+                env = worker_environment()
+            finally:
+                sys.path.remove(tmp_dir)
+            result = subprocess.run([python_executable(), "-c", "import renderup_runtime_module"], env=env,
+                                    capture_output=True)
+        self.assertEqual(result.returncode, 0, result.stderr.decode(errors="replace"))
+        self.assertEqual(env["QT_QPA_PLATFORM"], "offscreen")
+
+    @unittest.skipUnless(HAS_QGIS, "qgis is not importable")
+    def test_worker_imports_qgis(self):
+        """The worker interpreter can import qgis with the worker environment."""
+        from qgis.core import QgsApplication
+        env = worker_environment(QgsApplication.prefixPath())
+        result = subprocess.run([python_executable(), "-c", "from qgis.core import QgsApplication, QgsProject"],
+                                env=env, capture_output=True)
+        self.assertEqual(result.returncode, 0, result.stderr.decode(errors="replace"))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(workerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
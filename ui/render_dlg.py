@@ -38,8 +38,9 @@ from qgis._core import QgsMessageLog, Qgis, QgsProject, QgsMapLayerType, QgsWkbT
 from qgis._gui import QgisInterface
 
 from .render_dlg_style import Ui_renderUPDialogBase
+from ..core.profiling import profile_call
 from ..utils import get_field_index_no_case, default_field, metro_line_color_dict, PluginDir, poi_type_color_dict, \
-    get_qset_name, PLUGIN_NAME, check_crs, MESSAGE_TAG, get_default_font, PluginConfig, DefaultFont, default_label_size, \
+    get_qset_name, PLUGIN_NAME, check_crs, ExportDir, MESSAGE_TAG, get_default_font, PluginConfig, DefaultFont, default_label_size, \
     default_diag, default_metro_station_size, default_poi_size, default_block_outline_width, default_metro_network_width
 
 log = logging.getLogger('QGIS')
@@ -276,6 +277,14 @@ class renderDialog(QtWidgets.QDialog, Ui_renderUPDialogBase):
         self.qset.setValue(get_qset_name("image_layer_id"), self.current_image_layer_id)
 
     def btn_default_clicked(self):
+        # 开启剖析时一键符号化也写出剖析结果, 与出图的剖析结果放在一起
+        sample_ms = self.qset.value(get_qset_name("profile_sample_ms"), 0, type=int)
+        enabled = self.qset.value(get_qset_name("profile_every"), 0, type=int) > 0 or sample_ms > 0
+        out_path = self.qset.value(get_qset_name("out_path")) or ExportDir
+        with profile_call(out_path, "styling", enabled, sample_ms if sample_ms > 0 else 5):
+            self.apply_default_styles()
+
+    def apply_default_styles(self):
         layer_image_id = self.cmb_image_layer.itemData(self.cmb_image_layer.currentIndex())
         layer_metro_network_id = self.cmb_metro_network_layer.itemData(self.cmb_metro_network_layer.currentIndex())
         layer_metro_station_id = self.cmb_metro_station_layer.itemData(self.cmb_metro_station_layer.currentIndex())
@@ -34,7 +34,7 @@ from qgis._core import QgsMessageLog, Qgis, QgsProject, QgsMapLayerType, QgsWkbT
 
 from .setting_style import Ui_SettingDialog
 from ..utils import PluginConfig, get_qset_name, tianditu_map_url, check_subdomains, check_key_format, PLUGIN_NAME, \
-    check_url_status
+    check_url_status, ENCODER_PRESETS
 
 log = logging.getLogger('QGIS')
 
@@ -54,7 +54,7 @@ class SettingDialog(QtWidgets.QDialog, Ui_SettingDialog):
         # http://qt-project.org/doc/qt-4.8/designer-using-a-ui-file.html
         # #widgets-and-dialogs-with-auto-connect
         self.setupUi(self)
-        self.setFixedSize(QSize(480, 300))
+        self.setFixedSize(QSize(480, 360))
 
         self.project: QgsProject = project
 
@@ -75,7 +75,10 @@ class SettingDialog(QtWidgets.QDialog, Ui_SettingDialog):
             out_width=self.qset.value(get_qset_name("out_width"), type=int),
             out_height=self.qset.value(get_qset_name("out_height"), type=int),
             out_resolution=self.qset.value(get_qset_name("out_resolution"), type=int),
-            out_format=self.qset.value(get_qset_name("out_format"))
+            out_format=self.qset.value(get_qset_name("out_format")),
+            encoder_preset=self.qset.value(get_qset_name("encoder_preset"), "balanced", type=str),
+            png_palette=self.qset.value(get_qset_name("png_palette"), False, type=bool),
+            webp_quality=self.qset.value(get_qset_name("webp_quality"), 100, type=int)
         )
 
         self.mLineEdit_key.setText(self.config.key)
@@ -100,9 +103,20 @@ class SettingDialog(QtWidgets.QDialog, Ui_SettingDialog):
         self.txt_height.setText(str(self.config.out_height))
         self.txt_resolution.setText(str(self.config.out_resolution))
 
-        self.cmb_format.addItems(['png', 'jpg', 'pdf', 'bmp', 'tif', 'pdf'])
+        self.cmb_format.addItems(['png', 'jpg', 'pdf', 'bmp', 'tif', 'webp'])
         self.cmb_format.setCurrentText('png')
 
+        # 编码预设决定各格式的压缩参数
+        self.cmb_encoder_preset.addItem("快速", "fast")
+        self.cmb_encoder_preset.addItem("均衡", "balanced")
+        self.cmb_encoder_preset.addItem("最小文件", "small")
+        index = self.cmb_encoder_preset.findData(self.config.encoder_preset)
+        self.cmb_encoder_preset.setCurrentIndex(index if index >= 0 else 1)
+        # PNG调色板和WebP质量可以在预设的基础上单独调整, 切换预设时改为预设的值
+        self.set_encoder_options(self.config.png_palette, self.config.webp_quality)
+        self.cmb_encoder_preset.currentIndexChanged.connect(self.on_encoder_preset_changed)
+        self.chk_webp_lossless.toggled.connect(lambda checked: self.spin_webp_quality.setEnabled(not checked))
+
         self.pushButton.clicked.connect(self.check)
 
         self.ping_thread = PingUrlThread(self.config.key)
@@ -116,6 +130,15 @@ class SettingDialog(QtWidgets.QDialog, Ui_SettingDialog):
         self.qset.setValue(f"{PLUGIN_NAME}/settings/out_height", int(self.txt_height.text()))
         self.qset.setValue(f"{PLUGIN_NAME}/settings/out_resolution", int(self.txt_resolution.text()))
         self.qset.setValue(f"{PLUGIN_NAME}/settings/out_format", self.cmb_format.currentText())
+
+        preset = self.cmb_encoder_preset.currentData()
+        if preset != self.config.encoder_preset:
+            self.qset.setValue(get_qset_name("encoder_preset"), preset)
+            for key, value in ENCODER_PRESETS[preset].items():
+                self.qset.setValue(get_qset_name(key), value)
+        self.qset.setValue(get_qset_name("png_palette"), self.chk_png_palette.isChecked())
+        webp_quality = 100 if self.chk_webp_lossless.isChecked() else self.spin_webp_quality.value()
+        self.qset.setValue(get_qset_name("webp_quality"), webp_quality)
         # self.qset.setValue(f"{PLUGIN_NAME}/settings/out_path", self.mlineEdit_outpath.text())
 
         path = pathlib.Path(self.qset.value(get_qset_name("out_path")))
@@ -124,7 +147,22 @@ class SettingDialog(QtWidgets.QDialog, Ui_SettingDialog):
 
         super(SettingDialog, self).close()
 
-    #  选择输出目录
+    def set_encoder_options(self, png_palette, webp_quality):
+        """WebP质量100为无损, 有损时质量为0-99"""
+        self.chk_png_palette.setChecked(png_palette)
+        lossless = webp_quality >= 100
+        self.chk_webp_lossless.setChecked(lossless)
+        self.spin_webp_quality.setEnabled(not lossless)
+        if not lossless:
+            self.spin_webp_quality.setValue(webp_quality)
+        elif self.spin_webp_quality.value() == 0:
+            self.spin_webp_quality.setValue(90)
+
+    def on_encoder_preset_changed(self):
+        options = ENCODER_PRESETS[self.cmb_encoder_preset.currentData()]
+        self.set_encoder_options(options["png_palette"], options["webp_quality"])
+
+        #  选择输出目录
     def btn_selectfile_clicked(self):
         lastpath = self.qset.value(get_qset_name("lastpath"))
 
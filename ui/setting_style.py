@@ -14,7 +14,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_SettingDialog(object):
     def setupUi(self, SettingDialog):
         SettingDialog.setObjectName("SettingDialog")
-        SettingDialog.resize(467, 268)
+        SettingDialog.resize(467, 298)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Preferred)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -173,6 +173,46 @@ class Ui_SettingDialog(object):
         self.horizontalLayout_8.addItem(spacerItem4)
         self.horizontalLayout_10.addLayout(self.horizontalLayout_8)
         self.verticalLayout_3.addLayout(self.horizontalLayout_10)
+        self.horizontalLayout_12 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_12.setObjectName("horizontalLayout_12")
+        self.label_9 = QtWidgets.QLabel(self.groupBox_2)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.label_9.sizePolicy().hasHeightForWidth())
+        self.label_9.setSizePolicy(sizePolicy)
+        self.label_9.setObjectName("label_9")
+        self.horizontalLayout_12.addWidget(self.label_9)
+        self.cmb_encoder_preset = QtWidgets.QComboBox(self.groupBox_2)
+        self.cmb_encoder_preset.setObjectName("cmb_encoder_preset")
+        self.horizontalLayout_12.addWidget(self.cmb_encoder_preset)
+        spacerItem5 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_12.addItem(spacerItem5)
+        self.verticalLayout_3.addLayout(self.horizontalLayout_12)
+        self.horizontalLayout_13 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_13.setObjectName("horizontalLayout_13")
+        self.chk_png_palette = QtWidgets.QCheckBox(self.groupBox_2)
+        self.chk_png_palette.setObjectName("chk_png_palette")
+        self.horizontalLayout_13.addWidget(self.chk_png_palette)
+        self.label_10 = QtWidgets.QLabel(self.groupBox_2)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.label_10.sizePolicy().hasHeightForWidth())
+        self.label_10.setSizePolicy(sizePolicy)
+        self.label_10.setObjectName("label_10")
+        self.horizontalLayout_13.addWidget(self.label_10)
+        self.spin_webp_quality = QtWidgets.QSpinBox(self.groupBox_2)
+        self.spin_webp_quality.setMinimum(0)
+        self.spin_webp_quality.setMaximum(99)
+        self.spin_webp_quality.setObjectName("spin_webp_quality")
+        self.horizontalLayout_13.addWidget(self.spin_webp_quality)
+        self.chk_webp_lossless = QtWidgets.QCheckBox(self.groupBox_2)
+        self.chk_webp_lossless.setObjectName("chk_webp_lossless")
+        self.horizontalLayout_13.addWidget(self.chk_webp_lossless)
+        spacerItem6 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_13.addItem(spacerItem6)
+        self.verticalLayout_3.addLayout(self.horizontalLayout_13)
         self.verticalLayout.addWidget(self.groupBox_2)
         self.horizontalLayout_11.addLayout(self.verticalLayout)
 
@@ -195,5 +235,10 @@ class Ui_SettingDialog(object):
         self.label_6.setText(_translate("SettingDialog", "图片高度(像素):"))
         self.label_7.setText(_translate("SettingDialog", "图片分辨率(dpi):"))
         self.label_8.setText(_translate("SettingDialog", "图片格式:"))
+        self.label_9.setText(_translate("SettingDialog", "编码预设:"))
+        self.chk_png_palette.setToolTip(_translate("SettingDialog", "PNG量化为256色调色板图片, 适合色块为主的专题图, 不能与分条写出同时使用"))
+        self.chk_png_palette.setText(_translate("SettingDialog", "PNG调色板"))
+        self.label_10.setText(_translate("SettingDialog", "WebP质量:"))
+        self.chk_webp_lossless.setText(_translate("SettingDialog", "无损"))
 from qgspasswordlineedit import QgsPasswordLineEdit
 from .. import resources_rc
@@ -121,6 +121,17 @@ with open(EXTRAMAPS_PATH, encoding="utf-8") as f:
     extra_maps = yaml.load(f, Loader=yaml.FullLoader)
 
 
+# 图片编码预设: fast编码最快, balanced兼顾速度和大小, small文件最小
+ENCODER_PRESETS = {
+    "fast": {"png_compression": 1, "png_palette": False, "jpg_quality": 85, "jpg_progressive": False,
+             "webp_quality": 85, "tif_compress": "NONE"},
+    "balanced": {"png_compression": 4, "png_palette": False, "jpg_quality": 90, "jpg_progressive": False,
+                 "webp_quality": 100, "tif_compress": "LZW"},
+    "small": {"png_compression": 9, "png_palette": False, "jpg_quality": 80, "jpg_progressive": True,
+              "webp_quality": 75, "tif_compress": "DEFLATE"}
+}
+
+
 class single_window:
     m_frmRender = None  # 器窗口只能打开一个
     m_frmSetting = None
@@ -143,6 +154,33 @@ class PluginConfig:
     draw_scalebar: int = 2
     draw_legend: int = 2
     radius: float = 0.0
+    export_workers: int = 1  # 大于1时启用多进程并行导出
+    layout_template: bool = True  # 整批复用同一个版面, 不再逐个地块重建
+    project_files: str = "full"  # 地块工程文件: full, none, sidecar, qgz
+    export_engine: str = "layout"  # 导出引擎: layout, atlas, direct, mosaic
+    decoration_cache: bool = True  # direct引擎中预先栅格化指北针、比例尺和图例
+    legend_index: bool = True  # 用空间索引确定图例项, 代替按地图过滤图例
+    tile_prefetch: bool = False  # 出图前把底图瓦片预取到本地MBTiles, 出图时用缓存代替在线底图
+    tile_workers: int = 8  # 预取瓦片的并发下载数
+    mosaic_poi: bool = False  # mosaic引擎中POI图层也渲染到拼接底图
+    incremental: bool = False  # 按清单文件只导出变化或者没有完成的地块
+    encode_workers: int = 2  # 图片编码写盘的线程数, 0表示在渲染线程中同步写出
+    pdf_single: bool = False  # pdf格式时所有地块输出为一个多页PDF
+    pdf_hybrid: bool = False  # PDF中底部的栅格图层按pdf_raster_dpi渲染成图片, 其余图层、标注和装饰元素保持矢量
+    pdf_raster_dpi: int = 150  # 混合PDF中栅格底图的分辨率
+    encoder_preset: str = "balanced"  # 图片编码预设: fast, balanced, small, 选择后写入下面的编码参数
+    png_compression: int = 4  # PNG压缩级别0-9
+    png_palette: bool = False  # PNG用Pillow量化为8位调色板图片, 适合色块为主的专题图
+    jpg_quality: int = 90  # JPEG质量0-100
+    jpg_progressive: bool = False  # JPEG渐进式编码
+    webp_quality: int = 100  # WebP质量0-100, 100为无损
+    tif_compress: str = "LZW"  # TIFF压缩方式: NONE, LZW, DEFLATE, 分块写出
+    strip_memory_mb: int = 512  # 单张输出图片的内存上限(MB), 超过时png和tif按条带渲染并流式写出
+    layer_timing_every: int = 0  # 每隔多少个地块把各图层单独渲染一次, 抽样统计各图层的渲染耗时, 0为不统计
+    profile_every: int = 0  # 每隔多少个地块用cProfile剖析一个地块, 0为不剖析
+    profile_sample_ms: int = 0  # 调用栈采样间隔(毫秒), 输出火焰图用的折叠栈文件, 0为不采样
+    memory_warn_kb: int = 512  # 每个地块内存增长超过该值(KB)时警告
+    cleanup_every: int = 0  # 每隔多少个地块释放复用的版面和缓存并回收垃圾, 0为不清理
 
 
 def get_default_font():
@@ -179,6 +217,13 @@ def get_qset_name(key: str) -> str:
                       "metro_station_layer_id", "road_network_layer_id"]
     section_settings = ["lastpath", "out_path", "out_width", "out_height", "out_resolution", "out_format"]
     section_render = ["draw_northarrow", "draw_scalebar", "draw_legend", "draw_circle", "radius"]
+    section_export = ["export_workers", "layout_template", "project_files", "export_engine",
+                      "decoration_cache", "legend_index", "tile_prefetch", "tile_workers",
+                      "mosaic_poi", "incremental", "encode_workers", "pdf_single", "pdf_hybrid",
+                      "pdf_raster_dpi", "encoder_preset",
+                      "png_compression", "png_palette", "jpg_quality", "jpg_progressive", "webp_quality",
+                      "tif_compress", "strip_memory_mb", "layer_timing_every",
+                      "profile_every", "profile_sample_ms", "memory_warn_kb", "cleanup_every"]
     if key in section_tianditu:
         return f"{PLUGIN_NAME}/tianditu/{key}"
     if key in section_layers:
@@ -187,6 +232,8 @@ def get_qset_name(key: str) -> str:
         return f"{PLUGIN_NAME}/settings/{key}"
     if key in section_render:
         return f"{PLUGIN_NAME}/render/{key}"
+    if key in section_export:
+        return f"{PLUGIN_NAME}/export/{key}"
     return ""
 
 